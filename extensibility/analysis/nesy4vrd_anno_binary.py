@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: David Herron
+"""
+
+'''
+This module defines a compact binary file format for the NeSy4VRD visual
+relationship annotations of the VRD images, along with functions for
+writing and loading files in that format.
+
+A binary annotations file holds exactly the same information as a .json
+annotations file (as written by function
+write_customised_annotations_to_file() of the NeSy4VRD workflow), laid
+out as follows:
+    magic    : 8 bytes, b'NSY4VRDB'
+    length   : 8 bytes, little-endian uint64 (length of the header)
+    header   : JSON text (utf-8), padded with spaces to an 8-byte boundary
+    sections : the data sections described in the header, each starting
+               on an 8-byte boundary
+
+The header records the format version, the number of images and of
+visual relationships (VRs), the NeSy4VRD object class names and
+predicate names (if supplied when the file was written), the position
+and size of each data section, and a SHA-256 checksum of the data
+sections. The data sections are:
+    offsets      : int64, shape (n_images+1,); the VRs of image i are
+                   records offsets[i] to offsets[i+1]
+    records      : int32, shape (n_vrs, 11); one fixed-width record per
+                   VR, with fields: 'subject' class, predicate, 'object'
+                   class, 'subject' bbox (4), 'object' bbox (4)
+    name_offsets : int64, shape (n_images+1,); the name of image i is
+                   names[name_offsets[i]:name_offsets[i+1]]
+    names        : bytes; the utf-8 image names, concatenated (the image
+                   name string table)
+
+Loading a binary annotations file memory-maps the records and offsets
+sections, so the file opens almost instantly and its pages are shared by
+all the processes that have it open. The data are presented as a
+VRDAnnotationStore (see module nesy4vrd_anno_store).
+
+DEPENDENCIES:
+This module has dependencies on Python packages:
+    NumPy
+'''
+
+#%%
+
+import os
+import json
+import hashlib
+
+import numpy as np
+
+import nesy4vrd_anno_store as vrdas
+
+
+#%%
+
+binary_file_magic = b'NSY4VRDB'
+
+binary_file_version = 1
+
+binary_file_ext = '.vrdbin'
+
+record_width = 11
+
+section_names = ['offsets', 'records', 'name_offsets', 'names']
+
+
+#%%
+
+def is_binary_annotations_file(path):
+    '''
+    Return True if a path names a NeSy4VRD binary annotations file
+    (judged by its file name extension).
+    '''
+    return path.endswith(binary_file_ext)
+
+
+#%%
+
+def _align8(n):
+    return (n + 7) // 8 * 8
+
+
+def _calc_checksum(sections):
+    '''
+    Calculate the SHA-256 checksum of a sequence of data sections.
+    '''
+    hasher = hashlib.sha256()
+    for section in sections:
+        hasher.update(section)
+    return hasher.hexdigest()
+
+
+#%%
+
+def write_VRD_annotations_binary(vrd_anno, path, vrd_objects=None,
+                                 vrd_predicates=None):
+    '''
+    Write visual relationship annotations to file in the NeSy4VRD binary
+    annotations format.
+
+    Parameters:
+        vrd_anno : dictionary, VRDAnnotationView or VRDAnnotationStore
+        path : string (path and filename to which to write)
+        vrd_objects : list of strings (optional; object class names)
+        vrd_predicates : list of strings (optional; predicate names)
+
+    Returns:
+        None
+    '''
+
+    store = vrdas.get_annotation_store(vrd_anno)
+    if store is None:
+        store = vrdas.VRDAnnotationStore.from_dict(vrd_anno)
+
+    records = np.empty((store.n_vrs, record_width), dtype='<i4')
+    records[:, 0] = store.sub_cls
+    records[:, 1] = store.prd
+    records[:, 2] = store.obj_cls
+    records[:, 3:7] = store.sub_bbox
+    records[:, 7:11] = store.obj_bbox
+
+    encoded_names = [imname.encode('utf-8') for imname in store.img_names]
+    name_offsets = np.zeros(len(encoded_names) + 1, dtype='<i8')
+    name_offsets[1:] = np.cumsum([len(name) for name in encoded_names])
+
+    sections = [store.offsets.astype('<i8').tobytes(),
+                records.tobytes(),
+                name_offsets.tobytes(),
+                b''.join(encoded_names)]
+
+    # the position of each section, relative to the start of the data
+    section_layout = {}
+    position = 0
+    for name, section in zip(section_names, sections):
+        section_layout[name] = [position, len(section)]
+        position = _align8(position + len(section))
+
+    header = {'format_version': binary_file_version,
+              'n_images': store.n_images,
+              'n_vrs': store.n_vrs,
+              'object_classes': vrd_objects,
+              'predicates': vrd_predicates,
+              'sections': section_layout,
+              'checksum': _calc_checksum(sections)}
+
+    header_bytes = json.dumps(header).encode('utf-8')
+    data_start = _align8(16 + len(header_bytes))
+    header_bytes = header_bytes.ljust(data_start - 16, b' ')
+
+    # write to a temporary file and then move it into place, so that any
+    # process that has the existing file memory-mapped keeps seeing the
+    # old (complete) file rather than one being overwritten beneath it
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as fp:
+        fp.write(binary_file_magic)
+        fp.write(np.uint64(len(header_bytes)).astype('<u8').tobytes())
+        fp.write(header_bytes)
+        for name, section in zip(section_names, sections):
+            start, size = section_layout[name]
+            fp.seek(data_start + start)
+            fp.write(section)
+        # pad the file to the end of its final section
+        fp.truncate(data_start + position)
+    os.replace(tmp_path, path)
+
+    return None
+
+
+#%%
+
+def read_VRD_annotations_binary_header(path):
+    '''
+    Read the header of a NeSy4VRD binary annotations file.
+
+    Returns:
+        header : dictionary
+            - as described in the module docstring, plus key 'data_start'
+              (the file position at which the data sections begin)
+    '''
+
+    with open(path, 'rb') as fp:
+        magic = fp.read(8)
+        if magic != binary_file_magic:
+            raise ValueError(f'not a NeSy4VRD binary annotations file: {path}')
+        header_len = int(np.frombuffer(fp.read(8), dtype='<u8')[0])
+        header = json.loads(fp.read(header_len).decode('utf-8'))
+
+    if header['format_version'] != binary_file_version:
+        raise ValueError(f"unsupported binary annotations format version: {header['format_version']}")
+
+    header['data_start'] = 16 + header_len
+
+    return header
+
+
+#%%
+
+def _map_section(path, header, name, dtype, shape):
+    '''
+    Memory-map a data section of a binary annotations file as an array.
+    '''
+    start, size = header['sections'][name]
+    if size == 0:
+        return np.zeros(shape, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r',
+                     offset=header['data_start'] + start, shape=shape)
+
+
+def verify_VRD_annotations_binary_checksum(path, header=None):
+    '''
+    Verify the checksum of the data sections of a NeSy4VRD binary
+    annotations file. Doing so reads the whole file.
+
+    Returns:
+        ok : boolean
+    '''
+
+    if header is None:
+        header = read_VRD_annotations_binary_header(path)
+
+    sections = []
+    with open(path, 'rb') as fp:
+        for name in section_names:
+            start, size = header['sections'][name]
+            fp.seek(header['data_start'] + start)
+            sections.append(fp.read(size))
+
+    return _calc_checksum(sections) == header['checksum']
+
+
+#%%
+
+def load_VRD_annotations_binary(path, verify_checksum=False):
+    '''
+    Load a NeSy4VRD binary annotations file into a VRDAnnotationStore.
+
+    The VR records and the image offsets are memory-mapped rather than
+    read, so loading takes very little time and memory however large the
+    file. Only the image name string table is read in full.
+
+    Parameters:
+        path : string (path to binary annotations file)
+        verify_checksum : boolean
+            - if True, the checksum of the data sections is verified first
+              (which requires reading the whole file)
+
+    Returns:
+        store : VRDAnnotationStore
+        header : dictionary
+            - includes the object class names ('object_classes') and
+              predicate names ('predicates') stored with the annotations
+    '''
+
+    header = read_VRD_annotations_binary_header(path)
+
+    if verify_checksum:
+        if not verify_VRD_annotations_binary_checksum(path, header):
+            raise ValueError(f'binary annotations file checksum mismatch: {path}')
+
+    n_images = header['n_images']
+    n_vrs = header['n_vrs']
+
+    offsets = _map_section(path, header, 'offsets', '<i8', (n_images+1,))
+    records = _map_section(path, header, 'records', '<i4', (n_vrs, record_width))
+    name_offsets = _map_section(path, header, 'name_offsets', '<i8',
+                                (n_images+1,)).tolist()
+
+    start, size = header['sections']['names']
+    with open(path, 'rb') as fp:
+        fp.seek(header['data_start'] + start)
+        names = fp.read(size)
+
+    img_names = [names[name_offsets[idx]:name_offsets[idx+1]].decode('utf-8')
+                 for idx in range(n_images)]
+
+    # the columns are views of the memory-mapped records
+    store = vrdas.VRDAnnotationStore(img_names, offsets,
+                                     records[:, 0], records[:, 1],
+                                     records[:, 2], records[:, 3:7],
+                                     records[:, 7:11])
+
+    return store, header
+
+
@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: David Herron
+"""
+
+'''
+This module defines inverted indexes over the NeSy4VRD visual relationship
+annotations of the VRD images.
+
+An AnnotationIndex maps each of the following kinds of key to a posting
+list recording where, in the annotations, that key occurs:
+    'cls' : object class index (in either the 'subject' or 'object' role)
+    'prd' : predicate index
+    'sp'  : ('subject' class index, predicate index)
+    'po'  : (predicate index, 'object' class index)
+    'so'  : ('subject' class index, 'object' class index)
+    'spo' : ('subject' class index, predicate index, 'object' class index)
+
+A posting list is a dictionary whose keys are image names and whose values
+are lists of the positions (indices) of the matching visual relationships
+(VRs) within the image's list of VRs.
+
+With an index in place, the vrdu.get_images_with_* queries answer in time
+proportional to the size of their result rather than by scanning the VRs
+of every image.
+
+An IndexedVRDAnnotations is an annotations dictionary that keeps an
+AnnotationIndex up to date as entries are assigned or deleted, which is
+how the NeSy4VRD workflow modifies the annotations:
+    imanno = vrd_anno[imname].copy()
+    ... customise imanno ...
+    vrd_anno[imname] = imanno
+Modifying the VRs of an image 'in place', without assigning them back,
+bypasses the index and leaves it stale.
+'''
+
+#%%
+
+index_kinds = ['cls', 'prd', 'sp', 'po', 'so', 'spo']
+
+
+def get_vr_index_keys(vr):
+    '''
+    Get the index keys, by kind, of a visual relationship.
+
+    Returns:
+        keys : list of (kind, key) tuples
+    '''
+
+    sub_idx = vr['subject']['category']
+    prd_idx = vr['predicate']
+    obj_idx = vr['object']['category']
+
+    keys = [('cls', sub_idx),
+            ('prd', prd_idx),
+            ('sp', (sub_idx, prd_idx)),
+            ('po', (prd_idx, obj_idx)),
+            ('so', (sub_idx, obj_idx)),
+            ('spo', (sub_idx, prd_idx, obj_idx))]
+
+    if obj_idx != sub_idx:
+        keys.append(('cls', obj_idx))
+
+    return keys
+
+
+#%%
+
+class AnnotationIndex():
+    '''
+    Inverted indexes over a NeSy4VRD annotations dictionary.
+    '''
+
+    def __init__(self):
+        self._postings = {kind: {} for kind in index_kinds}
+        # the (kind, key) pairs contributed by each image
+        self._image_keys = {}
+        # the position of each image within the annotations dictionary
+        self._image_position = {}
+        self._next_position = 0
+        # the indexed image names, in position order (built when needed)
+        self._ordered_names = None
+
+    @classmethod
+    def from_annotations(cls, vrd_anno):
+        '''
+        Build an index over an annotations dictionary.
+        '''
+        index = cls()
+        for imname, imanno in vrd_anno.items():
+            index.update_image(imname, imanno)
+        return index
+
+    def __len__(self):
+        return len(self._image_keys)
+
+    def __contains__(self, imname):
+        return imname in self._image_keys
+
+    def update_image(self, imname, imanno):
+        '''
+        (Re)index the VRs of an image.
+        '''
+
+        if imname in self._image_keys:
+            self._remove_postings(imname)
+        else:
+            self._image_position[imname] = self._next_position
+            self._next_position += 1
+            self._ordered_names = None
+
+        image_keys = set()
+        for vr_idx, vr in enumerate(imanno):
+            for kind, key in get_vr_index_keys(vr):
+                posting = self._postings[kind].setdefault(key, {})
+                posting.setdefault(imname, []).append(vr_idx)
+                image_keys.add((kind, key))
+
+        self._image_keys[imname] = image_keys
+
+        return None
+
+    def remove_image(self, imname):
+        '''
+        Remove an image from the index.
+        '''
+        self._remove_postings(imname)
+        del self._image_keys[imname]
+        del self._image_position[imname]
+        self._ordered_names = None
+        return None
+
+    def _remove_postings(self, imname):
+        for kind, key in self._image_keys[imname]:
+            posting = self._postings[kind][key]
+            del posting[imname]
+            if len(posting) == 0:
+                del self._postings[kind][key]
+
+    def get_posting(self, kind, key):
+        '''
+        Get the posting list for a key.
+
+        Returns:
+            posting : dictionary
+                - keys are image names; values are lists of VR indices
+        '''
+        return self._postings[kind].get(key, {})
+
+    def get_images(self, kind, key, img_names=None):
+        '''
+        Get the images (amongst those named in 'img_names') whose VRs
+        contain a given key.
+
+        Only the images of the posting list for the key are examined, so
+        the work done is proportional to the size of the result. If
+        'img_names' is None, every indexed image is considered, and the
+        images are returned in annotations dictionary order (the order of
+        vrd_anno.keys()). Otherwise, they are returned in the order of
+        'img_names'.
+
+        Returns:
+            images : list of strings (image names)
+            vr_indices : list (one entry per image) of lists of integers
+        '''
+
+        posting = self.get_posting(kind, key)
+
+        position = self._get_positions(img_names)
+        if position is None:
+            # an image named more than once in 'img_names' is returned
+            # once for each time it is named
+            images = [imname for imname in img_names if imname in posting]
+        else:
+            images = [imname for imname in posting if imname in position]
+            images.sort(key=position.__getitem__)
+
+        vr_indices = [posting[imname] for imname in images]
+
+        return images, vr_indices
+
+    def _get_positions(self, img_names):
+        '''
+        Get a dictionary mapping each name in 'img_names' to its position,
+        or None if a name appears in 'img_names' more than once.
+
+        The common case, where 'img_names' lists exactly the indexed images
+        in annotations dictionary order, is recognised (by a list
+        comparison that is cheap, because the names are then the very
+        same string objects), and the index's own positions are reused.
+        '''
+
+        if img_names is None:
+            return self._image_position
+
+        if self._ordered_names is None:
+            self._ordered_names = sorted(self._image_position,
+                                         key=self._image_position.__getitem__)
+        if not isinstance(img_names, list):
+            img_names = list(img_names)
+        if img_names == self._ordered_names:
+            return self._image_position
+
+        position = {imname: idx for idx, imname in enumerate(img_names)}
+        if len(position) != len(img_names):
+            return None
+
+        return position
+
+    def to_data(self):
+        '''
+        Convert the index to plain (JSON-serialisable) data: the indexed
+        image names, in annotations dictionary order, and the posting
+        lists of each kind of key.
+        '''
+
+        img_names = sorted(self._image_keys.keys(),
+                           key=lambda imname: self._image_position[imname])
+        postings = {kind: [[key, list(posting.items())]
+                           for key, posting in self._postings[kind].items()]
+                    for kind in index_kinds}
+
+        return {'img_names': img_names, 'postings': postings}
+
+    @classmethod
+    def from_data(cls, data):
+        '''
+        Rebuild an index from plain data produced by to_data().
+        '''
+
+        index = cls()
+        for imname in data['img_names']:
+            index._image_keys[imname] = set()
+            index._image_position[imname] = index._next_position
+            index._next_position += 1
+
+        for kind in index_kinds:
+            for key, posting in data['postings'][kind]:
+                # JSON turns tuple keys into lists
+                if isinstance(key, list):
+                    key = tuple(key)
+                index._postings[kind][key] = dict(posting)
+                for imname, _ in posting:
+                    index._image_keys[imname].add((kind, key))
+
+        return index
+
+
+#%%
+
+class IndexedVRDAnnotations(dict):
+    '''
+    A NeSy4VRD annotations dictionary that keeps an AnnotationIndex up
+    to date as image entries are assigned and deleted.
+    '''
+
+    def __init__(self, vrd_anno, index=None):
+        super().__init__(vrd_anno)
+        if index is None:
+            index = AnnotationIndex.from_annotations(self)
+        self.index = index
+
+    def __setitem__(self, imname, imanno):
+        super().__setitem__(imname, imanno)
+        self.index.update_image(imname, imanno)
+
+    def __delitem__(self, imname):
+        super().__delitem__(imname)
+        self.index.remove_image(imname)
+
+    def pop(self, imname, *args):
+        if imname in self:
+            self.index.remove_image(imname)
+        return super().pop(imname, *args)
+
+    def update(self, *args, **kwargs):
+        for imname, imanno in dict(*args, **kwargs).items():
+            self[imname] = imanno
+
+
+#%%
+
+def get_annotation_index(vrd_anno):
+    '''
+    Return the AnnotationIndex maintained for an annotations dictionary,
+    or None if it has no index.
+    '''
+
+    if isinstance(vrd_anno, IndexedVRDAnnotations):
+        return vrd_anno.index
+    return None
+
@@ -0,0 +1,418 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: David Herron
+"""
+
+'''
+This module defines a columnar, array-backed store for the NeSy4VRD visual
+relationship annotations of the VRD images.
+
+The NeSy4VRD annotations are loaded from their .json files as a dictionary
+whose keys are image names and whose values are lists of visual
+relationship (VR) dictionaries, like this:
+
+{'predicate': 35,
+ 'object': {'category': 43, 'bbox': [376, 804, 133, 614]},
+ 'subject': {'category': 0, 'bbox': [149, 495, 267, 523]}}
+
+Over the full training set, that amounts to many hundreds of thousands of
+small Python dictionaries and lists. A VRDAnnotationStore holds exactly the
+same information as a small number of NumPy arrays (columns), with one
+row per VR:
+    img_idx  : the integer index of the image to which the VR belongs
+    sub_cls  : the 'subject' object class index
+    prd      : the predicate index
+    obj_cls  : the 'object' object class index
+    sub_bbox : the 'subject' bbox, [ymin, ymax, xmin, xmax]
+    obj_bbox : the 'object' bbox, [ymin, ymax, xmin, xmax]
+
+The VRs of each image occupy a contiguous block of rows, in the same order
+as they appear in the annotations dictionary. The block for the image
+with index i is given by rows offsets[i] to offsets[i+1].
+
+A VRDAnnotationView wraps a store and presents it as a dictionary-like
+object keyed by image name, so that existing code that expects the
+annotations dictionary keeps working.
+
+DEPENDENCIES:
+This module has dependencies on Python packages:
+    NumPy
+'''
+
+#%%
+
+import json
+from collections.abc import MutableMapping
+
+import numpy as np
+
+
+#%%
+
+class VRDAnnotationStore():
+    '''
+    A columnar, array-backed representation of a NeSy4VRD annotations
+    dictionary.
+
+    A store is never modified once built. To customise annotations,
+    work with a VRDAnnotationView (or a plain dictionary) and build a new
+    store from the result.
+
+    Attributes:
+        img_names : tuple of strings (image names, in annotations order)
+        offsets : int64 array, shape (n_images+1,)
+        img_idx : int32 array, shape (n_vrs,)
+        sub_cls : int32 array, shape (n_vrs,)
+        prd : int32 array, shape (n_vrs,)
+        obj_cls : int32 array, shape (n_vrs,)
+        sub_bbox : int32 array, shape (n_vrs, 4)
+        obj_bbox : int32 array, shape (n_vrs, 4)
+    '''
+
+    def __init__(self, img_names, offsets, sub_cls, prd, obj_cls,
+                 sub_bbox, obj_bbox):
+
+        self.img_names = tuple(img_names)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.sub_cls = np.asarray(sub_cls, dtype=np.int32)
+        self.prd = np.asarray(prd, dtype=np.int32)
+        self.obj_cls = np.asarray(obj_cls, dtype=np.int32)
+        self.sub_bbox = np.asarray(sub_bbox, dtype=np.int32).reshape(-1, 4)
+        self.obj_bbox = np.asarray(obj_bbox, dtype=np.int32).reshape(-1, 4)
+
+        if len(self.offsets) != len(self.img_names) + 1:
+            raise ValueError('offsets inconsistent with number of images')
+
+        n_vrs = int(self.offsets[-1])
+        for column in [self.sub_cls, self.prd, self.obj_cls,
+                       self.sub_bbox, self.obj_bbox]:
+            if len(column) != n_vrs:
+                raise ValueError('column length inconsistent with offsets')
+
+        # the image index of each VR, derived from the offsets
+        vrs_per_image = np.diff(self.offsets)
+        self.img_idx = np.repeat(np.arange(len(self.img_names), dtype=np.int32),
+                                 vrs_per_image)
+
+        # the position (index) of each image name
+        self.img_name_to_idx = {imname: idx for idx, imname in
+                                enumerate(self.img_names)}
+
+    @classmethod
+    def from_dict(cls, vrd_anno):
+        '''
+        Build a store from a NeSy4VRD annotations dictionary.
+
+        Parameters:
+            vrd_anno : dictionary (or VRDAnnotationView)
+                - keys are image names; values are lists of VR dictionaries
+
+        Returns:
+            store : VRDAnnotationStore
+        '''
+
+        img_names = list(vrd_anno.keys())
+
+        offsets = np.zeros(len(img_names) + 1, dtype=np.int64)
+        sub_cls = []
+        prd = []
+        obj_cls = []
+        sub_bbox = []
+        obj_bbox = []
+
+        for idx, imname in enumerate(img_names):
+            imanno = vrd_anno[imname]
+            for vr in imanno:
+                sub_cls.append(vr['subject']['category'])
+                prd.append(vr['predicate'])
+                obj_cls.append(vr['object']['category'])
+                sub_bbox.append(vr['subject']['bbox'])
+                obj_bbox.append(vr['object']['bbox'])
+            offsets[idx+1] = offsets[idx] + len(imanno)
+
+        return cls(img_names, offsets, sub_cls, prd, obj_cls,
+                   sub_bbox, obj_bbox)
+
+    @property
+    def n_images(self):
+        return len(self.img_names)
+
+    @property
+    def n_vrs(self):
+        return int(self.offsets[-1])
+
+    def __len__(self):
+        return self.n_images
+
+    def __contains__(self, imname):
+        return imname in self.img_name_to_idx
+
+    def __getitem__(self, imname):
+        return self.get_image_annotations(imname)
+
+    def vr_rows(self, imname):
+        '''
+        Return the slice of rows holding the VRs of a named image.
+        '''
+        idx = self.img_name_to_idx[imname]
+        return slice(int(self.offsets[idx]), int(self.offsets[idx+1]))
+
+    def get_image_annotations(self, imname):
+        '''
+        Return the VRs of a named image in their standard (dictionary)
+        format, as newly created Python objects.
+        '''
+
+        rows = self.vr_rows(imname)
+
+        # convert to Python ints in bulk so the results are json-friendly
+        sub_cls = self.sub_cls[rows].tolist()
+        prd = self.prd[rows].tolist()
+        obj_cls = self.obj_cls[rows].tolist()
+        sub_bbox = self.sub_bbox[rows].tolist()
+        obj_bbox = self.obj_bbox[rows].tolist()
+
+        imanno = []
+        for idx in range(len(prd)):
+            vr = {'predicate': prd[idx],
+                  'object': {'category': obj_cls[idx], 'bbox': obj_bbox[idx]},
+                  'subject': {'category': sub_cls[idx], 'bbox': sub_bbox[idx]}}
+            imanno.append(vr)
+
+        return imanno
+
+    def to_dict(self):
+        '''
+        Convert the store back into a NeSy4VRD annotations dictionary.
+        '''
+        return {imname: self.get_image_annotations(imname)
+                for imname in self.img_names}
+
+    def view(self):
+        '''
+        Return a dictionary-like view of the store, keyed by image name.
+        '''
+        return VRDAnnotationView(self)
+
+    def updated(self, img_names, changed_anno):
+        '''
+        Build a new store holding the images named in 'img_names', in that
+        order, taking the VRs of the images in 'changed_anno' from there
+        and those of every other image from this store.
+
+        Only the VRs of the changed images are converted from their
+        dictionary format; the rows of the other images are copied across
+        from this store's columns in bulk.
+
+        Parameters:
+            img_names : list of strings (the image names of the new store)
+            changed_anno : dictionary (or VRDAnnotationView)
+                - keys are image names; values are lists of VR dictionaries
+
+        Returns:
+            store : VRDAnnotationStore
+        '''
+
+        changed = VRDAnnotationStore.from_dict(changed_anno)
+
+        # the position of the first row of each image, and its number of
+        # VRs, in the columns of this store followed by those of the
+        # changed images
+        starts = np.empty(len(img_names), dtype=np.int64)
+        counts = np.empty(len(img_names), dtype=np.int64)
+        for idx, imname in enumerate(img_names):
+            if imname in changed.img_name_to_idx:
+                img_idx = changed.img_name_to_idx[imname]
+                starts[idx] = self.n_vrs + changed.offsets[img_idx]
+                counts[idx] = changed.offsets[img_idx+1] - changed.offsets[img_idx]
+            else:
+                img_idx = self.img_name_to_idx[imname]
+                starts[idx] = self.offsets[img_idx]
+                counts[idx] = self.offsets[img_idx+1] - self.offsets[img_idx]
+
+        offsets = np.zeros(len(img_names) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        rows = (np.repeat(starts - offsets[:-1], counts) +
+                np.arange(offsets[-1], dtype=np.int64))
+
+        def gather(name):
+            column = np.concatenate([getattr(self, name), getattr(changed, name)])
+            return column[rows]
+
+        return VRDAnnotationStore(img_names, offsets, gather('sub_cls'),
+                                  gather('prd'), gather('obj_cls'),
+                                  gather('sub_bbox'), gather('obj_bbox'))
+
+    def image_selection(self, img_names):
+        '''
+        Return a boolean array, one entry per image, that is True for the
+        images named in 'img_names'.
+        '''
+        selected = np.zeros(self.n_images, dtype=bool)
+        if len(img_names) > 0:
+            img_idxs = [self.img_name_to_idx[imname] for imname in img_names]
+            selected[img_idxs] = True
+        return selected
+
+    def images_with_vrs(self, vr_mask):
+        '''
+        Return a boolean array, one entry per image, that is True for the
+        images having at least one VR for which 'vr_mask' is True.
+        '''
+        hits = np.zeros(self.n_images, dtype=bool)
+        hits[self.img_idx[vr_mask]] = True
+        return hits
+
+    def filter_img_names(self, img_names, image_hits):
+        '''
+        Return the names in 'img_names' (in their given order) whose
+        entries in the per-image boolean array 'image_hits' are True.
+        '''
+        return [imname for imname in img_names
+                if image_hits[self.img_name_to_idx[imname]]]
+
+
+#%%
+
+class VRDAnnotationView(MutableMapping):
+    '''
+    A dictionary-like view of a VRDAnnotationStore, keyed by image name.
+
+    Reading an entry returns newly created VR dictionaries, so modifying
+    them has no effect on the view unless they are assigned back, which is
+    how the NeSy4VRD workflow scripts already work:
+        imanno = vrd_anno[imname].copy()
+        ... customise imanno ...
+        vrd_anno[imname] = imanno
+
+    Assigned and deleted entries are held in an overlay on top of the
+    underlying store. The method store() folds the overlay into a new
+    store whenever the columns are needed; only the assigned entries are
+    converted, the rows of all other images being copied from the
+    underlying store.
+    '''
+
+    def __init__(self, store):
+        self._store = store
+        self._overlay = {}
+        self._deleted = set()
+        self._img_names = list(store.img_names)
+        self._dirty = False
+
+    def __getitem__(self, imname):
+        if imname in self._overlay:
+            return self._overlay[imname]
+        if imname in self._deleted or not imname in self._store:
+            raise KeyError(imname)
+        return self._store.get_image_annotations(imname)
+
+    def __setitem__(self, imname, imanno):
+        if not imname in self:
+            self._img_names.append(imname)
+        self._deleted.discard(imname)
+        self._overlay[imname] = imanno
+        self._dirty = True
+
+    def __delitem__(self, imname):
+        if not imname in self:
+            raise KeyError(imname)
+        self._img_names.remove(imname)
+        self._overlay.pop(imname, None)
+        self._deleted.add(imname)
+        self._dirty = True
+
+    def __contains__(self, imname):
+        if imname in self._overlay:
+            return True
+        return imname in self._store and not imname in self._deleted
+
+    def __iter__(self):
+        return iter(list(self._img_names))
+
+    def __len__(self):
+        return len(self._img_names)
+
+    def store(self):
+        '''
+        Return a VRDAnnotationStore holding the current content of the view.
+        '''
+        if self._dirty:
+            self._store = self._store.updated(self._img_names, self._overlay)
+            self._overlay = {}
+            self._deleted = set()
+            self._dirty = False
+        return self._store
+
+
+#%%
+
+def get_annotation_store(vrd_anno):
+    '''
+    Return the VRDAnnotationStore behind an annotations object, or None
+    if the annotations object is a plain dictionary.
+    '''
+
+    if isinstance(vrd_anno, VRDAnnotationView):
+        return vrd_anno.store()
+    if isinstance(vrd_anno, VRDAnnotationStore):
+        return vrd_anno
+    return None
+
+
+def get_annotation_store_for_images(img_names, vrd_anno):
+    '''
+    Get a VRDAnnotationStore holding exactly the VRs of the named images,
+    in the order of 'img_names'.
+
+    If the annotations are already backed by a store, its columns are
+    sliced rather than the annotations being converted again.
+
+    Parameters:
+        img_names : list of strings (image names)
+        vrd_anno : dictionary (or VRDAnnotationView, or VRDAnnotationStore)
+
+    Returns:
+        store : VRDAnnotationStore
+    '''
+
+    store = get_annotation_store(vrd_anno)
+    if store is None:
+        return VRDAnnotationStore.from_dict({imname: vrd_anno[imname]
+                                             for imname in img_names})
+
+    if tuple(img_names) == store.img_names:
+        return store
+
+    img_idxs = np.asarray([store.img_name_to_idx[imname] for imname in img_names],
+                          dtype=np.int64)
+    starts = store.offsets[img_idxs]
+    counts = store.offsets[img_idxs + 1] - starts
+    offsets = np.zeros(len(img_names) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    rows = np.repeat(starts - offsets[:-1], counts) + np.arange(offsets[-1])
+
+    return VRDAnnotationStore(img_names, offsets, store.sub_cls[rows],
+                              store.prd[rows], store.obj_cls[rows],
+                              store.sub_bbox[rows], store.obj_bbox[rows])
+
+
+#%%
+
+def load_VRD_annotation_store(path):
+    '''
+    Load the VRD image visual relationship annotations into a
+    VRDAnnotationStore.
+
+    Parameters:
+        path : string (path to annotations file in annotations directory)
+
+    Returns:
+        store : VRDAnnotationStore
+    '''
+
+    with open(path, 'r') as fp:
+        annotations = json.load(fp)
+
+    return VRDAnnotationStore.from_dict(annotations)
+
@@ -16,6 +16,9 @@ import numpy as np
 import matplotlib.pyplot as plt
 
 import nesy4vrd_utils as vrdu
+import nesy4vrd_image_manifest as vrdim
+import nesy4vrd_quality_checks as vrdqc
+import nesy4vrd_dataset_profile as vrddp
 
 
 #%% get the NeSy4VRD visual relationships annotations data
@@ -36,9 +39,26 @@ path = os.path.join(anno_dir, 'nesy4vrd_annotations_train.json')
 #path = os.path.join(anno_dir, 'nesy4vrd_annotations_test.json')
 vrd_anno = vrdu.load_VRD_image_annotations(path)
 
+# alternatively, load the annotations into a columnar (array-backed) store
+# and work with its dictionary-like view; the vrdu.get_images_with_*
+# functions then search the store's columns directly
+#import nesy4vrd_anno_store as vrdas
+#vrd_anno = vrdas.load_VRD_annotation_store(path).view()
+
+# or, load the annotations along with inverted indexes over their content,
+# so the vrdu.get_images_with_* functions answer without scanning every
+# image; the indexes are saved alongside the annotations file and reused
+#vrd_anno = vrdu.load_VRD_image_annotations_indexed(path)
+
 # get the customised set of VRD (training or test) image names
 vrd_img_names = list(vrd_anno.keys())
 
+# get the statistical profile of the annotations, used by the
+# distributional analyses; it is saved alongside the annotations file
+# and recomputed only if the annotations file changes
+profile = vrddp.load_dataset_profile(path, vrd_anno, len(vrd_objects),
+                                     len(vrd_predicates))
+
 
 #%% set path to directory where the VRD images are located
 
@@ -787,10 +807,7 @@ for idx, vr in enumerate(imanno):
 
 #%% X.1
 
-cnt = 0
-for idx, imname in enumerate(vrd_img_names):
-    imanno = vrd_anno[imname]
-    cnt += len(imanno)
+cnt = profile.n_vrs
     
 print(f'Total number of visual relationships: {cnt}')
 
@@ -814,12 +831,7 @@ print(f'Total number of visual relationships: {cnt}')
 
 #%% X.1 calculate distribution data and show summary statistics
 
-n_imgs = len(vrd_img_names)
-n_vrs_per_img = np.zeros(n_imgs)
-
-for idx, imname in enumerate(vrd_img_names):
-    imanno = vrd_anno[imname]
-    n_vrs_per_img[idx] = len(imanno)
+n_vrs_per_img = profile.n_vrs_per_img
 
 max_vrs_per_img = int(np.max(n_vrs_per_img))
 
@@ -842,11 +854,7 @@ plt.title('Distribution of number of vrs per image')
 
 target_num = 1
 
-target_images = []
-for imname in vrd_img_names:
-    imanno = vrd_anno[imname]
-    if len(imanno) == target_num:
-        target_images.append(imname)
+target_images = profile.get_images_with_n_vrs(target_num)
 
 print(f'Nr images with {target_num} VRs: {len(target_images)}')
 
@@ -877,13 +885,7 @@ vrdu.display_image_with_bboxes_for_vr(imname, vr, imagedir)
 
 #%% X.1 calculate distribution data and show summary statistics
 
-n_imgs = len(vrd_img_names)
-n_obj_cls_per_img = np.zeros(n_imgs)
-for idx, imname in enumerate(vrd_img_names):
-    imanno = vrd_anno[imname]
-    sub_classes, prd_classes, obj_classes = vrdu.get_object_classes_and_predicates(imanno)
-    all_classes = set(sub_classes + obj_classes)
-    n_obj_cls_per_img[idx] = len(all_classes)
+n_obj_cls_per_img = profile.n_obj_cls_per_img
 
 max_obj_cls_per_img = int(np.max(n_obj_cls_per_img))
 
@@ -910,11 +912,7 @@ plt.title('Distribution of number of object classes per image')
 
 #%% X.1 calculate distribution data and show summary statistics
 
-n_pred_per_img = []
-for imname in vrd_img_names:
-    imanno = vrd_anno[imname]
-    sub_classes, prd_classes, obj_classes = vrdu.get_object_classes_and_predicates(imanno)
-    n_pred_per_img.append(len(prd_classes))
+n_pred_per_img = profile.n_prd_per_img
 
 max_pred_per_img = int(np.max(n_pred_per_img))
 
@@ -934,14 +932,73 @@ plt.hist(n_pred_per_img, bins)
 plt.title('Distribution of number of predicates per image')
 
 
+#%% analysis X
+
+# Analyse the frequencies of the object classes and the predicates
+
+#%% X.1 show the object classes in order of frequency
+
+cls_n_vrs = profile.cls_n_vrs_as_subject + profile.cls_n_vrs_as_object
+for cls_idx in np.argsort(-cls_n_vrs, kind='stable'):
+    print(f'{vrd_objects[cls_idx]}: {cls_n_vrs[cls_idx]} VR roles '
+          f'({profile.cls_n_vrs_as_subject[cls_idx]} subject, '
+          f'{profile.cls_n_vrs_as_object[cls_idx]} object); '
+          f'{profile.cls_n_objects[cls_idx]} objects; '
+          f'{profile.cls_n_images[cls_idx]} images')
+
+#%% X.2 show the predicates in order of frequency
+
+for prd_idx in np.argsort(-profile.prd_n_vrs, kind='stable'):
+    print(f'{vrd_predicates[prd_idx]}: {profile.prd_n_vrs[prd_idx]} VRs; '
+          f'{profile.prd_n_images[prd_idx]} images')
+
+#%% X.3 plot the predicate frequencies
+
+plt.bar(range(len(vrd_predicates)), profile.prd_n_vrs)
+plt.title('Number of VRs per predicate')
+
+
+#%% analysis X
+
+# Analyse the distributions of the bbox areas and aspect ratios (W / H)
+# of the objects of a given object class
+
+#%% X.1 summarise the bboxes of the objects of each object class
+
+summary = profile.get_class_bbox_summary()
+for cls_idx, name in enumerate(vrd_objects):
+    med_area, mean_area, med_aspect, mean_aspect = summary[cls_idx]
+    print(f'{name}: median area {med_area:.0f}; mean area {mean_area:.0f}; '
+          f'median aspect {med_aspect:.2f}; mean aspect {mean_aspect:.2f}')
+
+#%% X.2 plot the distribution histograms for one object class
+
+cls_name = 'person'
+cls_idx = vrd_objects.index(cls_name)
+
+plt.hist(profile.get_class_bbox_areas(cls_idx), bins=50)
+plt.title(f"Distribution of bbox areas of objects of class '{cls_name}'")
+
+#%% X.3
+
+plt.hist(profile.get_class_bbox_aspects(cls_idx), bins=50)
+plt.title(f"Distribution of bbox aspect ratios of objects of class '{cls_name}'")
+
+
 #%% Analysis X
 
 # Analyse the distribution of image sizes (W x H)
 
 #%% X.1 gather the sizes of all the images
 
-### CAUTION: this takes a few moments to run on the full training set annotations
+# build (or incrementally rebuild) the image metadata manifest of the
+# image directory; the sizes of the images are read from the headers of
+# the image files, in parallel, and saved alongside the image directory;
+# on later runs, only new or modified image files are read again
+manifest, n_read = vrdim.build_image_manifest(imagedir)
+print(f'Image manifest: {len(manifest)} images; {n_read} image files read')
 
+# vrdu.get_image_size() now takes the sizes from the manifest
 img_sizes = []
 for imname in vrd_img_names:
     size = vrdu.get_image_size(imname, imagedir)
@@ -1018,6 +1075,38 @@ print(f'Number of images with 0 annotated objects: {len(images_with_no_objects)}
 
 
 
+#%% analysis X
+
+# Run all of the quality verification checks of the analyses that follow
+# (flawed inverse VRs, duplicate VRs, VRs with identical bboxes, bboxes
+# with multiple object classes, degenerate bboxes and, if an image
+# directory is given, out-of-bounds bboxes) together, in one pass over
+# the annotations.
+
+# Unlike the individual analyses, the findings report every problem VR
+# of every image, not just the first one found.
+
+#%% X.1 run the checks
+
+findings = vrdqc.run_quality_checks(vrd_img_names, vrd_anno, imagedir=imagedir)
+
+for check_name, (n_images, n_vrs) in findings.summary().items():
+    print(f'{check_name}: {n_images} images, {n_vrs} VRs')
+# should all be 0
+
+#%% X.2 get the images (and their problem VRs) found by one check
+
+res_imgs, res_vr_idxs = findings.get_vr_indices('duplicate')
+
+#%% X.3 get all of the findings for one image
+
+if len(findings) > 0:
+    imname = findings.img_names[findings.img_idx[0]]
+    for vr_idx, check_names in findings.get_image_findings(imname):
+        print(vr_idx, check_names)
+
+
+
 #%% analysis X
 
 # Find images whose annotations contain pairs of visual relationships
@@ -1114,6 +1203,36 @@ print(f'Number of images with degenerate bboxes: {len(res_imgs)}')
 # should be 0
 
 
+#%% analysis X
+
+# Find images with bounding boxes that do not lie within the bounds of
+# the image.
+
+# Bbox format is: [ymin, ymax, xmin, xmax]
+# So, for an image of size (W x H), we should have:
+# 0 <= ymin  and  ymax <= H  and  0 <= xmin  and  xmax <= W
+
+# The image sizes are read from the image metadata manifest of the image
+# directory, if one has been built (see analysis X, image sizes), or from
+# the headers of the image files.
+
+#%% X.1 find the images
+
+res = vrdu.get_images_with_out_of_bounds_bboxes(vrd_img_names, vrd_anno,
+                                                imagedir)
+res_imgs, res_vr_idxs = res
+
+print(f'Number of images with out-of-bounds bboxes: {len(res_imgs)}')
+
+#%% X.2 optionally, get the VR annotations of those images with their bboxes clipped to the image bounds
+
+# (vrd_anno is not modified; clipping a bbox that lies wholly outside
+#  its image leaves a degenerate bbox)
+
+clipped_anno = vrdu.get_annotations_with_bboxes_clipped(res_imgs, vrd_anno,
+                                                        imagedir)
+
+
 
 #%% analysis X
 
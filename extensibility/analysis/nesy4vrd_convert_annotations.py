@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: David Herron
+"""
+
+'''
+This script converts a NeSy4VRD visual relationship annotations file
+between the standard .json format and the compact NeSy4VRD binary
+annotations format (see module nesy4vrd_anno_binary).
+
+The direction of conversion is determined by the file name extension of
+the input file: a '.vrdbin' file is converted to .json; anything else is
+converted to '.vrdbin'.
+
+Usage:
+    python nesy4vrd_convert_annotations.py <input file> <output file>
+           [--objects <path>] [--predicates <path>] [--verify]
+
+    --objects, --predicates
+        (json to binary only) the NeSy4VRD object class names and predicate
+        names files whose content is to be stored in the binary file header
+    --verify
+        check the converted annotations against the input annotations
+        (and, for binary input, verify the checksum of the input file)
+
+DEPENDENCIES:
+This module has dependencies on Python packages:
+    NumPy
+'''
+
+#%%
+
+import argparse
+import json
+
+import nesy4vrd_utils as vrdu
+import nesy4vrd_anno_binary as vrdab
+
+
+#%%
+
+def convert_json_to_binary(in_path, out_path, objects_path=None,
+                           predicates_path=None, verify=False):
+
+    vrd_anno = vrdu.load_VRD_image_annotations(in_path)
+
+    vrd_objects = None
+    if objects_path is not None:
+        vrd_objects = vrdu.load_VRD_object_class_names(objects_path)
+
+    vrd_predicates = None
+    if predicates_path is not None:
+        vrd_predicates = vrdu.load_VRD_predicate_names(predicates_path)
+
+    vrdab.write_VRD_annotations_binary(vrd_anno, out_path, vrd_objects,
+                                       vrd_predicates)
+
+    if verify:
+        store, _ = vrdab.load_VRD_annotations_binary(out_path,
+                                                     verify_checksum=True)
+        if store.to_dict() != vrd_anno:
+            raise Exception(f'converted annotations differ from input: {out_path}')
+
+    return len(vrd_anno)
+
+
+def convert_binary_to_json(in_path, out_path, verify=False):
+
+    store, _ = vrdab.load_VRD_annotations_binary(in_path,
+                                                 verify_checksum=verify)
+
+    vrd_anno = store.to_dict()
+
+    with open(out_path, 'w') as fp:
+        json.dump(vrd_anno, fp)
+
+    if verify:
+        if vrdu.load_VRD_image_annotations(out_path) != vrd_anno:
+            raise Exception(f'converted annotations differ from input: {out_path}')
+
+    return len(vrd_anno)
+
+
+#%%
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Convert a NeSy4VRD annotations file between .json and binary formats')
+    parser.add_argument('in_path', help='input annotations file')
+    parser.add_argument('out_path', help='output annotations file')
+    parser.add_argument('--objects', default=None,
+                        help='object class names file (json to binary only)')
+    parser.add_argument('--predicates', default=None,
+                        help='predicate names file (json to binary only)')
+    parser.add_argument('--verify', action='store_true',
+                        help='verify the converted annotations')
+    args = parser.parse_args()
+
+    if vrdab.is_binary_annotations_file(args.in_path):
+        n_images = convert_binary_to_json(args.in_path, args.out_path,
+                                          args.verify)
+    else:
+        n_images = convert_json_to_binary(args.in_path, args.out_path,
+                                          args.objects, args.predicates,
+                                          args.verify)
+
+    print(f'annotations for {n_images} images written to: {args.out_path}')
@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: David Herron
+"""
+
+'''
+This module defines the statistical profile of a set of NeSy4VRD visual
+relationship annotations of the VRD images.
+
+A DatasetProfile holds the statistics behind the distributional analyses
+of the annotations analysis script, all computed together, in one
+vectorised pass over a normalised (scene graph) form of the annotations:
+    per image : the number of VRs, of distinct objects, of distinct
+                object classes and of distinct predicates
+    per object class : the number of VRs in which the class is the
+                       'subject' and the 'object', the number of images
+                       and the number of distinct objects of the class,
+                       and the bbox area and aspect ratio of each object
+                       of the class
+    per predicate : the number of VRs and the number of images using it
+
+An object is a distinct (bbox, object class) pair of an image (see
+nesy4vrd_scene_graph.py).
+
+A profile is saved to disk, in the cache directory alongside its
+annotations file, keyed by a hash of that file's content and by the
+numbers of object classes and predicates, and is reused for as long as
+these are unchanged.
+
+DEPENDENCIES:
+This module has dependencies on Python packages:
+    NumPy
+'''
+
+#%%
+
+import os
+import json
+
+import numpy as np
+
+import nesy4vrd_utils as vrdu
+import nesy4vrd_scene_graph as vrdsg
+
+
+#%%
+
+# the array attributes of a DatasetProfile, as saved to disk
+profile_array_names = ['n_vrs_per_img', 'n_objects_per_img',
+                       'n_obj_cls_per_img', 'n_prd_per_img',
+                       'cls_n_vrs_as_subject', 'cls_n_vrs_as_object',
+                       'cls_n_images', 'cls_n_objects', 'prd_n_vrs',
+                       'prd_n_images', 'obj_cls', 'obj_bbox_area',
+                       'obj_bbox_aspect']
+
+# the version of the saved profile format; a profile saved in any other
+# version is recomputed
+profile_format_version = 1
+
+
+#%%
+
+def count_distinct_pairs(group_idx, values, n_groups, n_values):
+    '''
+    Count the distinct (group, value) pairs of two integer arrays, per
+    group and per value.
+
+    Returns:
+        group_counts : int64 array, shape (n_groups,)
+        value_counts : int64 array, shape (n_values,)
+    '''
+
+    pairs = np.unique(group_idx.astype(np.int64) * n_values + values)
+    group_counts = np.bincount(pairs // n_values, minlength=n_groups)
+    value_counts = np.bincount(pairs % n_values, minlength=n_values)
+
+    return group_counts, value_counts
+
+
+#%%
+
+class DatasetProfile():
+    '''
+    The statistical profile of a set of NeSy4VRD visual relationship
+    annotations.
+
+    Attributes:
+        img_names : tuple of strings (image names, in annotations order)
+        n_vrs_per_img : int64 array, shape (n_images,)
+        n_objects_per_img : int64 array, shape (n_images,)
+        n_obj_cls_per_img : int64 array, shape (n_images,)
+        n_prd_per_img : int64 array, shape (n_images,)
+        cls_n_vrs_as_subject : int64 array, shape (n_object_classes,)
+        cls_n_vrs_as_object : int64 array, shape (n_object_classes,)
+        cls_n_images : int64 array, shape (n_object_classes,)
+        cls_n_objects : int64 array, shape (n_object_classes,)
+        prd_n_vrs : int64 array, shape (n_predicates,)
+        prd_n_images : int64 array, shape (n_predicates,)
+        obj_cls : int32 array, shape (n_objects,) (the class of each object)
+        obj_bbox_area : int64 array, shape (n_objects,) (the bbox area of
+                        each object, in pixels)
+        obj_bbox_aspect : float64 array, shape (n_objects,) (the bbox aspect
+                          ratio, width / height, of each object; NaN for a
+                          degenerate bbox)
+    '''
+
+    def __init__(self, img_names, n_vrs_per_img, n_objects_per_img,
+                 n_obj_cls_per_img, n_prd_per_img, cls_n_vrs_as_subject,
+                 cls_n_vrs_as_object, cls_n_images, cls_n_objects,
+                 prd_n_vrs, prd_n_images, obj_cls, obj_bbox_area,
+                 obj_bbox_aspect):
+        self.img_names = tuple(img_names)
+        self.n_vrs_per_img = n_vrs_per_img
+        self.n_objects_per_img = n_objects_per_img
+        self.n_obj_cls_per_img = n_obj_cls_per_img
+        self.n_prd_per_img = n_prd_per_img
+        self.cls_n_vrs_as_subject = cls_n_vrs_as_subject
+        self.cls_n_vrs_as_object = cls_n_vrs_as_object
+        self.cls_n_images = cls_n_images
+        self.cls_n_objects = cls_n_objects
+        self.prd_n_vrs = prd_n_vrs
+        self.prd_n_images = prd_n_images
+        self.obj_cls = obj_cls
+        self.obj_bbox_area = obj_bbox_area
+        self.obj_bbox_aspect = obj_bbox_aspect
+
+    @classmethod
+    def from_annotations(cls, vrd_anno, n_object_classes=None,
+                         n_predicates=None):
+        '''
+        Compute the profile of a set of annotations.
+
+        Parameters:
+            vrd_anno : dictionary (or VRDAnnotationView, or
+                       VRDAnnotationStore, or VRDSceneGraphStore)
+            n_object_classes : integer (the number of NeSy4VRD object
+                               classes; by default, one more than the
+                               largest object class index used)
+            n_predicates : integer (the number of NeSy4VRD predicates; by
+                           default, one more than the largest predicate
+                           index used)
+
+        Returns:
+            profile : DatasetProfile
+        '''
+
+        sg = vrdsg.get_scene_graph(list(vrd_anno.keys()), vrd_anno)
+
+        sub_cls = sg.obj_cls[sg.get_object_rows(sg.rel_sub, sg.rel_img_idx)]
+        obj_cls = sg.obj_cls[sg.get_object_rows(sg.rel_obj, sg.rel_img_idx)]
+
+        if n_object_classes is None:
+            n_object_classes = int(sg.obj_cls.max()) + 1 if sg.n_objects > 0 else 0
+        if n_predicates is None:
+            n_predicates = int(sg.rel_prd.max()) + 1 if sg.n_vrs > 0 else 0
+
+        # per image and per class/predicate counts
+        n_vrs_per_img = np.diff(sg.rel_offsets)
+        n_objects_per_img = np.diff(sg.obj_offsets)
+        n_obj_cls_per_img, cls_n_images = count_distinct_pairs(sg.obj_img_idx,
+                                                               sg.obj_cls,
+                                                               sg.n_images,
+                                                               n_object_classes)
+        n_prd_per_img, prd_n_images = count_distinct_pairs(sg.rel_img_idx,
+                                                           sg.rel_prd,
+                                                           sg.n_images,
+                                                           n_predicates)
+
+        cls_n_vrs_as_subject = np.bincount(sub_cls, minlength=n_object_classes)
+        cls_n_vrs_as_object = np.bincount(obj_cls, minlength=n_object_classes)
+        cls_n_objects = np.bincount(sg.obj_cls, minlength=n_object_classes)
+        prd_n_vrs = np.bincount(sg.rel_prd, minlength=n_predicates)
+
+        # bbox geometry, per object; bbox format: [ymin, ymax, xmin, xmax]
+        bbox = sg.bbox[sg.get_bbox_rows(sg.obj_bbox_id, sg.obj_img_idx)].astype(np.int64)
+        heights = bbox[:, 1] - bbox[:, 0]
+        widths = bbox[:, 3] - bbox[:, 2]
+        obj_bbox_area = np.clip(heights, 0, None) * np.clip(widths, 0, None)
+        obj_bbox_aspect = np.full(len(bbox), np.nan)
+        valid = (heights > 0) & (widths > 0)
+        obj_bbox_aspect[valid] = widths[valid] / heights[valid]
+
+        return cls(sg.img_names, n_vrs_per_img, n_objects_per_img,
+                   n_obj_cls_per_img, n_prd_per_img, cls_n_vrs_as_subject,
+                   cls_n_vrs_as_object, cls_n_images, cls_n_objects,
+                   prd_n_vrs, prd_n_images, sg.obj_cls.copy(), obj_bbox_area,
+                   obj_bbox_aspect)
+
+    @property
+    def n_images(self):
+        return len(self.img_names)
+
+    @property
+    def n_vrs(self):
+        return int(self.n_vrs_per_img.sum())
+
+    @property
+    def n_objects(self):
+        return len(self.obj_cls)
+
+    def get_images_with_n_vrs(self, n_vrs):
+        '''
+        Return the names of the images having a given number of VRs.
+        '''
+        return [self.img_names[idx] for idx in
+                np.flatnonzero(self.n_vrs_per_img == n_vrs).tolist()]
+
+    def get_class_bbox_areas(self, cls_idx):
+        '''
+        Return the bbox areas of the objects of an object class.
+        '''
+        return self.obj_bbox_area[self.obj_cls == cls_idx]
+
+    def get_class_bbox_aspects(self, cls_idx):
+        '''
+        Return the bbox aspect ratios (width / height) of the objects of an
+        object class (excluding any degenerate bboxes).
+        '''
+        aspects = self.obj_bbox_aspect[self.obj_cls == cls_idx]
+        return aspects[~np.isnan(aspects)]
+
+    def get_class_bbox_summary(self):
+        '''
+        Summarise the bbox areas and aspect ratios of the objects of each
+        object class.
+
+        Returns:
+            summary : float64 array, shape (n_object_classes, 4); the
+                      columns are the median area, the mean area, the
+                      median aspect ratio and the mean aspect ratio of the
+                      objects of each class (NaN for a class without
+                      objects)
+        '''
+
+        summary = np.full((len(self.cls_n_objects), 4), np.nan)
+        for cls_idx in np.flatnonzero(self.cls_n_objects).tolist():
+            areas = self.get_class_bbox_areas(cls_idx)
+            summary[cls_idx, 0] = np.median(areas)
+            summary[cls_idx, 1] = np.mean(areas)
+            aspects = self.get_class_bbox_aspects(cls_idx)
+            if len(aspects) > 0:
+                summary[cls_idx, 2] = np.median(aspects)
+                summary[cls_idx, 3] = np.mean(aspects)
+
+        return summary
+
+    def save(self, path, header):
+        '''
+        Save the profile to a file on disk, in NumPy .npz format, along
+        with a JSON header that identifies what it was computed from.
+        The file is written to a temporary file first and then moved into
+        place.
+
+        Parameters:
+            path : string (path of the saved profile)
+            header : dictionary (JSON serialisable)
+        '''
+        arrays = {name: getattr(self, name) for name in profile_array_names}
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as fp:
+            np.savez(fp, header=np.array(json.dumps(header)),
+                     img_names=np.array(self.img_names, dtype=str), **arrays)
+        os.replace(tmp_path, path)
+        return None
+
+    @classmethod
+    def load(cls, path, header):
+        '''
+        Load a profile saved to a file on disk, but only if it was saved
+        with a header equal to 'header'; the arrays of the profile are not
+        read otherwise.
+
+        Returns:
+            profile : DatasetProfile (or None, if the file does not exist
+                      or its header differs)
+        '''
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                if json.loads(str(data['header'])) != header:
+                    return None
+                arrays = {name: data[name] for name in profile_array_names}
+                img_names = data['img_names'].tolist()
+        except (ValueError, KeyError, OSError):
+            return None
+        return cls(img_names, **arrays)
+
+
+#%%
+
+def load_dataset_profile(path, vrd_anno=None, n_object_classes=None,
+                         n_predicates=None, profile_path=None):
+    '''
+    Load the profile of an annotations file, computing (and saving) it only
+    if the annotations file, or the numbers of object classes and
+    predicates, have changed since it was last computed.
+
+    Parameters:
+        path : string (path to annotations file in annotations directory)
+        vrd_anno : the annotations loaded from the file (if None, and the
+                   profile needs to be computed, they are loaded)
+        n_object_classes : integer (see DatasetProfile.from_annotations())
+        n_predicates : integer (see DatasetProfile.from_annotations())
+        profile_path : string (path of the saved profile; by default, a
+                       file in the cache directory alongside the
+                       annotations file (see nesy4vrd_utils.get_cache_path())
+                       named after the annotations file, with
+                       '.profile.npz' appended)
+
+    Returns:
+        profile : DatasetProfile
+    '''
+
+    if profile_path is None:
+        profile_path = vrdu.get_cache_path(path, '.profile.npz')
+
+    header = {'format_version': profile_format_version,
+              'anno_file_hash': vrdu.get_file_hash(path),
+              'n_object_classes': n_object_classes,
+              'n_predicates': n_predicates}
+
+    profile = DatasetProfile.load(profile_path, header)
+    if profile is not None:
+        return profile
+
+    if vrd_anno is None:
+        vrd_anno = vrdu.load_VRD_image_annotations(path)
+
+    profile = DatasetProfile.from_annotations(vrd_anno, n_object_classes,
+                                              n_predicates)
+    profile.save(profile_path, header)
+
+    return profile
@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: David Herron
+"""
+
+'''
+This module defines the image metadata manifest of a directory of VRD
+images.
+
+An ImageManifest maps each image name (filename) to an ImageRecord that
+records the image's:
+    width, height : the size of the image, in pixels (W x H)
+    file_size : the size of the image file, in bytes
+    mtime_ns : the modification time of the image file, in nanoseconds
+    sha256 : a hash of the content of the image file (or None)
+
+The width and height of an image are read from the header of its file
+(the SOFn marker segment of a JPEG, or the IHDR chunk of a PNG), so no
+image is ever decoded.
+
+A manifest is saved as a sidecar file alongside the image directory (by
+default, the directory path with '.manifest.json' appended). Rebuilding
+a manifest is incremental: only the files that are new, or whose
+modification time or size have changed since the manifest was last
+built, are read again. The files are read by a pool of threads.
+
+DEPENDENCIES:
+This module has dependencies on Python packages:
+    NumPy
+'''
+
+#%%
+
+import os
+import json
+import struct
+import hashlib
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+#%%
+
+manifest_format_version = 1
+
+image_file_extensions = ('.jpg', '.jpeg', '.png')
+
+ImageRecord = namedtuple('ImageRecord', ['width', 'height', 'file_size',
+                                         'mtime_ns', 'sha256'])
+
+# in-memory cache of loaded (or built) manifests; a manifest file path maps
+# to its manifest
+image_manifests = {}
+
+
+#%%
+
+def read_JPEG_size(fp):
+    '''
+    Read the size (W x H) of a JPEG image from the SOFn marker segment of
+    its header.
+    '''
+
+    if fp.read(2) != b'\xff\xd8':
+        raise ValueError('not a JPEG file')
+
+    while True:
+        byte = fp.read(1)
+        if byte == b'':
+            raise ValueError('JPEG SOFn marker not found')
+        if byte != b'\xff':
+            continue
+        # skip any fill bytes preceding the marker
+        marker = fp.read(1)
+        while marker == b'\xff':
+            marker = fp.read(1)
+        marker = ord(marker) if marker else None
+        if marker is None:
+            raise ValueError('JPEG SOFn marker not found')
+        # markers without a segment
+        if marker == 0x01 or 0xd0 <= marker <= 0xd9:
+            continue
+        length = struct.unpack('>H', fp.read(2))[0]
+        # SOF0..SOF15, excluding DHT (0xc4), JPG (0xc8) and DAC (0xcc)
+        if 0xc0 <= marker <= 0xcf and not marker in (0xc4, 0xc8, 0xcc):
+            height, width = struct.unpack('>xHH', fp.read(5))
+            return width, height
+        fp.seek(length - 2, os.SEEK_CUR)
+
+
+def read_PNG_size(fp):
+    '''
+    Read the size (W x H) of a PNG image from its IHDR chunk.
+    '''
+
+    header = fp.read(24)
+    if header[:8] != b'\x89PNG\r\n\x1a\n' or header[12:16] != b'IHDR':
+        raise ValueError('not a PNG file')
+
+    width, height = struct.unpack('>II', header[16:24])
+
+    return width, height
+
+
+def read_image_size(path):
+    '''
+    Read the size (W x H) of a JPEG or PNG image from the header of its
+    file, without decoding the image.
+
+    Returns:
+        size : tuple (width, height)
+    '''
+
+    with open(path, 'rb') as fp:
+        signature = fp.read(2)
+        fp.seek(0)
+        if signature == b'\xff\xd8':
+            return read_JPEG_size(fp)
+        if signature == b'\x89P':
+            return read_PNG_size(fp)
+
+    raise ValueError(f'image file format not recognised: {path}')
+
+
+def read_image_record(path, hash_contents=True):
+    '''
+    Read the ImageRecord of an image file.
+    '''
+
+    stat = os.stat(path)
+
+    width, height = read_image_size(path)
+
+    sha256 = None
+    if hash_contents:
+        hasher = hashlib.sha256()
+        with open(path, 'rb') as fp:
+            for chunk in iter(lambda: fp.read(1 << 20), b''):
+                hasher.update(chunk)
+        sha256 = hasher.hexdigest()
+
+    return ImageRecord(width, height, stat.st_size, stat.st_mtime_ns, sha256)
+
+
+#%%
+
+class ImageManifest(dict):
+    '''
+    The image metadata manifest of a directory of VRD images: a dictionary
+    mapping image names to ImageRecords.
+
+    Attributes:
+        imagedir : string (the path of the image directory)
+    '''
+
+    def __init__(self, imagedir, records=None):
+        super().__init__(records or {})
+        self.imagedir = imagedir
+
+    def get_image_size(self, imname):
+        '''
+        Return the size of an image as (W x H).
+        '''
+        record = self[imname]
+        return record.width, record.height
+
+    def save(self, path):
+        '''
+        Save the manifest to a file on disk, in JSON format.
+        '''
+        data = {'format_version': manifest_format_version,
+                'images': {imname: list(record) for imname, record in self.items()}}
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as fp:
+            json.dump(data, fp)
+        os.replace(tmp_path, path)
+        return None
+
+    @staticmethod
+    def load(path, imagedir):
+        '''
+        Load a manifest saved to a file on disk.
+
+        Returns:
+            manifest : ImageManifest (or None, if the file was saved in a
+                       different format version)
+        '''
+        with open(path, 'r') as fp:
+            data = json.load(fp)
+        if data.get('format_version') != manifest_format_version:
+            return None
+        records = {imname: ImageRecord(*record)
+                   for imname, record in data['images'].items()}
+        return ImageManifest(imagedir, records)
+
+
+def get_manifest_path(imagedir):
+    '''
+    Return the default path of the manifest of an image directory.
+    '''
+    return os.path.normpath(imagedir) + '.manifest.json'
+
+
+#%%
+
+def build_image_manifest(imagedir, manifest_path=None, n_workers=None,
+                         hash_contents=True):
+    '''
+    Build (or incrementally rebuild) the image metadata manifest of a
+    directory of VRD images, and save it.
+
+    Only the image files that are not in the saved manifest, or whose
+    modification time or size differ from those recorded in it, are read;
+    the records of image files that no longer exist are dropped.
+
+    Parameters:
+        imagedir : string (the path of the image directory)
+        manifest_path : string (the path of the manifest file; by default,
+                        the image directory path with '.manifest.json'
+                        appended)
+        n_workers : integer (the number of threads reading image files; by
+                    default, as chosen by ThreadPoolExecutor)
+        hash_contents : boolean (whether to record a hash of the content
+                        of each image file)
+
+    Returns:
+        manifest : ImageManifest
+        n_read : integer (the number of image files that were read)
+    '''
+
+    if manifest_path is None:
+        manifest_path = get_manifest_path(imagedir)
+
+    previous = None
+    if os.path.exists(manifest_path):
+        previous = ImageManifest.load(manifest_path, imagedir)
+    if previous is None:
+        previous = ImageManifest(imagedir)
+
+    manifest = ImageManifest(imagedir)
+    to_read = []
+    with os.scandir(imagedir) as entries:
+        for entry in entries:
+            if not entry.is_file():
+                continue
+            if not entry.name.lower().endswith(image_file_extensions):
+                continue
+            stat = entry.stat()
+            record = previous.get(entry.name)
+            if (record is not None and
+                record.mtime_ns == stat.st_mtime_ns and
+                record.file_size == stat.st_size and
+                (record.sha256 is not None or not hash_contents)):
+                manifest[entry.name] = record
+            else:
+                to_read.append(entry.name)
+
+    def read_record(imname):
+        path = os.path.join(imagedir, imname)
+        return read_image_record(path, hash_contents)
+
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        for imname, record in zip(to_read, executor.map(read_record, to_read)):
+            manifest[imname] = record
+
+    # keep the manifest in a stable order, for reproducible files
+    manifest = ImageManifest(imagedir, sorted(manifest.items()))
+
+    if to_read or len(manifest) != len(previous):
+        manifest.save(manifest_path)
+
+    image_manifests[manifest_path] = manifest
+
+    return manifest, len(to_read)
+
+
+def get_image_manifest(imagedir, manifest_path=None):
+    '''
+    Get the saved manifest of an image directory (without rebuilding it).
+
+    Returns:
+        manifest : ImageManifest (or None, if no manifest has been built)
+    '''
+
+    if manifest_path is None:
+        manifest_path = get_manifest_path(imagedir)
+
+    manifest = image_manifests.get(manifest_path)
+    if manifest is None and os.path.exists(manifest_path):
+        manifest = ImageManifest.load(manifest_path, imagedir)
+        if manifest is not None:
+            image_manifests[manifest_path] = manifest
+
+    return manifest
+
+
+#%%
+
+def get_image_sizes(img_names, imagedir, n_workers=None):
+    '''
+    Get the sizes of a sequence of images, as a table.
+
+    The sizes are taken from the saved manifest of the image directory,
+    if there is one; the sizes of any images that are not in the manifest
+    are read from the headers of their image files, by a pool of threads.
+
+    Returns:
+        sizes : int64 array, shape (len(img_names), 2), holding the
+                (W, H) of each image, in the order of 'img_names'
+    '''
+
+    sizes = np.zeros((len(img_names), 2), dtype=np.int64)
+
+    manifest = get_image_manifest(imagedir)
+    if manifest is None:
+        manifest = {}
+
+    to_read = []
+    for idx, imname in enumerate(img_names):
+        record = manifest.get(imname)
+        if record is None:
+            to_read.append(idx)
+        else:
+            sizes[idx] = (record.width, record.height)
+
+    def read_size(idx):
+        return read_image_size(os.path.join(imagedir, img_names[idx]))
+
+    if to_read:
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            for idx, size in zip(to_read, executor.map(read_size, to_read)):
+                sizes[idx] = size
+
+    return sizes
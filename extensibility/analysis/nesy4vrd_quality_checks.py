@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: David Herron
+"""
+
+'''
+This module runs the quality verification checks on the NeSy4VRD visual
+relationship annotations of the VRD images, all together, in one pass
+over a columnar (VRDAnnotationStore) form of the annotations.
+
+The checks are those of the quality verification analyses of the
+annotations analysis script (nesy4vrd_annotations_analysis.py). Each
+check flags individual visual relationships (VRs):
+    'flawed_inverse' : the VR and another VR of the image relate the same
+        two bboxes, with the same (but swapped) pair of different object
+        classes; one of the two likely needs its bboxes swapped (see
+        vrdu.get_images_with_target_vr_F())
+    'duplicate' : the VR has an exact duplicate in the image
+    'identical_bboxes' : the 'subject' and 'object' bboxes of the VR are
+        identical
+    'multiple_object_classes' : a bbox of the VR has been assigned more
+        than one object class in the image
+    'degenerate_bbox' : a bbox of the VR is degenerate (NOT ymin < ymax, or
+        NOT xmin < xmax)
+    'out_of_bounds_bbox' : a bbox of the VR does not lie within the bounds
+        of its image (checked only if an image directory is given)
+
+Unlike the individual vrdu.get_images_with_* functions, which report (for
+some checks) only the first problem found in each image, the checks here
+report every VR having a problem, in a QualityFindings table.
+
+All of the checks concern the VRs of one image at a time, so the images
+are processed in independent chunks; for large annotation sets, the
+chunks are processed in a pool of worker processes.
+
+DEPENDENCIES:
+This module has dependencies on Python packages:
+    NumPy
+'''
+
+#%%
+
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import nesy4vrd_anno_store as vrdas
+import nesy4vrd_image_manifest as vrdim
+import nesy4vrd_utils as vrdu
+
+
+#%%
+
+quality_check_names = ('flawed_inverse', 'duplicate', 'identical_bboxes',
+                       'multiple_object_classes', 'degenerate_bbox',
+                       'out_of_bounds_bbox')
+
+# the number of images per chunk
+quality_check_chunk_size = 2000
+
+# the minimum number of VRs worth checking in parallel
+min_parallel_vrs = 200000
+
+
+#%%
+
+class QualityFindings():
+    '''
+    The findings of the quality verification checks: a table with one row
+    per VR having at least one finding, and one boolean column per check.
+
+    Attributes:
+        img_names : tuple of strings (the names of the images checked)
+        img_idx : int64 array (for each row, the index of its image in
+                  'img_names')
+        vr_idx : int64 array (for each row, the index of its VR within
+                 the image's list of VRs)
+        flags : boolean array, shape (n_rows, len(check_names))
+        check_names : tuple of strings (the names of the checks performed)
+    '''
+
+    def __init__(self, img_names, img_idx, vr_idx, flags, check_names):
+        self.img_names = tuple(img_names)
+        self.img_idx = img_idx
+        self.vr_idx = vr_idx
+        self.flags = flags
+        self.check_names = tuple(check_names)
+
+    def __len__(self):
+        return len(self.vr_idx)
+
+    def get_check_mask(self, check_name):
+        '''
+        Return the boolean column (over the rows) of a named check.
+        '''
+        if not check_name in self.check_names:
+            raise ValueError(f"quality check '{check_name}' not performed")
+        return self.flags[:, self.check_names.index(check_name)]
+
+    def get_vr_indices(self, check_name):
+        '''
+        Find the images having VRs flagged by a named check.
+
+        Returns:
+            images_with_target : list of strings (image names, in the
+                                 order in which they were checked)
+            vr_indices : list (one entry per image) of lists of integers
+                         (the indices of the image's flagged VRs)
+        '''
+
+        mask = self.get_check_mask(check_name)
+
+        images_with_target = []
+        vr_indices = []
+        last_img_idx = -1
+        for img_idx, vr_idx in zip(self.img_idx[mask].tolist(),
+                                   self.vr_idx[mask].tolist()):
+            if img_idx != last_img_idx:
+                images_with_target.append(self.img_names[img_idx])
+                vr_indices.append([])
+                last_img_idx = img_idx
+            vr_indices[-1].append(vr_idx)
+
+        return images_with_target, vr_indices
+
+    def get_image_findings(self, imname):
+        '''
+        Return the findings for the VRs of a named image.
+
+        Returns:
+            findings : list of (vr_idx, list of check names) tuples
+        '''
+
+        img_idx = self.img_names.index(imname)
+        rows = np.flatnonzero(self.img_idx == img_idx)
+
+        return [(int(self.vr_idx[row]),
+                 [name for name, flag in zip(self.check_names, self.flags[row])
+                  if flag])
+                for row in rows]
+
+    def summary(self):
+        '''
+        Summarise the findings.
+
+        Returns:
+            summary : dictionary mapping each check name to a tuple
+                      (number of images, number of VRs) flagged
+        '''
+
+        summary = {}
+        for idx, check_name in enumerate(self.check_names):
+            mask = self.flags[:, idx]
+            summary[check_name] = (len(np.unique(self.img_idx[mask])),
+                                   int(np.count_nonzero(mask)))
+
+        return summary
+
+
+#%%
+
+def get_key_ids(keys):
+    '''
+    Number the distinct rows of an integer array, giving each row the
+    number of its distinct value.
+    '''
+
+    _, key_ids = np.unique(keys, axis=0, return_inverse=True)
+
+    return key_ids.reshape(-1)
+
+
+def check_store_chunk(store, img_start, img_end, image_sizes=None):
+    '''
+    Perform the quality checks on the VRs of the images of a store with
+    indices 'img_start' to 'img_end' (exclusive).
+
+    Parameters:
+        image_sizes : int64 array, shape (store.n_images, 2), holding the
+                      (W, H) of each image of the store (or None, to skip
+                      the 'out_of_bounds_bbox' check)
+
+    Returns:
+        rows : int64 array (the store rows of the VRs having at least one
+               finding)
+        flags : boolean array, shape (len(rows), len(quality_check_names))
+    '''
+
+    row_start = int(store.offsets[img_start])
+    row_end = int(store.offsets[img_end])
+    n_rows = row_end - row_start
+
+    img = store.img_idx[row_start:row_end].astype(np.int64)[:, np.newaxis]
+    sub_cls = store.sub_cls[row_start:row_end].astype(np.int64)[:, np.newaxis]
+    prd = store.prd[row_start:row_end].astype(np.int64)[:, np.newaxis]
+    obj_cls = store.obj_cls[row_start:row_end].astype(np.int64)[:, np.newaxis]
+    sub_bbox = store.sub_bbox[row_start:row_end].astype(np.int64)
+    obj_bbox = store.obj_bbox[row_start:row_end].astype(np.int64)
+
+    flags = np.zeros((n_rows, len(quality_check_names)), dtype=bool)
+    if n_rows == 0:
+        return np.zeros(0, dtype=np.int64), flags
+
+    # 'flawed_inverse': another VR of the image has the same bboxes and
+    # the swapped (different) pair of object classes
+    keys = np.hstack([img, sub_bbox, obj_bbox, sub_cls, obj_cls])
+    swapped_keys = np.hstack([img, sub_bbox, obj_bbox, obj_cls, sub_cls])
+    key_ids = get_key_ids(np.vstack([keys, swapped_keys]))
+    present = np.zeros(int(key_ids.max()) + 1, dtype=bool)
+    present[key_ids[n_rows:]] = True
+    flags[:, 0] = present[key_ids[:n_rows]] & (sub_cls[:, 0] != obj_cls[:, 0])
+
+    # 'duplicate': another VR of the image is identical
+    key_ids = get_key_ids(np.hstack([img, sub_cls, sub_bbox, prd,
+                                     obj_cls, obj_bbox]))
+    flags[:, 1] = np.bincount(key_ids)[key_ids] > 1
+
+    # 'identical_bboxes'
+    flags[:, 2] = np.all(sub_bbox == obj_bbox, axis=1)
+
+    # 'multiple_object_classes': count the distinct classes assigned to
+    # each distinct bbox of each image, over both roles
+    objects = np.vstack([np.hstack([img, sub_bbox, sub_cls]),
+                         np.hstack([img, obj_bbox, obj_cls])])
+    bbox_ids = get_key_ids(objects[:, :5])
+    _, first_rows = np.unique(objects, axis=0, return_index=True)
+    n_classes = np.bincount(bbox_ids[first_rows])
+    multiple = n_classes[bbox_ids] > 1
+    flags[:, 3] = multiple[:n_rows] | multiple[n_rows:]
+
+    # 'degenerate_bbox'
+    flags[:, 4] = ((sub_bbox[:, 0] >= sub_bbox[:, 1]) |
+                   (sub_bbox[:, 2] >= sub_bbox[:, 3]) |
+                   (obj_bbox[:, 0] >= obj_bbox[:, 1]) |
+                   (obj_bbox[:, 2] >= obj_bbox[:, 3]))
+
+    # 'out_of_bounds_bbox'
+    if image_sizes is not None:
+        sizes = image_sizes[img[:, 0]]
+        flags[:, 5] = (vrdu.get_out_of_bounds_bbox_mask(sub_bbox, sizes) |
+                       vrdu.get_out_of_bounds_bbox_mask(obj_bbox, sizes))
+
+    hits = np.flatnonzero(flags.any(axis=1))
+
+    return hits + row_start, flags[hits]
+
+
+#%% parallel execution
+
+# The data shared, read-only, with the worker processes of a parallel
+# run. Worker processes are forked, so they inherit it rather than
+# receiving a pickled copy.
+_shared_quality_check_data = None
+
+
+def _check_store_chunk(chunk):
+    store, image_sizes = _shared_quality_check_data
+    return check_store_chunk(store, chunk[0], chunk[1], image_sizes)
+
+
+def get_n_workers(n_workers, n_vrs):
+    '''
+    Determine the number of worker processes for checking 'n_vrs' VRs.
+    A result of 1 means check serially.
+    '''
+
+    # worker processes are forked; where fork is unavailable (e.g. Windows),
+    # the calling scripts could not safely be re-imported by spawned workers
+    if not 'fork' in multiprocessing.get_all_start_methods():
+        return 1
+
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+
+    # for small annotation sets, starting workers costs more than it saves
+    if n_vrs < min_parallel_vrs:
+        return 1
+
+    return max(1, n_workers)
+
+
+#%%
+
+def run_quality_checks(img_names, anno, imagedir=None, n_workers=None,
+                       chunk_size=None):
+    '''
+    Run all of the quality verification checks on the VRs of the named
+    images, in one pass.
+
+    Parameters:
+        img_names : list of strings (image names)
+        anno : dictionary (or VRDAnnotationView, or VRDAnnotationStore)
+        imagedir : string (the path of the image directory, for the
+                   'out_of_bounds_bbox' check; the image sizes are read
+                   from the image metadata manifest of the directory, or
+                   from the headers of the image files; if None, the check
+                   is not performed)
+        n_workers : integer (the number of worker processes; 1 means
+                    always check serially; None means use all CPUs, for
+                    large annotation sets)
+        chunk_size : integer (the number of images per chunk)
+
+    Returns:
+        findings : QualityFindings
+    '''
+
+    global _shared_quality_check_data
+
+    img_names = list(img_names)
+    store = vrdas.get_annotation_store_for_images(img_names, anno)
+
+    check_names = quality_check_names
+    image_sizes = None
+    if imagedir is None:
+        check_names = quality_check_names[:-1]
+    else:
+        image_sizes = vrdim.get_image_sizes(img_names, imagedir)
+
+    if chunk_size is None:
+        chunk_size = quality_check_chunk_size
+    chunks = [(img_start, min(img_start + chunk_size, store.n_images))
+              for img_start in range(0, store.n_images, chunk_size)]
+
+    n_workers = get_n_workers(n_workers, store.n_vrs)
+    if n_workers > 1 and len(chunks) > 1:
+        _shared_quality_check_data = (store, image_sizes)
+        try:
+            mp_context = multiprocessing.get_context('fork')
+            with ProcessPoolExecutor(max_workers=n_workers,
+                                     mp_context=mp_context) as executor:
+                results = list(executor.map(_check_store_chunk, chunks))
+        finally:
+            _shared_quality_check_data = None
+    else:
+        results = [check_store_chunk(store, img_start, img_end, image_sizes)
+                   for img_start, img_end in chunks]
+
+    if len(results) > 0:
+        rows = np.concatenate([result[0] for result in results])
+        flags = np.concatenate([result[1] for result in results])
+    else:
+        rows = np.zeros(0, dtype=np.int64)
+        flags = np.zeros((0, len(quality_check_names)), dtype=bool)
+
+    img_idx = store.img_idx[rows].astype(np.int64)
+    vr_idx = rows - store.offsets[img_idx]
+
+    # drop the rows flagged only by checks not performed
+    flags = flags[:, :len(check_names)]
+    keep = flags.any(axis=1)
+
+    return QualityFindings(img_names, img_idx[keep], vr_idx[keep], flags[keep],
+                           check_names)
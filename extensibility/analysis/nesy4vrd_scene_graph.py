@@ -0,0 +1,386 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: David Herron
+"""
+
+'''
+This module defines a normalised (scene graph) form of the NeSy4VRD visual
+relationship annotations of the VRD images.
+
+In the NeSy4VRD annotations, each visual relationship (VR) repeats the
+full object class and bbox of both of its objects ('subject' and
+'object'), so an object that takes part in several VRs is annotated
+several times over. A VRDSceneGraphStore records each distinct thing
+once, in three tables, each of which holds a contiguous block of rows for
+each image:
+    bboxes : the distinct bboxes of the image, [ymin, ymax, xmin, xmax]
+    objects : the distinct objects of the image; an object is a
+              (bbox, object class) pair, and refers to its bbox by the
+              bbox's position in the image's block of bboxes
+    relations : the VRs of the image, in annotations order, as
+                (subject object, predicate, object object) triples whose
+                objects are given by their positions in the image's block
+                of objects (their object ids)
+
+Bboxes and objects are numbered in the order in which they first appear
+in the VRs of their image ('subject' before 'object'). A bbox that has
+been assigned more than one object class is shared by more than one
+object. The conversion to and from the VR format is lossless.
+
+Code that identifies objects by their bboxes alone (as the NeSy4VRD KG
+does) works with the bboxes and takes the class of the first object
+having each bbox as the class of the object (see get_image_nodes()).
+
+DEPENDENCIES:
+This module has dependencies on Python packages:
+    NumPy
+'''
+
+#%%
+
+import numpy as np
+
+import nesy4vrd_anno_store as vrdas
+
+
+#%%
+
+def intern_rows(keys, group_idx, n_groups):
+    '''
+    Number the distinct rows of an integer array, in order of first
+    appearance, within each group of rows.
+
+    Parameters:
+        keys : int64 array, shape (n, k) (the group index of each row must
+               be one of its columns)
+        group_idx : int64 array, shape (n,) (the group index of each row;
+                    the rows of each group are contiguous, and the groups
+                    are in order)
+        n_groups : integer
+
+    Returns:
+        ids : int64 array, shape (n,) (the number of the distinct value of
+              each row, within its group)
+        first_rows : int64 array (the row of the first appearance of each
+                     distinct value, in order)
+        offsets : int64 array, shape (n_groups+1,) (the distinct values of
+                  group g are numbered offsets[g+1] - offsets[g])
+    '''
+
+    offsets = np.zeros(n_groups + 1, dtype=np.int64)
+    if len(keys) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), offsets
+
+    _, first_rows, inverse = np.unique(keys, axis=0, return_index=True,
+                                       return_inverse=True)
+    inverse = inverse.reshape(-1)
+
+    # renumber the distinct values in order of first appearance; because
+    # the groups are contiguous and in order, so are their values
+    order = np.argsort(first_rows, kind='stable')
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+    first_rows = first_rows[order]
+
+    np.cumsum(np.bincount(group_idx[first_rows], minlength=n_groups),
+              out=offsets[1:])
+    ids = rank[inverse] - offsets[group_idx]
+
+    return ids, first_rows, offsets
+
+
+#%%
+
+class VRDSceneGraphStore():
+    '''
+    A normalised (scene graph) representation of a NeSy4VRD annotations
+    dictionary: per image, a table of distinct bboxes, a table of objects
+    and a table of relations.
+
+    Like a VRDAnnotationStore, a scene graph store is never modified once
+    built.
+
+    Attributes:
+        img_names : tuple of strings (image names, in annotations order)
+        bbox_offsets : int64 array, shape (n_images+1,)
+        bbox : int32 array, shape (n_bboxes, 4)
+        obj_offsets : int64 array, shape (n_images+1,)
+        obj_cls : int32 array, shape (n_objects,)
+        obj_bbox_id : int32 array, shape (n_objects,) (the position of the
+                      object's bbox in its image's block of bboxes)
+        rel_offsets : int64 array, shape (n_images+1,)
+        rel_sub : int32 array, shape (n_vrs,) (the object id of the
+                  'subject' object of each relation)
+        rel_prd : int32 array, shape (n_vrs,)
+        rel_obj : int32 array, shape (n_vrs,) (the object id of the
+                  'object' object of each relation)
+        bbox_obj_id : int32 array, shape (n_bboxes,) (the object id of the
+                      first object having each bbox)
+        bbox_n_objects : int64 array, shape (n_bboxes,) (the number of
+                         objects, i.e. object classes, having each bbox)
+    '''
+
+    def __init__(self, img_names, bbox_offsets, bbox, obj_offsets, obj_cls,
+                 obj_bbox_id, rel_offsets, rel_sub, rel_prd, rel_obj):
+
+        self.img_names = tuple(img_names)
+        self.bbox_offsets = np.asarray(bbox_offsets, dtype=np.int64)
+        self.bbox = np.asarray(bbox, dtype=np.int32).reshape(-1, 4)
+        self.obj_offsets = np.asarray(obj_offsets, dtype=np.int64)
+        self.obj_cls = np.asarray(obj_cls, dtype=np.int32)
+        self.obj_bbox_id = np.asarray(obj_bbox_id, dtype=np.int32)
+        self.rel_offsets = np.asarray(rel_offsets, dtype=np.int64)
+        self.rel_sub = np.asarray(rel_sub, dtype=np.int32)
+        self.rel_prd = np.asarray(rel_prd, dtype=np.int32)
+        self.rel_obj = np.asarray(rel_obj, dtype=np.int32)
+
+        for offsets in [self.bbox_offsets, self.obj_offsets, self.rel_offsets]:
+            if len(offsets) != len(self.img_names) + 1:
+                raise ValueError('offsets inconsistent with number of images')
+
+        if len(self.bbox) != self.bbox_offsets[-1]:
+            raise ValueError('bbox table length inconsistent with offsets')
+        if (len(self.obj_cls) != self.obj_offsets[-1] or
+            len(self.obj_bbox_id) != self.obj_offsets[-1]):
+            raise ValueError('object table length inconsistent with offsets')
+        for column in [self.rel_sub, self.rel_prd, self.rel_obj]:
+            if len(column) != self.rel_offsets[-1]:
+                raise ValueError('relation table length inconsistent with offsets')
+
+        # the image index of each row of each table, derived from the offsets
+        image_idxs = np.arange(len(self.img_names), dtype=np.int32)
+        self.bbox_img_idx = np.repeat(image_idxs, np.diff(self.bbox_offsets))
+        self.obj_img_idx = np.repeat(image_idxs, np.diff(self.obj_offsets))
+        self.rel_img_idx = np.repeat(image_idxs, np.diff(self.rel_offsets))
+
+        # the first object having each bbox, and the number of objects
+        # having each bbox
+        obj_bbox_rows = self.get_bbox_rows(self.obj_bbox_id, self.obj_img_idx)
+        self.bbox_n_objects = np.bincount(obj_bbox_rows,
+                                          minlength=len(self.bbox))
+        _, bbox_obj_rows = np.unique(obj_bbox_rows, return_index=True)
+        self.bbox_obj_id = (bbox_obj_rows -
+                            self.obj_offsets[self.bbox_img_idx]).astype(np.int32)
+
+        # the position (index) of each image name
+        self.img_name_to_idx = {imname: idx for idx, imname in
+                                enumerate(self.img_names)}
+
+    @classmethod
+    def from_store(cls, store):
+        '''
+        Build a scene graph store from a VRDAnnotationStore.
+
+        Returns:
+            scene_graph : VRDSceneGraphStore
+        '''
+
+        n_vrs = store.n_vrs
+
+        # the objects of the VRs, 'subject' before 'object', as
+        # (image, bbox, class) rows
+        img = np.repeat(store.img_idx.astype(np.int64), 2)
+        role_bbox = np.empty((2 * n_vrs, 4), dtype=np.int64)
+        role_bbox[0::2] = store.sub_bbox
+        role_bbox[1::2] = store.obj_bbox
+        role_cls = np.empty(2 * n_vrs, dtype=np.int64)
+        role_cls[0::2] = store.sub_cls
+        role_cls[1::2] = store.obj_cls
+
+        # intern the objects
+        keys = np.hstack([img[:, np.newaxis], role_bbox, role_cls[:, np.newaxis]])
+        role_obj_id, obj_rows, obj_offsets = intern_rows(keys, img,
+                                                         store.n_images)
+
+        # intern the bboxes of the objects
+        obj_img = img[obj_rows]
+        obj_bbox_id, bbox_rows, bbox_offsets = intern_rows(keys[obj_rows, :5],
+                                                           obj_img,
+                                                           store.n_images)
+
+        return cls(store.img_names, bbox_offsets, role_bbox[obj_rows][bbox_rows],
+                   obj_offsets, role_cls[obj_rows], obj_bbox_id,
+                   store.offsets, role_obj_id[0::2], store.prd,
+                   role_obj_id[1::2])
+
+    @classmethod
+    def from_dict(cls, vrd_anno):
+        '''
+        Build a scene graph store from a NeSy4VRD annotations dictionary.
+        '''
+        return cls.from_store(vrdas.VRDAnnotationStore.from_dict(vrd_anno))
+
+    @property
+    def n_images(self):
+        return len(self.img_names)
+
+    @property
+    def n_bboxes(self):
+        return len(self.bbox)
+
+    @property
+    def n_objects(self):
+        return len(self.obj_cls)
+
+    @property
+    def n_vrs(self):
+        return len(self.rel_prd)
+
+    def __len__(self):
+        return self.n_images
+
+    def __contains__(self, imname):
+        return imname in self.img_name_to_idx
+
+    def __getitem__(self, imname):
+        return self.get_image_annotations(imname)
+
+    def get_bbox_rows(self, bbox_ids, img_idxs):
+        '''
+        Convert (image-local) bbox ids to rows of the bbox table.
+        '''
+        return self.bbox_offsets[img_idxs] + bbox_ids
+
+    def get_object_rows(self, object_ids, img_idxs):
+        '''
+        Convert (image-local) object ids to rows of the object table.
+        '''
+        return self.obj_offsets[img_idxs] + object_ids
+
+    def get_image_objects(self, imname):
+        '''
+        Return the objects of a named image.
+
+        Returns:
+            objects : list of (object_id, class, bbox) tuples (the bbox
+                      being a list [ymin, ymax, xmin, xmax])
+        '''
+
+        idx = self.img_name_to_idx[imname]
+        rows = slice(int(self.obj_offsets[idx]), int(self.obj_offsets[idx+1]))
+        bbox_rows = self.bbox_offsets[idx] + self.obj_bbox_id[rows]
+
+        return [(object_id, cls, bbox) for object_id, (cls, bbox) in
+                enumerate(zip(self.obj_cls[rows].tolist(),
+                              self.bbox[bbox_rows].tolist()))]
+
+    def get_image_relations(self, imname):
+        '''
+        Return the relations of a named image.
+
+        Returns:
+            relations : list of (subject object_id, predicate,
+                        object object_id) tuples, in annotations order
+        '''
+
+        idx = self.img_name_to_idx[imname]
+        rows = slice(int(self.rel_offsets[idx]), int(self.rel_offsets[idx+1]))
+
+        return list(zip(self.rel_sub[rows].tolist(), self.rel_prd[rows].tolist(),
+                        self.rel_obj[rows].tolist()))
+
+    def get_image_nodes(self, imname):
+        '''
+        Return the objects and relations of a named image, with objects
+        identified by their bboxes alone.
+
+        Returns:
+            bboxes : list of tuples (the distinct bboxes of the image, in
+                     order of first appearance)
+            classes : list of integers (the class of the object of each
+                      bbox; the first class annotated for the bbox)
+            vr_nodes : int64 array of shape (n_vrs, 3) - the (subject bbox,
+                       predicate, object bbox) of each VR, with bboxes given
+                       by their positions in 'bboxes'
+        '''
+
+        idx = self.img_name_to_idx[imname]
+        bbox_rows = slice(int(self.bbox_offsets[idx]),
+                          int(self.bbox_offsets[idx+1]))
+        rel_rows = slice(int(self.rel_offsets[idx]), int(self.rel_offsets[idx+1]))
+        obj_start = int(self.obj_offsets[idx])
+
+        bboxes = [tuple(bbox) for bbox in self.bbox[bbox_rows].tolist()]
+        classes = self.obj_cls[obj_start + self.bbox_obj_id[bbox_rows]].tolist()
+
+        obj_bbox_id = self.obj_bbox_id[obj_start:int(self.obj_offsets[idx+1])]
+        vr_nodes = np.stack([obj_bbox_id[self.rel_sub[rel_rows]],
+                             self.rel_prd[rel_rows],
+                             obj_bbox_id[self.rel_obj[rel_rows]]],
+                            axis=1).astype(np.int64)
+
+        return bboxes, classes, vr_nodes
+
+    def to_store(self):
+        '''
+        Convert the scene graph store back into a VRDAnnotationStore.
+        '''
+
+        sub_rows = self.get_object_rows(self.rel_sub, self.rel_img_idx)
+        obj_rows = self.get_object_rows(self.rel_obj, self.rel_img_idx)
+        obj_bbox = self.bbox[self.get_bbox_rows(self.obj_bbox_id,
+                                                self.obj_img_idx)]
+
+        return vrdas.VRDAnnotationStore(self.img_names, self.rel_offsets,
+                                        self.obj_cls[sub_rows], self.rel_prd,
+                                        self.obj_cls[obj_rows],
+                                        obj_bbox[sub_rows], obj_bbox[obj_rows])
+
+    def get_image_annotations(self, imname):
+        '''
+        Return the VRs of a named image in their standard (dictionary)
+        format, as newly created Python objects.
+        '''
+
+        objects = self.get_image_objects(imname)
+
+        imanno = []
+        for sub_id, prd, obj_id in self.get_image_relations(imname):
+            _, sub_cls, sub_bbox = objects[sub_id]
+            _, obj_cls, obj_bbox = objects[obj_id]
+            vr = {'predicate': prd,
+                  'object': {'category': obj_cls, 'bbox': list(obj_bbox)},
+                  'subject': {'category': sub_cls, 'bbox': list(sub_bbox)}}
+            imanno.append(vr)
+
+        return imanno
+
+    def to_dict(self):
+        '''
+        Convert the scene graph store back into a NeSy4VRD annotations
+        dictionary.
+        '''
+        return {imname: self.get_image_annotations(imname)
+                for imname in self.img_names}
+
+
+#%%
+
+def get_scene_graph(img_names, vrd_anno):
+    '''
+    Get a VRDSceneGraphStore holding the VRs of the named images.
+
+    If the annotations are backed by a VRDAnnotationStore, the scene graph
+    is built from a slice of the store's columns holding the named images
+    only (see nesy4vrd_anno_store.get_annotation_store_for_images()), so
+    building scene graphs for successive chunks of a large store costs
+    no more than building one for the whole store.
+
+    Parameters:
+        img_names : list of strings (image names)
+        vrd_anno : dictionary (or VRDAnnotationView, or VRDAnnotationStore,
+                   or VRDSceneGraphStore)
+
+    Returns:
+        scene_graph : VRDSceneGraphStore
+    '''
+
+    if isinstance(vrd_anno, VRDSceneGraphStore):
+        return vrd_anno
+
+    # an image named more than once is included once
+    img_names = list(dict.fromkeys(img_names))
+    store = vrdas.get_annotation_store_for_images(img_names, vrd_anno)
+
+    return VRDSceneGraphStore.from_store(store)
@@ -15,8 +15,15 @@ No function in this module modifies data files in any way.
 
 import os
 import json
+import hashlib
+import numpy as np
 from PIL import Image, ImageDraw
-import itertools
+
+import nesy4vrd_anno_store as vrdas
+import nesy4vrd_anno_index as vrdai
+import nesy4vrd_anno_binary as vrdab
+import nesy4vrd_image_manifest as vrdim
+import nesy4vrd_scene_graph as vrdsg
 
 
 #%%
@@ -77,20 +84,35 @@ def load_VRD_predicate_names(path):
 
 #%% 
 
-def load_VRD_image_annotations(path):
+def load_VRD_image_annotations(path, img_names=None):
     '''
     Load the VRD image visual relationship annotations.
        
     Parameters:
         path : string (path to annotations file in annotations directory)
+        img_names : list of strings (optional)
+            - if specified, only the annotations of the named images are
+              loaded (see load_VRD_image_annotations_subset)
     
     Returns:
         anno : dictionary
             - the keys are image names
             - the values are lists (of dictionaries)
+            - if 'path' names a NeSy4VRD binary annotations file (see 
+              module nesy4vrd_anno_binary), the annotations are memory-mapped
+              and returned as a dictionary-like VRDAnnotationView
     
     '''
 
+    if vrdab.is_binary_annotations_file(path):
+        store, _ = vrdab.load_VRD_annotations_binary(path)
+        if img_names is not None:
+            return {imname: store[imname] for imname in img_names}
+        return store.view()
+
+    if img_names is not None:
+        return load_VRD_image_annotations_subset(path, img_names)
+
     with open(path, 'r') as fp:
         annotations = json.load(fp)
     
@@ -98,12 +120,356 @@ def load_VRD_image_annotations(path):
 
 #%%
 
+def iter_VRD_image_annotations_entries(path, img_names=None, 
+                                       chunk_size=1 << 20):
+    '''
+    Stream the entries of a VRD image visual relationship annotations
+    file, without building the whole annotations dictionary in memory.
+    
+    The file is read incrementally, in chunks. Each (image name, 
+    annotations) entry of the top-level JSON object is decoded and yielded
+    in turn, along with the byte offsets of its annotations within the file.
+    
+    Parameters:
+        path : string (path to annotations file in annotations directory)
+        img_names : collection of strings (optional)
+            - if specified, the annotations of other images are decoded but
+              not yielded, and reading stops as soon as all the named images
+              have been found
+        chunk_size : integer (number of bytes to read at a time)
+    
+    Yields:
+        (imname, imanno, start, end) tuples
+            - start and end are the byte offsets of the image's annotations
+              (a JSON array) within the file
+    '''
+    
+    decoder = json.JSONDecoder()
+    whitespace = ' \t\n\r'
+    
+    if img_names is not None:
+        names_wanted = set(img_names)
+    
+    with open(path, 'rb') as fp:
+        
+        # the file is decoded as latin-1, so that character offsets within 
+        # the text are also byte offsets within the file; JSON syntax is 
+        # pure ASCII, and any non-ASCII text is re-decoded as UTF-8 below
+        buf = ''
+        base = 0     # the file offset of buf[0]
+        pos = 0      # the current position within buf
+        eof = False
+        
+        def read_more():
+            nonlocal buf, eof
+            chunk = fp.read(chunk_size)
+            if len(chunk) == 0:
+                eof = True
+            buf = buf + chunk.decode('latin-1')
+            return not eof
+        
+        def skip_whitespace():
+            nonlocal pos
+            while True:
+                while pos < len(buf) and buf[pos] in whitespace:
+                    pos += 1
+                if pos < len(buf) or not read_more():
+                    return
+        
+        def decode_next():
+            nonlocal pos
+            while True:
+                try:
+                    value, end = decoder.raw_decode(buf, pos)
+                    # a value that ends the buffer may be incomplete
+                    if end < len(buf) or eof:
+                        break
+                except json.JSONDecodeError:
+                    if eof:
+                        raise ValueError(f'malformed annotations file: {path}')
+                if not read_more() and pos >= len(buf):
+                    raise ValueError(f'malformed annotations file: {path}')
+            text = buf[pos:end]
+            if not text.isascii():
+                value = json.loads(text.encode('latin-1').decode('utf-8'))
+            start = base + pos
+            pos = end
+            return value, start, base + end
+        
+        skip_whitespace()
+        if buf[pos:pos+1] != '{':
+            raise ValueError(f'annotations file must contain a JSON object: {path}')
+        pos += 1
+        
+        while True:
+            skip_whitespace()
+            if buf[pos:pos+1] == '}':
+                break
+            if buf[pos:pos+1] == ',':
+                pos += 1
+                skip_whitespace()
+            
+            imname, _, _ = decode_next()
+            
+            skip_whitespace()
+            if buf[pos:pos+1] != ':':
+                raise ValueError(f'malformed annotations file: {path}')
+            pos += 1
+            skip_whitespace()
+            
+            imanno, start, end = decode_next()
+            
+            # discard the text consumed so far, once there is enough of it
+            if pos >= chunk_size:
+                buf = buf[pos:]
+                base += pos
+                pos = 0
+            
+            if img_names is None:
+                yield imname, imanno, start, end
+            elif imname in names_wanted:
+                yield imname, imanno, start, end
+                names_wanted.discard(imname)
+                if len(names_wanted) == 0:
+                    break
+    
+    return None
+
+#%%
+
+def iter_VRD_image_annotations(path, img_names=None):
+    '''
+    Stream (imname, imanno) pairs from a VRD image visual relationship 
+    annotations file, without building the whole annotations dictionary.
+    See iter_VRD_image_annotations_entries().
+    '''
+    
+    for imname, imanno, _, _ in iter_VRD_image_annotations_entries(path,
+                                                                   img_names):
+        yield imname, imanno
+
+#%%
+
+def get_VRD_image_annotations_offsets(path, offsets_path=None):
+    '''
+    Get the byte offsets of the annotations of each image within a VRD
+    image visual relationship annotations file.
+    
+    The offsets are saved to a small cache file (see write_cache_file()),
+    and are reused for as long as the size and modification time of the
+    annotations file are unchanged. Otherwise they are rebuilt with one
+    streaming pass over the annotations file.
+    
+    Parameters:
+        path : string (path to annotations file in annotations directory)
+        offsets_path : string (path of the cache file; by default, a file
+                       in the cache directory alongside the annotations
+                       file (see get_cache_path()) named after the
+                       annotations file, with '.offsets.json' appended)
+    
+    Returns:
+        offsets : dictionary
+            - keys are image names; values are [start, end] byte offsets
+    '''
+    
+    if offsets_path is None:
+        offsets_path = get_cache_path(path, '.offsets.json')
+    
+    stat = os.stat(path)
+    header = {'file_key': [stat.st_size, stat.st_mtime_ns]}
+    
+    offsets = read_cache_file(offsets_path, header)
+    if offsets is not None:
+        return offsets
+    
+    offsets = {}
+    for imname, _, start, end in iter_VRD_image_annotations_entries(path):
+        offsets[imname] = [start, end]
+    
+    write_cache_file(offsets_path, header, offsets)
+    
+    return offsets
+
+#%%
+
+def load_VRD_image_annotations_subset(path, img_names):
+    '''
+    Load the visual relationship annotations of a subset of the VRD images.
+    
+    The byte offsets of each image's annotations within the annotations 
+    file (see get_VRD_image_annotations_offsets) are used to read and decode
+    the annotations of the named images only.
+    
+    Parameters:
+        path : string (path to annotations file in annotations directory)
+        img_names : list of strings (image names)
+    
+    Returns:
+        anno : dictionary
+            - the keys are image names, in the order given in 'img_names'
+            - the values are lists (of dictionaries)
+    '''
+    
+    offsets = get_VRD_image_annotations_offsets(path)
+    
+    annotations = {}
+    with open(path, 'rb') as fp:
+        for imname in img_names:
+            if not imname in offsets:
+                raise KeyError(f'image name not found in annotations file: {imname}')
+            start, end = offsets[imname]
+            fp.seek(start)
+            annotations[imname] = json.loads(fp.read(end - start))
+    
+    return annotations
+
+#%%
+
+def get_file_hash(path):
+    '''
+    Calculate a hash of the content of a file, for use as a key that
+    identifies a particular version of a data file (such as an annotations
+    file).
+    
+    Returns:
+        file_hash : string (hex digest)
+    '''
+    
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(1 << 20), b''):
+            hasher.update(chunk)
+    
+    return hasher.hexdigest()
+
+#%%
+
+# the name of the directory, alongside a data file, in which the files
+# derived from it (indexes, profiles, compiled forms) are cached; the
+# name is listed in the repository's .gitignore file
+cache_dir_name = '.nesy4vrd_cache'
+
+def get_cache_path(path, suffix):
+    '''
+    Get the path of a cache file derived from a data file: a file, named
+    after the data file with 'suffix' appended, in the cache directory
+    alongside the data file. The cache directory is created if need be.
+    
+    Parameters:
+        path : string (path of the data file)
+        suffix : string (e.g. '.index.json')
+    
+    Returns:
+        cache_path : string
+    '''
+    
+    cache_dir = os.path.join(os.path.dirname(path), cache_dir_name)
+    os.makedirs(cache_dir, exist_ok=True)
+    
+    return os.path.join(cache_dir, os.path.basename(path) + suffix)
+
+
+def write_cache_file(path, header, body):
+    '''
+    Write a cache file: a one-line JSON header (which identifies what the
+    cache was built from) followed by a JSON body. The file is written to
+    a temporary file first and then moved into place.
+    '''
+    
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as fp:
+        fp.write(json.dumps(header) + '\n')
+        json.dump(body, fp)
+    os.replace(tmp_path, path)
+    
+    return None
+
+
+def read_cache_file(path, header):
+    '''
+    Read the body of a cache file written by write_cache_file(), but only
+    if its header equals 'header'; the body is not decoded otherwise.
+    
+    Returns:
+        body : the decoded JSON body (or None, if the file does not exist,
+               its header differs, or it cannot be decoded)
+    '''
+    
+    if not os.path.exists(path):
+        return None
+    
+    with open(path, 'r') as fp:
+        try:
+            saved_header = json.loads(fp.readline())
+            if saved_header != header:
+                return None
+            return json.load(fp)
+        except ValueError:
+            return None
+
+#%%
+
+index_format_version = 1
+
+def load_VRD_image_annotations_indexed(path, index_path=None):
+    '''
+    Load the VRD image visual relationship annotations as a dictionary
+    that maintains inverted indexes (an AnnotationIndex) over its content.
+    
+    The index is built once per annotations file. It is saved to disk, in
+    the cache directory alongside the annotations file, keyed by a hash of
+    that file's content, and is reused for as long as the annotations file
+    is unchanged.
+    
+    Parameters:
+        path : string (path to annotations file in annotations directory)
+        index_path : string (path of the saved index; by default, a file
+                     named after the annotations file, with '.index.json'
+                     appended, in the cache directory (see get_cache_path()))
+    
+    Returns:
+        anno : IndexedVRDAnnotations (a dictionary)
+    '''
+    
+    if index_path is None:
+        index_path = get_cache_path(path, '.index.json')
+    
+    annotations = load_VRD_image_annotations(path)
+    header = {'format_version': index_format_version,
+              'anno_file_hash': get_file_hash(path)}
+    
+    data = read_cache_file(index_path, header)
+    if data is not None:
+        index = vrdai.AnnotationIndex.from_data(data)
+    else:
+        index = vrdai.AnnotationIndex.from_annotations(annotations)
+        write_cache_file(index_path, header, index.to_data())
+    
+    return vrdai.IndexedVRDAnnotations(annotations, index)
+
+#%%
+
 def get_image_size(imname, imagedir):
+    '''
+    Get the size of an image, as (W x H).
+    
+    The size is taken from the image metadata manifest of the image
+    directory, if one has been built (see vrdim.build_image_manifest());
+    otherwise, it is read from the header of the image file.  Either way,
+    the image is not decoded.
+    '''
+
+    manifest = vrdim.get_image_manifest(imagedir)
+    if manifest is not None and imname in manifest:
+        return manifest.get_image_size(imname)
 
     path = os.path.join(imagedir, imname)
-    img = Image.open(path)  
-         
-    return img.size  # (W x H)
+    try:
+        return vrdim.read_image_size(path)
+    except ValueError:
+        # neither a JPEG nor a PNG file; let PIL work out the format
+        img = Image.open(path)
+        return img.size  # (W x H)
 
 #%%
 
@@ -311,6 +677,97 @@ def get_bboxes_and_object_classes(imgname, imganno):
     return bboxes        
         
 
+def find_bboxes_with_multiple_object_classes(scene_graph, img_names):
+    '''
+    Find the images of a scene graph store that have a bbox that has been
+    assigned more than one object class, and report the first such case
+    for each image, just as get_bboxes_and_object_classes() would.
+    
+    Parameters:
+        scene_graph : VRDSceneGraphStore
+        img_names : list of strings (image names)
+    
+    Returns:
+        images_with_target : list of strings (image names)
+        vr_indices_with_problem_bbox : list of integers (the index of the
+                                       first VR to assign a second class
+                                       to a bbox)
+        bboxes_with_multiple_classes : list of bbox tuples
+    '''
+    
+    sg = scene_graph
+    
+    # the objects that are not the first object having their bbox; within
+    # each image, objects are in order of first appearance, so the first
+    # such object of an image is the first to assign a second class
+    obj_bbox_rows = sg.get_bbox_rows(sg.obj_bbox_id, sg.obj_img_idx)
+    obj_ids = np.arange(sg.n_objects) - sg.obj_offsets[sg.obj_img_idx]
+    problem_rows = np.flatnonzero(obj_ids != sg.bbox_obj_id[obj_bbox_rows])
+    problem_imgs, first = np.unique(sg.obj_img_idx[problem_rows], 
+                                    return_index=True)
+    first_problem_rows = dict(zip(problem_imgs.tolist(), 
+                                  problem_rows[first].tolist()))
+    
+    images_with_target = []
+    vr_indices_with_problem_bbox = []
+    bboxes_with_multiple_classes = []
+    
+    for imname in img_names:
+        img_idx = sg.img_name_to_idx[imname]
+        if not img_idx in first_problem_rows:
+            continue
+        obj_row = first_problem_rows[img_idx]
+        obj_id = obj_row - sg.obj_offsets[img_idx]
+        rel_rows = slice(int(sg.rel_offsets[img_idx]), 
+                         int(sg.rel_offsets[img_idx+1]))
+        vr_mask = (sg.rel_sub[rel_rows] == obj_id) | (sg.rel_obj[rel_rows] == obj_id)
+        images_with_target.append(imname)
+        vr_indices_with_problem_bbox.append(int(np.argmax(vr_mask)))
+        bboxes_with_multiple_classes.append(tuple(sg.bbox[obj_bbox_rows[obj_row]].tolist()))
+    
+    return images_with_target, vr_indices_with_problem_bbox, bboxes_with_multiple_classes
+
+
+def get_bboxes_and_object_classes_for_images(img_names, anno):
+    '''
+    Extract the unique set of bboxes, and the object class index assigned
+    to each bbox, for each of a sequence of images (as per
+    get_bboxes_and_object_classes()), from a scene graph form of the
+    annotations, in which each distinct bbox of an image is already
+    recorded just once.
+    
+    If we encounter an image whose annotations contain a bbox that has
+    been assigned more than one object class, raise an exception.
+    
+    Returns:
+        image_bboxes : list (one entry per image) of lists of bbox tuples
+                       (in order of first appearance)
+        image_bbox_classes : list (one entry per image) of lists of object
+                             class indices
+    '''
+    
+    scene_graph = vrdsg.get_scene_graph(img_names, anno)
+    
+    res = find_bboxes_with_multiple_object_classes(scene_graph, img_names)
+    if len(res[0]) > 0:
+        raise BboxError("Image has bbox with multiple classes", 
+                        res[0][0], res[1][0], res[2][0])
+    
+    sg = scene_graph
+    bbox_classes = sg.obj_cls[sg.obj_offsets[sg.bbox_img_idx] + sg.bbox_obj_id]
+    
+    image_bboxes = []
+    image_bbox_classes = []
+    for imname in img_names:
+        img_idx = sg.img_name_to_idx[imname]
+        rows = slice(int(sg.bbox_offsets[img_idx]), 
+                     int(sg.bbox_offsets[img_idx+1]))
+        image_bboxes.append([tuple(bbox) for bbox in sg.bbox[rows].tolist()])
+        image_bbox_classes.append(bbox_classes[rows].tolist())
+    
+    return image_bboxes, image_bbox_classes
+
+
 #%%
 
 def get_object_classes_and_predicates(imganno):
@@ -391,6 +848,52 @@ def get_all_relationships_for_predicate(prd_name, imgs, img_annos,
 
     return res
 
+#%% find images in a VRDAnnotationStore
+
+def get_images_with_target_vrs_in_store(store, img_names, vr_mask):
+    '''
+    Find the images (amongst those named in 'img_names') having at least
+    one visual relationship selected by a boolean mask over the VR rows
+    of a VRDAnnotationStore.
+    
+    Parameters:
+        store : VRDAnnotationStore
+        img_names : list of strings (image names)
+        vr_mask : boolean array, one entry per VR row of the store
+    
+    Returns:
+        images_with_target : list of strings (image names, in the order
+                             in which they appear in 'img_names')
+        vr_mask : boolean array
+            - the VR mask restricted to the images named in 'img_names'
+    '''
+    
+    vr_mask = vr_mask & store.image_selection(img_names)[store.img_idx]
+    image_hits = store.images_with_vrs(vr_mask)
+    images_with_target = store.filter_img_names(img_names, image_hits)
+    
+    return images_with_target, vr_mask
+
+
+def get_vr_indices_in_store(store, img_names, vr_mask):
+    '''
+    For each named image, get the positions (indices) within the image's
+    own list of VRs of the VRs selected by a boolean mask over the VR rows
+    of a VRDAnnotationStore.
+    
+    Returns:
+        vr_indices : list (one entry per image) of lists of integers
+    '''
+    
+    vr_indices = []
+    for imname in img_names:
+        rows = store.vr_rows(imname)
+        vr_idxs = np.flatnonzero(vr_mask[rows]).tolist()
+        vr_indices.append(vr_idxs)
+    
+    return vr_indices
+
+
 #%% get all images for a given object class
 
 def get_images_with_object_class(cls_name, vrd_img_names, vrd_anno, 
@@ -400,6 +903,21 @@ def get_images_with_object_class(cls_name, vrd_img_names, vrd_anno,
     
     cls_idx = vrd_objects.index(cls_name)
     
+    index = vrdai.get_annotation_index(vrd_anno)
+    if index is not None:
+        images_with_target_cls, _ = index.get_images('cls', cls_idx, vrd_img_names)
+        annos_with_target_cls = [vrd_anno[imname].copy() for imname in images_with_target_cls]
+        return images_with_target_cls, annos_with_target_cls
+    
+    store = vrdas.get_annotation_store(vrd_anno)
+    if store is not None:
+        vr_mask = (store.sub_cls == cls_idx) | (store.obj_cls == cls_idx)
+        images_with_target_cls, _ = get_images_with_target_vrs_in_store(store, 
+                                                                        vrd_img_names,
+                                                                        vr_mask)
+        annos_with_target_cls = [vrd_anno[imname] for imname in images_with_target_cls]
+        return images_with_target_cls, annos_with_target_cls
+    
     images_with_target_cls = []
     annos_with_target_cls = []
     for idx, imname in enumerate(vrd_img_names):
@@ -424,6 +942,27 @@ def get_images_with_object_classes(cls_names, vrd_img_names, vrd_anno,
     
     cls_idxs = [vrd_objects.index(name) for name in cls_names]
     
+    index = vrdai.get_annotation_index(vrd_anno)
+    if index is not None and len(cls_idxs) > 0:
+        images_with_target_cls, _ = index.get_images('cls', cls_idxs[0], vrd_img_names)
+        for cls_idx in cls_idxs[1:]:
+            posting = index.get_posting('cls', cls_idx)
+            images_with_target_cls = [imname for imname in images_with_target_cls
+                                      if imname in posting]
+        annos_with_target_cls = [vrd_anno[imname].copy() for imname in images_with_target_cls]
+        return images_with_target_cls, annos_with_target_cls
+    
+    store = vrdas.get_annotation_store(vrd_anno)
+    if store is not None:
+        images_with_target_cls = list(vrd_img_names)
+        for cls_idx in cls_idxs:
+            vr_mask = (store.sub_cls == cls_idx) | (store.obj_cls == cls_idx)
+            images_with_target_cls, _ = get_images_with_target_vrs_in_store(store, 
+                                                                            images_with_target_cls,
+                                                                            vr_mask)
+        annos_with_target_cls = [vrd_anno[imname] for imname in images_with_target_cls]
+        return images_with_target_cls, annos_with_target_cls
+    
     images_with_target_cls = []
     annos_with_target_cls = []
     for idx, imname in enumerate(vrd_img_names):
@@ -454,6 +993,21 @@ def get_images_with_predicate(prd_name, vrd_img_names, vrd_anno,
     
     prd_idx = vrd_predicates.index(prd_name)
     
+    index = vrdai.get_annotation_index(vrd_anno)
+    if index is not None:
+        images_with_target_prd, _ = index.get_images('prd', prd_idx, vrd_img_names)
+        annos_with_target_prd = [vrd_anno[imname].copy() for imname in images_with_target_prd]
+        return images_with_target_prd, annos_with_target_prd
+    
+    store = vrdas.get_annotation_store(vrd_anno)
+    if store is not None:
+        vr_mask = store.prd == prd_idx
+        images_with_target_prd, _ = get_images_with_target_vrs_in_store(store, 
+                                                                        vrd_img_names,
+                                                                        vr_mask)
+        annos_with_target_prd = [vrd_anno[imname] for imname in images_with_target_prd]
+        return images_with_target_prd, annos_with_target_prd
+    
     images_with_target_prd = []
     annos_with_target_prd = []
     for idx, imname in enumerate(vrd_img_names):
@@ -472,6 +1026,15 @@ def get_distinct_predicates_for_object_class(cls_name, img_names, anno,
                                              objects, predicates):
     '''
     '''
+    index = vrdai.get_annotation_index(anno)
+    if index is not None:
+        cls_idx = objects.index(cls_name)
+        posting = index.get_posting('cls', cls_idx)
+        res_prd = [predicates[anno[imname][vr_idx]['predicate']]
+                   for imname in img_names if imname in posting
+                   for vr_idx in posting[imname]]
+        return list(set(res_prd))
+    
     res_imgs, res_annos = get_images_with_object_class(cls_name, img_names,
                                                        anno, objects, 
                                                        predicates)
@@ -504,6 +1067,27 @@ def get_images_with_target_vr_A(sub_name, prd_name,
     sub_idx = objects.index(sub_name)
     prd_idx = predicates.index(prd_name)  
 
+    index = vrdai.get_annotation_index(anno)
+    if index is not None:
+        images_with_target, vr_indices = index.get_images('sp', (sub_idx, prd_idx),
+                                                          img_names)
+        annos_with_target = [anno[imname].copy() for imname in images_with_target]
+        object_names = [objects[imanno[vr_idx]['object']['category']]
+                        for imanno, vr_idxs in zip(annos_with_target, vr_indices)
+                        for vr_idx in vr_idxs]
+        return images_with_target, annos_with_target, list(set(object_names))
+
+    store = vrdas.get_annotation_store(anno)
+    if store is not None:
+        vr_mask = (store.sub_cls == sub_idx) & (store.prd == prd_idx)
+        images_with_target, vr_mask = get_images_with_target_vrs_in_store(store, 
+                                                                          img_names,
+                                                                          vr_mask)
+        annos_with_target = [anno[imname] for imname in images_with_target]
+        distinct_object_names = [objects[idx] for idx in 
+                                 np.unique(store.obj_cls[vr_mask])]
+        return images_with_target, annos_with_target, distinct_object_names
+
     images_with_target = []
     annos_with_target = []
     object_names = []
@@ -542,6 +1126,23 @@ def get_images_with_target_vr_B(sub_name, prd_name, obj_name,
     prd_idx = predicates.index(prd_name)
     obj_idx = objects.index(obj_name)
 
+    index = vrdai.get_annotation_index(anno)
+    if index is not None:
+        images_with_target, _ = index.get_images('spo', (sub_idx, prd_idx, obj_idx),
+                                                 img_names)
+        annos_with_target = [anno[imname].copy() for imname in images_with_target]
+        return images_with_target, annos_with_target
+
+    store = vrdas.get_annotation_store(anno)
+    if store is not None:
+        vr_mask = ((store.sub_cls == sub_idx) & (store.prd == prd_idx) &
+                   (store.obj_cls == obj_idx))
+        images_with_target, _ = get_images_with_target_vrs_in_store(store, 
+                                                                    img_names,
+                                                                    vr_mask)
+        annos_with_target = [anno[imname] for imname in images_with_target]
+        return images_with_target, annos_with_target
+
     images_with_target = []
     annos_with_target = []
     
@@ -574,6 +1175,29 @@ def get_images_with_target_vr_C(sub_name, prd_name,
     #print(sub_name, sub_idx)
     #print(prd_name, prd_idx)
 
+    index = vrdai.get_annotation_index(anno)
+    if index is not None:
+        images_with_prd, vr_indices = index.get_images('prd', prd_idx, img_names)
+        images_with_target = []
+        annos_with_target = []
+        for imname, vr_idxs in zip(images_with_prd, vr_indices):
+            imanno = anno[imname].copy()
+            for vr_idx in vr_idxs:
+                if imanno[vr_idx]['subject']['category'] != sub_idx:
+                    images_with_target.append(imname)
+                    annos_with_target.append(imanno)
+                    break
+        return images_with_target, annos_with_target
+
+    store = vrdas.get_annotation_store(anno)
+    if store is not None:
+        vr_mask = (store.prd == prd_idx) & (store.sub_cls != sub_idx)
+        images_with_target, _ = get_images_with_target_vrs_in_store(store, 
+                                                                    img_names,
+                                                                    vr_mask)
+        annos_with_target = [anno[imname] for imname in images_with_target]
+        return images_with_target, annos_with_target
+
     images_with_target = []
     annos_with_target = []
 
@@ -610,6 +1234,27 @@ def get_images_with_target_vr_D(prd_name, obj_name,
     prd_idx = predicates.index(prd_name)  
     obj_idx = objects.index(obj_name)
 
+    index = vrdai.get_annotation_index(anno)
+    if index is not None:
+        images_with_target, vr_indices = index.get_images('po', (prd_idx, obj_idx),
+                                                          img_names)
+        annos_with_target = [anno[imname].copy() for imname in images_with_target]
+        subject_names = [objects[imanno[vr_idx]['subject']['category']]
+                         for imanno, vr_idxs in zip(annos_with_target, vr_indices)
+                         for vr_idx in vr_idxs]
+        return images_with_target, annos_with_target, list(set(subject_names))
+
+    store = vrdas.get_annotation_store(anno)
+    if store is not None:
+        vr_mask = (store.prd == prd_idx) & (store.obj_cls == obj_idx)
+        images_with_target, vr_mask = get_images_with_target_vrs_in_store(store, 
+                                                                          img_names,
+                                                                          vr_mask)
+        annos_with_target = [anno[imname] for imname in images_with_target]
+        distinct_subject_names = [objects[idx] for idx in 
+                                  np.unique(store.sub_cls[vr_mask])]
+        return images_with_target, annos_with_target, distinct_subject_names
+
     images_with_target = []
     annos_with_target = []
     subject_names = []
@@ -648,6 +1293,27 @@ def get_images_with_target_vr_E(sub_name, obj_name,
     sub_idx = objects.index(sub_name)  
     obj_idx = objects.index(obj_name)
 
+    index = vrdai.get_annotation_index(anno)
+    if index is not None:
+        images_with_target, vr_indices = index.get_images('so', (sub_idx, obj_idx),
+                                                          img_names)
+        annos_with_target = [anno[imname].copy() for imname in images_with_target]
+        predicate_names = [predicates[imanno[vr_idx]['predicate']]
+                           for imanno, vr_idxs in zip(annos_with_target, vr_indices)
+                           for vr_idx in vr_idxs]
+        return images_with_target, annos_with_target, list(set(predicate_names))
+
+    store = vrdas.get_annotation_store(anno)
+    if store is not None:
+        vr_mask = (store.sub_cls == sub_idx) & (store.obj_cls == obj_idx)
+        images_with_target, vr_mask = get_images_with_target_vrs_in_store(store, 
+                                                                          img_names,
+                                                                          vr_mask)
+        annos_with_target = [anno[imname] for imname in images_with_target]
+        distinct_predicate_names = [predicates[idx] for idx in 
+                                    np.unique(store.prd[vr_mask])]
+        return images_with_target, annos_with_target, distinct_predicate_names
+
     images_with_target = []
     annos_with_target = []
     predicate_names = []
@@ -697,6 +1363,128 @@ def check_if_vrs_are_duplicates(vr1, vr2):
     return duplicates
 
 
+#%%
+
+def get_vr_key(vr):
+    '''
+    Get a canonical, hashable key for a visual relationship (vr).
+    
+    Two vrs are duplicates of one another (per check_if_vrs_are_duplicates)
+    if and only if their keys are equal.
+    
+    Returns:
+        key : tuple
+            - (subject category, subject bbox, predicate,
+               object category, object bbox), with bboxes as tuples
+    '''
+    
+    return (vr['subject']['category'], tuple(vr['subject']['bbox']),
+            vr['predicate'],
+            vr['object']['category'], tuple(vr['object']['bbox']))
+
+
+#%%
+
+def find_duplicate_vr_groups(imanno):
+    '''
+    Find all groups of duplicate visual relationships (vrs) within the
+    annotations of an image, in a single pass over the vrs.
+    
+    Parameters:
+        imanno : list of dictionaries (vr annotations for an image)
+    
+    Returns:
+        dup_groups : list of lists of integers
+            - each inner list holds the indices of a set of mutually
+              duplicate vrs, in ascending order; groups appear in order
+              of their first vr
+    '''
+    
+    groups = {}
+    for vr_idx, vr in enumerate(imanno):
+        groups.setdefault(get_vr_key(vr), []).append(vr_idx)
+    
+    dup_groups = [group for group in groups.values() if len(group) > 1]
+    
+    return dup_groups
+
+
+#%%
+
+def find_duplicate_vr_groups_in_store(store, img_names):
+    '''
+    Find all groups of duplicate visual relationships (vrs) for the named
+    images of a VRDAnnotationStore, in one vectorised pass over its columns.
+    
+    Returns:
+        images_with_target : list of strings (image names)
+        image_dup_groups : list (one entry per image) of the image's 
+                           duplicate vr groups (see find_duplicate_vr_groups)
+    '''
+    
+    rows = np.flatnonzero(store.image_selection(img_names)[store.img_idx])
+    
+    # one key row per vr, prefixed by the image index so that vrs in
+    # different images never compare equal
+    keys = np.column_stack([store.img_idx[rows],
+                            store.sub_cls[rows], store.sub_bbox[rows],
+                            store.prd[rows],
+                            store.obj_cls[rows], store.obj_bbox[rows]])
+    
+    _, key_ids, key_counts = np.unique(keys, axis=0, return_inverse=True,
+                                       return_counts=True)
+    key_ids = key_ids.reshape(-1)
+    
+    # gather the rows having duplicates into groups, in row order
+    dup_positions = np.flatnonzero(key_counts[key_ids] > 1)
+    groups_by_image = {}
+    for pos in dup_positions.tolist():
+        row = int(rows[pos])
+        img_idx = int(store.img_idx[row])
+        vr_idx = row - int(store.offsets[img_idx])
+        image_groups = groups_by_image.setdefault(img_idx, {})
+        image_groups.setdefault(int(key_ids[pos]), []).append(vr_idx)
+    
+    images_with_target = []
+    image_dup_groups = []
+    for imname in img_names:
+        img_idx = store.img_name_to_idx[imname]
+        if img_idx in groups_by_image:
+            images_with_target.append(imname)
+            image_dup_groups.append(list(groups_by_image[img_idx].values()))
+    
+    return images_with_target, image_dup_groups
+
+
+#%%
+
+def get_duplicate_vr_groups(img_names, anno):
+    '''
+    Find images whose annotations contain duplicate visual relationships
+    (vrs), and report every group of duplicates in each such image.
+    
+    Returns:
+        images_with_target : list of strings (image names)
+        image_dup_groups : list (one entry per image) of the image's 
+                           duplicate vr groups (see find_duplicate_vr_groups)
+    '''
+    
+    store = vrdas.get_annotation_store(anno)
+    if store is not None:
+        return find_duplicate_vr_groups_in_store(store, img_names)
+    
+    images_with_target = []
+    image_dup_groups = []
+    
+    for imname in img_names:
+        dup_groups = find_duplicate_vr_groups(anno[imname])
+        if len(dup_groups) > 0:
+            images_with_target.append(imname)
+            image_dup_groups.append(dup_groups)
+    
+    return images_with_target, image_dup_groups
+
+
 #%%
 
 def get_images_with_target_vr_F(img_names, anno): 
@@ -797,30 +1585,17 @@ def get_images_with_duplicate_vrs(img_names, anno):
     example:
     (person, wear, hat)    (person, wear, hat)
     (bb_p)       (bb_h)    (bb_p)     (bb_h)
+    
+    For each image found, the indices of the first pair of duplicate vrs
+    are reported. Use get_duplicate_vr_groups() to get every group of 
+    duplicates for each image.
     '''
 
-    images_with_target = []
-    annos_with_target = []
-    vr_pair_indices = []
-    
-    for idx, imname in enumerate(img_names):
-        imanno = anno[imname]
-        keep_img = False
-        for idx1, vr1 in enumerate(imanno):
-            for idx2, vr2 in enumerate(imanno):
-                if idx1 != idx2:
-                    duplicates = check_if_vrs_are_duplicates(vr1, vr2)
-                    if duplicates:
-                        keep_img = True
-                        break
-            
-            if keep_img:
-                break
+    images_with_target, image_dup_groups = get_duplicate_vr_groups(img_names,
+                                                                   anno)
     
-        if keep_img:
-            images_with_target.append(imname)
-            annos_with_target.append(imanno)
-            vr_pair_indices.append([idx1, idx2])
+    annos_with_target = [anno[imname] for imname in images_with_target]
+    vr_pair_indices = [dup_groups[0][0:2] for dup_groups in image_dup_groups]
 
     return images_with_target, annos_with_target, vr_pair_indices
 
@@ -833,6 +1608,16 @@ def get_images_with_vrs_with_identical_bboxes(img_names, anno):
     where the 'subject' and 'object' bboxes are identical.
     '''
 
+    store = vrdas.get_annotation_store(anno)
+    if store is not None:
+        vr_mask = np.all(store.sub_bbox == store.obj_bbox, axis=1)
+        images_with_target, vr_mask = get_images_with_target_vrs_in_store(store, 
+                                                                          img_names,
+                                                                          vr_mask)
+        annos_with_target = [anno[imname] for imname in images_with_target]
+        vr_indices = get_vr_indices_in_store(store, images_with_target, vr_mask)
+        return images_with_target, annos_with_target, vr_indices
+
     images_with_target = []
     annos_with_target = []
     vr_indices = []
@@ -861,20 +1646,9 @@ def get_images_with_bboxes_having_multiple_object_classes(img_names, anno):
     more than one object class.
     '''
     
-    images_with_target = []
-    vr_indices_with_problem_bbox = []
-    bboxes_with_multiple_classes = []
+    scene_graph = vrdsg.get_scene_graph(img_names, anno)
     
-    for idx, imname in enumerate(img_names):
-        imanno = anno[imname]
-        try:
-            _ = get_bboxes_and_object_classes(imname, imanno)
-        except BboxError as e:
-            images_with_target.append(imname)
-            vr_indices_with_problem_bbox.append(e.vridx)
-            bboxes_with_multiple_classes.append(e.bbox)
-    
-    return images_with_target, vr_indices_with_problem_bbox, bboxes_with_multiple_classes
+    return find_bboxes_with_multiple_object_classes(scene_graph, img_names)
     
 #%%
 
@@ -887,6 +1661,20 @@ def get_images_with_degenerate_bboxes(img_names, anno):
         NOT (xmin < xmax)
     '''
     
+    store = vrdas.get_annotation_store(anno)
+    if store is not None:
+        vr_mask = ((store.sub_bbox[:,0] >= store.sub_bbox[:,1]) |
+                   (store.sub_bbox[:,2] >= store.sub_bbox[:,3]) |
+                   (store.obj_bbox[:,0] >= store.obj_bbox[:,1]) |
+                   (store.obj_bbox[:,2] >= store.obj_bbox[:,3]))
+        images_with_target, vr_mask = get_images_with_target_vrs_in_store(store, 
+                                                                          img_names,
+                                                                          vr_mask)
+        vr_indices_with_bad_bbox = get_vr_indices_in_store(store, 
+                                                           images_with_target, 
+                                                           vr_mask)
+        return images_with_target, vr_indices_with_bad_bbox
+
     images_with_target = []
     vr_indices_with_bad_bbox = []
     
@@ -910,6 +1698,136 @@ def get_images_with_degenerate_bboxes(img_names, anno):
     return images_with_target, vr_indices_with_bad_bbox
     
     
+#%%
+
+def get_out_of_bounds_bbox_mask(bboxes, sizes):
+    '''
+    Find the bboxes that do not lie within the bounds of their images,
+    for many bboxes at once.
+    
+    A bbox, [ymin, ymax, xmin, xmax], lies within the bounds of an image
+    of size (W x H) if:
+        0 <= ymin  and  ymax <= H  and  0 <= xmin  and  xmax <= W
+    
+    Parameters:
+        bboxes : integer array, shape (n, 4)
+        sizes : integer array, shape (n, 2) (the (W, H) of the image of
+                each bbox)
+    
+    Returns:
+        mask : boolean array, shape (n,)
+    '''
+    
+    return ((bboxes[:,0] < 0) | (bboxes[:,1] > sizes[:,1]) |
+            (bboxes[:,2] < 0) | (bboxes[:,3] > sizes[:,0]))
+
+
+def clip_bboxes_to_image_bounds(bboxes, sizes):
+    '''
+    Clip bboxes to the bounds of their images, for many bboxes at once.
+    
+    Parameters:
+        bboxes : integer array, shape (n, 4)
+        sizes : integer array, shape (n, 2) (the (W, H) of the image of
+                each bbox)
+    
+    Returns:
+        clipped : integer array, shape (n, 4)
+    '''
+    
+    clipped = np.maximum(bboxes, 0)
+    clipped[:,[0,1]] = np.minimum(clipped[:,[0,1]], sizes[:,[1]])
+    clipped[:,[2,3]] = np.minimum(clipped[:,[2,3]], sizes[:,[0]])
+    
+    return clipped
+
+
+def get_store_and_image_sizes(img_names, anno, imagedir):
+    '''
+    Get a VRDAnnotationStore holding (at least) the VRs of the named
+    images, and the size (W, H) of the image of each VR row of the store.
+    
+    The image sizes are read from the image metadata manifest of the
+    image directory, or from the headers of the image files (see
+    vrdim.get_image_sizes()); no image is decoded.  VR rows of images not
+    named in 'img_names' are given an unbounded size.
+    '''
+    
+    store = vrdas.get_annotation_store(anno)
+    if store is None:
+        store = vrdas.VRDAnnotationStore.from_dict({imname: anno[imname]
+                                                    for imname in img_names})
+    
+    image_sizes = np.full((store.n_images, 2), np.iinfo(np.int64).max,
+                          dtype=np.int64)
+    img_idxs = [store.img_name_to_idx[imname] for imname in img_names]
+    image_sizes[img_idxs] = vrdim.get_image_sizes(img_names, imagedir)
+    
+    return store, image_sizes[store.img_idx]
+
+
+def get_images_with_out_of_bounds_bboxes(img_names, anno, imagedir):
+    '''
+    Find images that have bboxes that do not lie within the bounds of the
+    image (see get_out_of_bounds_bbox_mask()).
+    
+    All of the 'subject' and 'object' bboxes of all of the named images
+    are checked against the sizes of their images in one pass.
+    
+    Returns:
+        images_with_target : list of strings (image names)
+        vr_indices_with_bad_bbox : list of lists of integers (for each
+            image, the indices of its VRs having an out-of-bounds bbox)
+    '''
+    
+    store, sizes = get_store_and_image_sizes(img_names, anno, imagedir)
+    
+    vr_mask = (get_out_of_bounds_bbox_mask(store.sub_bbox, sizes) |
+               get_out_of_bounds_bbox_mask(store.obj_bbox, sizes))
+    
+    images_with_target, vr_mask = get_images_with_target_vrs_in_store(store,
+                                                                      img_names,
+                                                                      vr_mask)
+    vr_indices_with_bad_bbox = get_vr_indices_in_store(store,
+                                                       images_with_target,
+                                                       vr_mask)
+    
+    return images_with_target, vr_indices_with_bad_bbox
+
+
+def get_annotations_with_bboxes_clipped(img_names, anno, imagedir):
+    '''
+    Clip the out-of-bounds bboxes of the named images to the bounds of
+    their images (see clip_bboxes_to_image_bounds()), in one pass.
+    
+    The annotations 'anno' are not modified.  Note that clipping a bbox
+    that lies wholly outside its image leaves a degenerate bbox.
+    
+    Returns:
+        clipped_anno : dictionary
+            - the VR annotations, with clipped bboxes, of each named image
+              that has an out-of-bounds bbox
+    '''
+    
+    store, sizes = get_store_and_image_sizes(img_names, anno, imagedir)
+    
+    sub_mask = get_out_of_bounds_bbox_mask(store.sub_bbox, sizes)
+    obj_mask = get_out_of_bounds_bbox_mask(store.obj_bbox, sizes)
+    
+    images_with_target, _ = get_images_with_target_vrs_in_store(store,
+                                                                img_names,
+                                                                sub_mask | obj_mask)
+    
+    clipped_store = vrdas.VRDAnnotationStore(store.img_names, store.offsets,
+                                             store.sub_cls, store.prd,
+                                             store.obj_cls,
+                                             clip_bboxes_to_image_bounds(store.sub_bbox, sizes),
+                                             clip_bboxes_to_image_bounds(store.obj_bbox, sizes))
+    
+    return {imname: clipped_store.get_image_annotations(imname)
+            for imname in images_with_target}
+
+
 #%% 
 
 def calc_bbox_pair_iou(bb):
@@ -945,6 +1863,154 @@ def calc_bbox_pair_iou(bb):
     return iou
 
 
+#%%
+
+def calc_bbox_intersection_areas(bboxes1, bboxes2):
+    '''
+    Calculate the intersection areas of every bbox in 'bboxes1' with every
+    bbox in 'bboxes2', for all pairs at once.
+    
+    The bbox format is [ymin, ymax, xmin, xmax]. Leading (batch) 
+    dimensions are supported, so padded batches of bboxes for many 
+    images can be processed in a single call.
+    
+    Parameters:
+        bboxes1 : array-like, shape (..., n, 4)
+        bboxes2 : array-like, shape (..., m, 4)
+    
+    Returns:
+        areas : float64 array, shape (..., n, m)
+    '''
+    
+    b1 = np.asarray(bboxes1, dtype=np.float64)[..., :, np.newaxis, :]
+    b2 = np.asarray(bboxes2, dtype=np.float64)[..., np.newaxis, :, :]
+    
+    x1 = np.maximum(b1[..., 2], b2[..., 2])  # max xmin
+    y1 = np.maximum(b1[..., 0], b2[..., 0])  # max ymin
+    x2 = np.minimum(b1[..., 3], b2[..., 3])  # min xmax
+    y2 = np.minimum(b1[..., 1], b2[..., 1])  # min ymax
+    
+    areas = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    
+    return areas
+
+
+def calc_bbox_areas(bboxes):
+    '''
+    Calculate the areas of bboxes of format [ymin, ymax, xmin, xmax].
+    
+    Parameters:
+        bboxes : array-like, shape (..., n, 4)
+    
+    Returns:
+        areas : float64 array, shape (..., n)
+    '''
+    
+    b = np.asarray(bboxes, dtype=np.float64)
+    
+    return (b[..., 3] - b[..., 2]) * (b[..., 1] - b[..., 0])
+
+
+#%%
+
+def calc_bbox_iou_matrix(bboxes1, bboxes2=None):
+    '''
+    Calculate the IoU (Intersection over Union) of every bbox in 'bboxes1'
+    with every bbox in 'bboxes2' (or, if 'bboxes2' is None, of every pair
+    of bboxes in 'bboxes1').  This is the vectorised counterpart of
+    calc_bbox_pair_iou(). 
+    
+    Leading (batch) dimensions are supported; zero-padded bboxes have 
+    zero area and, hence, zero IoU with every other bbox.
+    
+    Parameters:
+        bboxes1 : array-like, shape (..., n, 4)
+        bboxes2 : array-like, shape (..., m, 4)
+    
+    Returns:
+        ious : float64 array, shape (..., n, m)
+    '''
+    
+    if bboxes2 is None:
+        bboxes2 = bboxes1
+    
+    intersection_areas = calc_bbox_intersection_areas(bboxes1, bboxes2)
+    b1_areas = calc_bbox_areas(bboxes1)[..., :, np.newaxis]
+    b2_areas = calc_bbox_areas(bboxes2)[..., np.newaxis, :]
+    union_areas = b1_areas + b2_areas - intersection_areas
+    
+    ious = np.divide(intersection_areas, union_areas, 
+                     out=np.zeros_like(intersection_areas),
+                     where=union_areas > 0)
+    
+    return ious
+
+
+#%%
+
+def calc_bbox_inclusion_ratio_matrix(bboxes1, bboxes2=None):
+    '''
+    Calculate the Inclusion Ratio of every bbox in 'bboxes2' within every
+    bbox in 'bboxes1' (or, if 'bboxes2' is None, for every pair of bboxes
+    in 'bboxes1').  Element [i, j] of the result is the inclusion ratio 
+    of bboxes2[j] within bboxes1[i], as per calc_bbox_pair_inclusion_ratio().
+    
+    Parameters:
+        bboxes1 : array-like, shape (..., n, 4)
+        bboxes2 : array-like, shape (..., m, 4)
+    
+    Returns:
+        ratios : float64 array, shape (..., n, m)
+    '''
+    
+    if bboxes2 is None:
+        bboxes2 = bboxes1
+    
+    intersection_areas = calc_bbox_intersection_areas(bboxes1, bboxes2)
+    b2_areas = np.broadcast_to(calc_bbox_areas(bboxes2)[..., np.newaxis, :],
+                               intersection_areas.shape)
+    
+    ratios = np.divide(intersection_areas, b2_areas,
+                       out=np.zeros_like(intersection_areas),
+                       where=b2_areas > 0)
+    
+    return ratios
+
+
+#%%
+
+def calc_bbox_pairs_inclusion_ratio(bboxes1, bboxes2):
+    '''
+    Calculate the Inclusion Ratio of bboxes2[k] within bboxes1[k], for
+    each k. This is the element-wise (paired) counterpart of
+    calc_bbox_pair_inclusion_ratio(); for example, for the 'subject' and
+    'object' bboxes of many visual relationships at once.
+    
+    Parameters:
+        bboxes1 : array-like, shape (n, 4)
+        bboxes2 : array-like, shape (n, 4)
+    
+    Returns:
+        ratios : float64 array, shape (n,)
+    '''
+    
+    b1 = np.asarray(bboxes1, dtype=np.float64)
+    b2 = np.asarray(bboxes2, dtype=np.float64)
+    
+    x1 = np.maximum(b1[:, 2], b2[:, 2])
+    y1 = np.maximum(b1[:, 0], b2[:, 0])
+    x2 = np.minimum(b1[:, 3], b2[:, 3])
+    y2 = np.minimum(b1[:, 1], b2[:, 1])
+    intersection_areas = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    b2_areas = calc_bbox_areas(b2)
+    
+    ratios = np.divide(intersection_areas, b2_areas,
+                       out=np.zeros_like(intersection_areas),
+                       where=b2_areas > 0)
+    
+    return ratios
+
+
 #%%
 
 def get_images_with_highly_similar_bboxes(img_names, anno,
@@ -969,49 +2035,112 @@ def get_images_with_highly_similar_bboxes(img_names, anno,
                          object classes.
     '''
     
-    images_with_target = []
-    image_similar_bbox_pairs = []
-    image_similar_bbox_ious = []
+    threshold_band = (lower_threshold, upper_threshold)
     
-    for idx, imname in enumerate(img_names):
-        imanno = anno[imname]
-        bboxes_dict = get_bboxes_and_object_classes(imname, imanno)
-        bboxes = list(bboxes_dict.keys())
-        bbox_classes = list(bboxes_dict.values())
-        bbox_class_tuples = list(zip(bboxes, bbox_classes))
-        bbox_pairs = itertools.combinations(bbox_class_tuples, 2)
-        keep_img = False
-        bb_pairs = []
-        bb_pair_ious = []
-        for pair in bbox_pairs:
-            bb1 = pair[0][0]
-            bb2 = pair[1][0]
-            bb1_cls = pair[0][1]
-            bb2_cls = pair[1][1]
-            bb_pair = [bb1, bb2]
-            iou = calc_bbox_pair_iou(bb_pair)
-            if iou > lower_threshold and iou <= upper_threshold:
-                save_result = True
-                if obj_class_same:
-                    if bb1_cls == bb2_cls:
-                        pass
-                    else:
-                        save_result = False
-                else:
-                    if bb1_cls == bb2_cls:
-                        save_result = False
-                    else:
-                        pass                    
-                if save_result:
-                    keep_img = True
-                    bb_pairs.append(pair)
-                    bb_pair_ious.append(round(iou,3))
-        if keep_img:
-            images_with_target.append(imname)
+    results = get_images_with_highly_similar_bboxes_for_bands(img_names, anno,
+                                                              [threshold_band],
+                                                              obj_class_same)
+         
+    return results[threshold_band]
+
+
+#%%
+
+def get_images_with_highly_similar_bboxes_for_bands(img_names, anno,
+                                                    threshold_bands,
+                                                    obj_class_same=False,
+                                                    batch_size=256):
+    '''
+    Find images whose visual relationship annotations contain highly
+    similar bboxes (see get_images_with_highly_similar_bboxes), for 
+    several IoU threshold bands at once.
+    
+    The IoUs of all pairs of bboxes are calculated just once, with 
+    NumPy, for batches of images whose bboxes are zero-padded to a common
+    count. The images are batched in order of their number of bboxes so
+    that little padding is needed.
+    
+    Parameters:
+        threshold_bands : list of (lower_threshold, upper_threshold) tuples
+        obj_class_same : boolean flag (see get_images_with_highly_similar_bboxes)
+        batch_size : integer (maximum number of images per batch)
+    
+    Returns:
+        results : dictionary
+            - keys are the threshold band tuples
+            - values are 3-tuples of the form returned by
+              get_images_with_highly_similar_bboxes
+    '''
+    
+    # get the distinct bboxes, and their object classes, for each image
+    image_bboxes, image_bbox_classes = get_bboxes_and_object_classes_for_images(img_names,
+                                                                               anno)
+    
+    # per band, the similar bbox pairs found for each image (by position)
+    band_hits = {band: {} for band in threshold_bands}
+    
+    n_bboxes = np.array([len(bboxes) for bboxes in image_bboxes], dtype=np.int64)
+    image_order = np.argsort(n_bboxes, kind='stable')
+    image_order = image_order[n_bboxes[image_order] > 1]
+    
+    for batch_start in range(0, len(image_order), batch_size):
+        batch = image_order[batch_start:batch_start+batch_size]
+        max_n = int(n_bboxes[batch].max())
+        
+        # assemble the zero-padded batch of bboxes and their classes
+        padded_bboxes = np.zeros((len(batch), max_n, 4), dtype=np.int64)
+        padded_classes = np.full((len(batch), max_n), -1, dtype=np.int64)
+        for row, img_pos in enumerate(batch.tolist()):
+            n = n_bboxes[img_pos]
+            padded_bboxes[row, :n] = image_bboxes[img_pos]
+            padded_classes[row, :n] = image_bbox_classes[img_pos]
+        
+        ious = calc_bbox_iou_matrix(padded_bboxes)
+        
+        # consider each distinct pair (i < j) of real (unpadded) bboxes 
+        # once, subject to the object class condition
+        valid = padded_classes >= 0
+        pair_mask = np.triu(np.ones((max_n, max_n), dtype=bool), k=1)
+        pair_mask = pair_mask & valid[:, :, np.newaxis] & valid[:, np.newaxis, :]
+        same_class = padded_classes[:, :, np.newaxis] == padded_classes[:, np.newaxis, :]
+        if obj_class_same:
+            pair_mask = pair_mask & same_class
+        else:
+            pair_mask = pair_mask & ~same_class
+        
+        for band in threshold_bands:
+            lower_threshold, upper_threshold = band
+            hits = pair_mask & (ious > lower_threshold) & (ious <= upper_threshold)
+            rows, idx1s, idx2s = np.nonzero(hits)
+            for row, idx1, idx2 in zip(rows.tolist(), idx1s.tolist(), idx2s.tolist()):
+                img_pos = int(batch[row])
+                band_hits[band].setdefault(img_pos, []).append((idx1, idx2, 
+                                                                ious[row, idx1, idx2]))
+    
+    # assemble the results in the order of the given image names
+    results = {}
+    for band in threshold_bands:
+        images_with_target = []
+        image_similar_bbox_pairs = []
+        image_similar_bbox_ious = []
+        hits = band_hits[band]
+        for img_pos in sorted(hits.keys()):
+            bboxes = image_bboxes[img_pos]
+            bbox_classes = image_bbox_classes[img_pos]
+            bb_pairs = []
+            bb_pair_ious = []
+            for idx1, idx2, iou in hits[img_pos]:
+                pair = ((bboxes[idx1], bbox_classes[idx1]), 
+                        (bboxes[idx2], bbox_classes[idx2]))
+                bb_pairs.append(pair)
+                bb_pair_ious.append(round(float(iou), 3))
+            images_with_target.append(img_names[img_pos])
             image_similar_bbox_pairs.append(bb_pairs)
             image_similar_bbox_ious.append(bb_pair_ious)
-         
-    return images_with_target, image_similar_bbox_pairs, image_similar_bbox_ious
+        results[band] = (images_with_target, image_similar_bbox_pairs,
+                         image_similar_bbox_ious)
+    
+    return results
 
 
 #%%
@@ -1029,12 +2158,11 @@ def get_images_with_multiple_objects_of_a_given_class(img_names, anno,
     
     obj_class_idx = objects.index(obj_class_name)
     
+    image_bboxes, image_bbox_classes = get_bboxes_and_object_classes_for_images(img_names,
+                                                                               anno)
+    
     for idx, imname in enumerate(img_names):
-        imanno = anno[imname]
-        bboxes_dict = get_bboxes_and_object_classes(imname, imanno)
-        bboxes = list(bboxes_dict.keys())
-        bbox_classes = list(bboxes_dict.values())
-        bbox_class_tuples = list(zip(bboxes, bbox_classes))
+        bbox_class_tuples = list(zip(image_bboxes[idx], image_bbox_classes[idx]))
         bb_cls_tuples = []
         for bb_cls_tuple in bbox_class_tuples:
             if bb_cls_tuple[1] == obj_class_idx:
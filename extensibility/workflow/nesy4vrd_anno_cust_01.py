@@ -52,6 +52,7 @@ apply the changes you have requested (because they are already in place).
 
 import os
 import nesy4vrd_utils3 as vrdu3
+import nesy4vrd_anno_cust_steps as vrdsteps
 
 # Import the appropriate NeSy4VRD workflow configuration module
 import nesy4vrd_anno_cust_config_train as vrdcfg
@@ -82,42 +83,18 @@ vrd_predicates = vrdu3.load_NeSy4VRD_predicate_names(vrd_predicates_path)
 print('Step 1: processing begins ...')
 print()
 
-#%% introduce any new object class names
+#%% introduce any new object class names; adjust/extend predicate names
 
-if len(vrdcfg.step_1_new_object_names) > 0:
-    vrd_objects = list(vrd_objects) # make object class names mutable
-    for name in vrdcfg.step_1_new_object_names:
-        if name in vrd_objects:
-            raise ValueError(f'new object class name already exists: {name}')
-        vrd_objects.append(name)
+results = vrdsteps.perform_step_1(vrd_objects, vrd_predicates, vrdcfg)
+vrd_objects, vrd_predicates, objects_changed, predicates_changed = results
+
+#%% save the modified master lists to files on disk
+
+if objects_changed:
     vrdu3.save_VRD_object_class_names(vrd_objects, vrd_objects_path)
     print(f'Extended object class names saved to file: {vrd_objects_path}')
 
-#%% adjust/extend predicate names
-
-predicates_adjusted = False
-predicates_added = False
-
-if len(vrdcfg.step_1_predicate_name_adjustments) > 0:
-    vrd_predicates = list(vrd_predicates) # make predicate names mutable
-    for adjustment in vrdcfg.step_1_predicate_name_adjustments:
-        from_name, to_name = adjustment
-        if not from_name in vrd_predicates:
-            raise ValueError(f'predicate name not recognised: {from_name}')
-        from_name_idx = vrd_predicates.index(from_name)
-        vrd_predicates[from_name_idx] = to_name
-        predicates_adjusted = True
-
-if len(vrdcfg.step_1_new_predicate_names) > 0:
-    if not predicates_adjusted:
-        vrd_predicates = list(vrd_predicates) # convert tuple to list
-    for name in vrdcfg.step_1_new_predicate_names:
-        if name in vrd_predicates:
-            raise ValueError(f'new predicate name already exists: {name}')
-        vrd_predicates.append(name)
-        predicates_added = True
-
-if predicates_adjusted or predicates_added:
+if predicates_changed:
     vrdu3.save_VRD_predicate_names(vrd_predicates, vrd_predicates_path)
     print(f'Revised/extended predicate names saved to file: {vrd_predicates_path}')
 
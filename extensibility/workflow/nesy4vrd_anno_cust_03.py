@@ -24,6 +24,7 @@ the nature of the annotation customisations you wish to make.
 
 import os
 import nesy4vrd_utils3 as vrdu3
+import nesy4vrd_anno_cust_steps as vrdsteps
 
 # Import the appropriate NeSy4VRD workflow configuration module
 # depending on whether we are doing a 'training set' or 'test set' run
@@ -61,34 +62,14 @@ print()
 
 #%% process the customisation
 
-if len(vrdcfg.step_3_from_class_to_class) != \
-   len(vrdcfg.step_3_from_class_to_class_img_names):
-    raise ValueError('problem with from/to class configuration parameters')
-
-for idx, from_class_to_class in enumerate(vrdcfg.step_3_from_class_to_class):
-    from_name, to_name = from_class_to_class
-    if not from_name in vrd_objects:
-        raise ValueError(f"Object class 'from name' not recognised: {from_name}")
-    if not to_name in vrd_objects:
-       raise ValueError(f"Object class 'to name' not recognised: {to_name}")
-    img_names = vrdcfg.step_3_from_class_to_class_img_names[idx]
-    if len(img_names) > 0:
-        print(f"Switching object class '{from_name}' to '{to_name}' in named images begins ...")
-        print()
-    else:
-        raise ValueError(f"no image names for from/to class pair: {from_name}, {to_name}")
-
-    vrdu3.switch_object_classes_in_named_images(from_name, to_name, img_names,
-                                                vrd_anno, vrd_objects, 
-                                                vrd_predicates)  
-    if len(img_names) > 0:
-        print(f"Switching object class '{from_name}' to '{to_name}' in named images complete")
-        print()
-
-#%% save the customised annotations to file on disk 
-
-if len(img_names) > 0:
-    vrdu3.write_customised_annotations_to_file(vrd_anno, vrd_anno_path)
+save_required = vrdsteps.perform_step_3(vrd_anno, vrd_objects, vrd_predicates,
+                                        vrdcfg)
+
+#%% save the customised annotations to file on disk
+
+if save_required:
+    vrdu3.write_customised_annotations_to_file(vrd_anno, vrd_anno_path,
+                                               vrd_objects, vrd_predicates)
     print(f'Customised annotations saved to file: {vrd_anno_path}')
 
 print()
@@ -23,6 +23,7 @@ the nature of the annotation customisations you wish to make.
 
 import os
 import nesy4vrd_utils3 as vrdu3
+import nesy4vrd_anno_cust_steps as vrdsteps
 
 # Import the appropriate NeSy4VRD workflow configuration module
 # depending on whether we are doing a 'training set' or 'test set' run
@@ -45,9 +46,10 @@ vrd_objects = vrdu3.load_NeSy4VRD_object_class_names(path)
 path = os.path.join(anno_dir, vrdcfg.predicates_file)
 vrd_predicates = vrdu3.load_NeSy4VRD_predicate_names(path)
 
-# get NeSy4VRD visual relationship annotations
+# get NeSy4VRD visual relationship annotations (indexed, because this
+# step searches them repeatedly)
 vrd_anno_path = os.path.join(anno_dir, vrdcfg.annotations_file)
-vrd_anno = vrdu3.load_NeSy4VRD_image_annotations(vrd_anno_path)
+vrd_anno = vrdu3.load_NeSy4VRD_image_annotations_indexed(vrd_anno_path)
 
 # get a list of the VRD image names from the annotations dictionary
 vrd_img_names = list(vrd_anno.keys())
@@ -57,59 +59,16 @@ vrd_img_names = list(vrd_anno.keys())
 print('Step 4: processing begins ...')
 print()
 
-#%% process the object class merges, if anay
+#%% process the object class merges and predicate merges, if any
 
-if len(vrdcfg.step_4_object_classes_to_merge) > 0:
-    print('Processing of object class merges begins ...')
-    print()
-
-for pair in vrdcfg.step_4_object_classes_to_merge:
-    from_name, to_name = pair
-
-    if not from_name in vrd_objects:
-        raise ValueError(f"Object class 'from name' not recognised: {from_name}")
-    if not to_name in vrd_objects:
-        raise ValueError(f"Object class 'to name' not recognised: {to_name}")
-    
-    vrdu3.merge_object_classes(from_name, to_name, vrd_img_names,
-                               vrd_anno, vrd_objects, vrd_predicates)
-    
-    print(f'Merge of object class {from_name} into {to_name} complete')
-    print()
-
-if len(vrdcfg.step_4_object_classes_to_merge) > 0:
-    print('Processing of object class merges complete')
-    print()
-
-#%% process the predicate merges, if any
-
-if len(vrdcfg.step_4_predicates_to_merge) > 0:
-    print('Processing of predicate merges begins ...')
-    print()
-
-for pair in vrdcfg.step_4_predicates_to_merge:
-    from_name, to_name = pair
-
-    if not from_name in vrd_predicates:
-        raise ValueError(f"Predicate 'from name' not recognised: {from_name}")
-    if not to_name in vrd_predicates:
-        raise ValueError(f"Predicate 'to name' not recognised: {to_name}")
-
-    vrdu3.merge_predicates(from_name, to_name, vrd_img_names,
-                           vrd_anno, vrd_objects, vrd_predicates)
-
-    print(f'Merge of predicate {from_name} into {to_name} complete')
-    print()
-
-if len(vrdcfg.step_4_predicates_to_merge) > 0:
-    print('Processing of predicate merges complete')
-    print()
+save_required = vrdsteps.perform_step_4(vrd_anno, vrd_objects, vrd_predicates,
+                                        vrdcfg)
 
 #%% save customised annotations to file on disk
 
-if len(vrdcfg.step_4_object_classes_to_merge) > 0 or \
-   len(vrdcfg.step_4_predicates_to_merge) > 0:
-    vrdu3.write_customised_annotations_to_file(vrd_anno, vrd_anno_path)
+if save_required:
+    vrdu3.write_customised_annotations_to_file(vrd_anno, vrd_anno_path,
+                                               vrd_objects, vrd_predicates)
     print(f'Customised annotations saved to file: {vrd_anno_path}')
 
 print()
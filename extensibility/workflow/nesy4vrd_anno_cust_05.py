@@ -24,6 +24,7 @@ the nature of the annotation customisations you wish to make.
 
 import os
 import nesy4vrd_utils3 as vrdu3
+import nesy4vrd_anno_cust_steps as vrdsteps
 
 # Import the appropriate NeSy4VRD workflow configuration module
 # depending on whether we are doing a 'training set' or 'test set' run
@@ -46,9 +47,10 @@ vrd_objects = vrdu3.load_NeSy4VRD_object_class_names(path)
 path = os.path.join(anno_dir, vrdcfg.predicates_file)
 vrd_predicates = vrdu3.load_NeSy4VRD_predicate_names(path)
 
-# get NeSy4VRD visual relationship annotations
+# get NeSy4VRD visual relationship annotations (indexed, because this
+# step searches them repeatedly)
 vrd_anno_path = os.path.join(anno_dir, vrdcfg.annotations_file)
-vrd_anno = vrdu3.load_NeSy4VRD_image_annotations(vrd_anno_path)
+vrd_anno = vrdu3.load_NeSy4VRD_image_annotations_indexed(vrd_anno_path)
 
 # get a list of the VRD image names from the annotations dictionary
 vrd_img_names = list(vrd_anno.keys())
@@ -60,34 +62,14 @@ print()
 
 #%% process the vr removals
 
-if len(vrdcfg.step_5_vrs_to_remove) > 0:
-    print('Processing of global vr removals begins ...')
-    print()
-
-for vr in vrdcfg.step_5_vrs_to_remove:
-    sub_name, prd_name, obj_name = vr
-
-    if not sub_name in vrd_objects:
-        raise ValueError(f'Subject name not recognised: {sub_name}')
-    if not prd_name in vrd_predicates:
-        raise ValueError(f'Predicate name not recognised: {prd_name}')
-    if not obj_name in vrd_objects:
-        raise ValueError(f'Object name not recognised: {obj_name}')
-
-    nremoved = vrdu3.remove_vr_globally(vr, vrd_img_names, vrd_anno,
-                                        vrd_objects, vrd_predicates)
-
-    print(f'vr {vr} removed globally; {nremoved} instances')
-    print()
-
-if len(vrdcfg.step_5_vrs_to_remove) > 0:
-    print('Processing of global vr removals complete')
-    print()
+save_required = vrdsteps.perform_step_5(vrd_anno, vrd_objects, vrd_predicates,
+                                        vrdcfg)
 
 #%% save customised annotations to file on disk
 
-if len(vrdcfg.step_5_vrs_to_remove) > 0:
-    vrdu3.write_customised_annotations_to_file(vrd_anno, vrd_anno_path)
+if save_required:
+    vrdu3.write_customised_annotations_to_file(vrd_anno, vrd_anno_path,
+                                               vrd_objects, vrd_predicates)
     print(f'Customised annotations saved to file: {vrd_anno_path}')
 
 print()
@@ -48,6 +48,7 @@ annotations.
 
 import os
 import nesy4vrd_utils3 as vrdu3
+import nesy4vrd_anno_cust_steps as vrdsteps
 
 # Import the appropriate NeSy4VRD workflow configuration module
 # depending on whether we are doing a 'training set' or 'test set' run
@@ -63,6 +64,14 @@ import nesy4vrd_anno_cust_config_train as vrdcfg
 # data files reside
 anno_dir = os.path.join('..', '..', *vrdcfg.anno_dir)
 
+# get the NeSy4VRD object class names
+path = os.path.join(anno_dir, vrdcfg.object_classes_file)
+vrd_objects = vrdu3.load_NeSy4VRD_object_class_names(path)
+
+# get NeSy4VRD predicate names
+path = os.path.join(anno_dir, vrdcfg.predicates_file)
+vrd_predicates = vrdu3.load_NeSy4VRD_predicate_names(path)
+
 # get NeSy4VRD visual relationship annotations
 vrd_anno_path = os.path.join(anno_dir, vrdcfg.annotations_file)
 vrd_anno = vrdu3.load_NeSy4VRD_image_annotations(vrd_anno_path)
@@ -77,25 +86,13 @@ print()
 
 #%% find and remove image name keys whose values are empty lists
 
-# get the names of the images whose annotations are empty lists
-images_with_empty_annos = []
-for imname in vrd_img_names:
-    imanno = vrd_anno[imname]
-    if len(imanno) == 0:
-        images_with_empty_annos.append(imname)
-
-print(f'number of image names with zero annotations: {len(images_with_empty_annos)}')
-
-# remove the entries for these images from the annotations dictionary
-for imname in images_with_empty_annos:
-    del vrd_anno[imname]
-
-print(f'entries removed from annotations dictionary: {len(images_with_empty_annos)}')
+save_required = vrdsteps.perform_step_6(vrd_anno)
 
 #%% save customised annotations to file on disk
 
-if len(images_with_empty_annos) > 0:
-    vrdu3.write_customised_annotations_to_file(vrd_anno, vrd_anno_path)
+if save_required:
+    vrdu3.write_customised_annotations_to_file(vrd_anno, vrd_anno_path,
+                                               vrd_objects, vrd_predicates)
     print(f'Customised annotations saved to file: {vrd_anno_path}')
 
 print()
@@ -30,6 +30,7 @@ the nature of the annotation customisations you wish to make.
 
 import os
 import nesy4vrd_utils3 as vrdu3
+import nesy4vrd_anno_cust_steps as vrdsteps
 
 # Import the appropriate NeSy4VRD workflow configuration module
 # depending on whether we are doing a 'training set' or 'test set' run
@@ -53,9 +54,10 @@ vrd_objects = vrdu3.load_NeSy4VRD_object_class_names(path)
 path = os.path.join(anno_dir, vrdcfg.predicates_file)
 vrd_predicates = vrdu3.load_NeSy4VRD_predicate_names(path)
 
-# get NeSy4VRD visual relationship annotations
+# get NeSy4VRD visual relationship annotations (indexed, because this
+# step searches them repeatedly)
 vrd_anno_path = os.path.join(anno_dir, vrdcfg.annotations_file)
-vrd_anno = vrdu3.load_NeSy4VRD_image_annotations(vrd_anno_path)
+vrd_anno = vrdu3.load_NeSy4VRD_image_annotations_indexed(vrd_anno_path)
 
 # get a list of the VRD image names from the annotations dictionary
 vrd_img_names = list(vrd_anno.keys())
@@ -67,55 +69,14 @@ print()
 
 #%% process the vr changes
 
-if len(vrdcfg.step_9_from_vr_to_vr) > 0:
-    print('Processing of global vr transformations begins ...')
-    print()
-
-for vr_pair in vrdcfg.step_9_from_vr_to_vr:
-    from_vr, to_vr = vr_pair
-
-    if not from_vr[0] in vrd_objects:
-        raise ValueError(f'Subject name not recognised: {from_vr[0]}')
-    if not from_vr[1] in vrd_predicates:
-        raise ValueError(f'Predicate name not recognised: {from_vr[1]}')
-    if not from_vr[2] in vrd_objects:
-        raise ValueError(f'Object name not recognised: {from_vr[2]}')
-
-    objects_swap_positions = None
-    if from_vr[0] == to_vr[0] and from_vr[2] == to_vr[2]:
-        objects_swap_positions = False
-    elif from_vr[0] == to_vr[2] and from_vr[2] == to_vr[0]:
-        objects_swap_positions = True
-    else:
-        raise ValueError(f'from_vr -> to_vr specification not valid: {vr_pair}')
-
-    if not to_vr[1] in vrd_predicates:
-        raise ValueError(f'Predicate name not recognised: {to_vr[1]}')
-
-    predicate_changes = True
-    if from_vr[1] == to_vr[1]:
-        predicate_changes = False
-
-    if ((not objects_swap_positions) and (not predicate_changes)):
-        raise ValueError(f'from_vr -> to_vr specification invalid: {vr_pair}')
-
-    nchanged = vrdu3.change_vr_globally(from_vr, to_vr,
-                                        objects_swap_positions,
-                                        predicate_changes,
-                                        vrd_img_names, vrd_anno,
-                                        vrd_objects, vrd_predicates)
-
-    print(f'{vr_pair} processed globally; {nchanged} vr instances changed')
-    print()
-
-if len(vrdcfg.step_9_from_vr_to_vr) > 0:
-    print('Processing of global vr transformations complete')
-    print()
+save_required = vrdsteps.perform_step_9(vrd_anno, vrd_objects, vrd_predicates,
+                                        vrdcfg)
 
 #%% save customised annotations to file on disk
 
-if len(vrdcfg.step_9_from_vr_to_vr) > 0:
-    vrdu3.write_customised_annotations_to_file(vrd_anno, vrd_anno_path)
+if save_required:
+    vrdu3.write_customised_annotations_to_file(vrd_anno, vrd_anno_path,
+                                               vrd_objects, vrd_predicates)
     print(f'Customised annotations saved to file: {vrd_anno_path}')
 
 print()
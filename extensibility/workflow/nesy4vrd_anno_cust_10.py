@@ -36,6 +36,7 @@ NeSy4VRD workflow and running it just in case, as a quality control measure.
 
 import os
 import nesy4vrd_utils3 as vrdu3
+import nesy4vrd_anno_cust_steps as vrdsteps
 
 # Import the appropriate NeSy4VRD workflow configuration module
 # depending on whether we are doing a 'training set' or 'test set' run
@@ -73,50 +74,14 @@ print()
 
 #%% find and remove duplicate visual relationships
 
-im_cnt = 0
-vr_cnt = 0
-
-for imname in vrd_img_names:
-          
-    imanno = vrd_anno[imname].copy() # we want a new object, not a 'view' object
-    n_vrs = len(imanno)
-    dup_vr_indices = []
-    
-    if n_vrs < 2:
-        pass # no possibility of duplicates
-    else:
-        for idx1, vr1 in enumerate(imanno):
-            for idx2 in range(idx1+1, n_vrs):
-                vr2 = imanno[idx2]
-                duplicates = vrdu3.check_if_vrs_are_duplicates(vr1, vr2)
-                if duplicates:
-                    dup_vr_indices.append(idx2)
-   
-    if len(dup_vr_indices) > 0:
-        # eliminate duplicate references to duplicate vrs and sort the
-        # resulting distinct indices in ascending order
-        dup_vr_indices = sorted(list(set(dup_vr_indices)))
-        
-        # remove any duplicate vrs in DESCENDING order of vr index so that
-        # no removal can invalidate the index of another duplicate vr yet
-        # to be removed
-        for idx in reversed(dup_vr_indices):
-            del imanno[idx]
-            vr_cnt += 1
-        
-        # overwrite old annos with new annos
-        vrd_anno[imname] = imanno
-        im_cnt += 1
-
-print(f'number of images with duplicate vrs: {im_cnt}')
-
-print(f'number of duplicate vrs removed: {vr_cnt}')
+save_required = vrdsteps.perform_step_10(vrd_anno)
 
 
 #%% save customised annotations to file on disk
 
-if len(vrdcfg.step_9_from_vr_to_vr) > 0:
-    vrdu3.write_customised_annotations_to_file(vrd_anno, vrd_anno_path)
+if save_required:
+    vrdu3.write_customised_annotations_to_file(vrd_anno, vrd_anno_path,
+                                               vrd_objects, vrd_predicates)
     print(f'Customised annotations saved to file: {vrd_anno_path}')
 
 print()
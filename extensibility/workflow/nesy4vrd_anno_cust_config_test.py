@@ -275,3 +275,59 @@ step_11_save_customised_annotations = True
 
 
 
+
+
+#%% protocol execution config parameters
+
+# The instructions in a NeSy4VRD protocol annotation customisation
+# instructions file are executed image by image. For large instructions
+# files, the images are processed in parallel, in a pool of worker
+# processes; the outcome is identical to that of serial processing.
+# Specify the number of worker processes: 1 means always process the
+# images serially; None means use all available CPUs.
+
+protocol_n_workers = None
+
+# When an instructions file is loaded, the bboxes it specifies (the new
+# bboxes of 'cvrsbb' and 'cvrobb' instructions, and the bboxes of the new
+# VRs of 'avrxxx' instructions) can be checked against the sizes of their
+# images. The image sizes are read from the image metadata manifest of the
+# image directory, or from the headers of the image files; the images are
+# never opened. To enable the check, list the directory names which, when
+# joined, form a relative path to the directory containing the VRD images,
+# e.g. ['data', 'test_images']. None means no check.
+
+protocol_image_dir = None
+
+
+#%% workflow runner config parameters
+
+# The workflow runner script (nesy4vrd_anno_cust_runner.py) performs all
+# of the steps of a run of the workflow in a single process: it loads the
+# NeSy4VRD annotations data once, performs the steps listed here in order,
+# on the data held in memory, and saves the customised annotations once,
+# at the end. These parameters are used only by the runner script; the
+# scripts for the individual steps ignore them.
+
+# Specify the numbers of the workflow steps to be performed by the runner.
+# This 'test set' run of the workflow skips Steps 1 and 8.
+
+workflow_steps = [2, 3, 4, 5, 6, 7, 9, 10, 11]
+
+
+# Specify the numbers of any workflow steps after which the runner is to
+# save a checkpoint copy of the customised annotations. A checkpoint file
+# is saved in the annotations directory with the step number appended to
+# the name of the annotations file (e.g. '..._step_05.json').
+
+workflow_checkpoint_steps = []
+
+# Specify the numbers of any workflow steps after which the runner is to
+# run the quality verification checks of the annotations analysis module
+# nesy4vrd_quality_checks.py (flawed inverse VRs, duplicate VRs, VRs with
+# identical bboxes, bboxes with multiple object classes and degenerate
+# bboxes, plus out-of-bounds bboxes if 'protocol_image_dir' is set) on the
+# customised annotations, and report its findings. The checks do not
+# change the annotations or abort the run.
+
+workflow_quality_check_steps = []
@@ -0,0 +1,652 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: David Herron
+"""
+
+'''
+This module compiles and executes NeSy4VRD protocol annotation
+customisation instruction files.
+
+Processing an instruction file happens in two separate phases:
+* compilation: every line of the file is parsed and validated against the
+  NeSy4VRD object class names and predicate names, and the instructions
+  are converted to typed instruction records, grouped per image, in which
+  all object class names, predicate names and target visual relationships
+  (VRs) have been resolved to integer ids; any error in the file is
+  reported (by line number) before any annotation is changed
+* execution: the compiled instructions for each image are applied to the
+  image's VR annotations, checking each target VR by comparing integer ids;
+  all of the customised annotations are staged and applied to the
+  annotations dictionary only once every instruction has executed
+  successfully, so a failing instruction leaves the annotations dictionary
+  unchanged
+
+The instructions for different images are independent of one another, so
+execution splits the compiled instructions into per-image work units. For
+large instruction files these are executed in a pool of worker processes,
+which share the annotations dictionary read-only; the results are merged
+back in file order, and errors are reported with their original line
+numbers, so the outcome is identical to that of serial execution.
+
+Compiled instructions are cached on disk, in a file alongside the
+instructions file, keyed by a hash of the content of the instructions
+file and of the object class names and predicate names against which they
+were compiled. Repeated runs (and dry runs) of an unchanged instructions
+file therefore skip parsing entirely.
+
+Optionally, once an instructions file is compiled (or loaded from the
+cache), the bboxes it specifies can be checked against the sizes of their
+images, which are read from image file headers rather than by opening the
+images.
+'''
+
+#%%
+
+import ast
+import copy
+import hashlib
+import json
+import multiprocessing
+import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import nesy4vrd_utils3 as vrdu3
+# (the analysis modules are on the path once nesy4vrd_utils3 is imported)
+import nesy4vrd_utils as vrdu
+import nesy4vrd_image_manifest as vrdim
+
+
+#%% compiled instruction records
+
+# An instruction applied to the VRs of an image.
+#   line_num : integer (line number in the instructions file)
+#   op : string (instruction name: 'cvrsoc', 'cvrsbb', 'cvrpxx', 'cvrooc',
+#        'cvrobb', 'rvrxxx' or 'avrxxx')
+#   vr_idx : integer (index of the target VR; None for 'avrxxx')
+#   target : tuple of 3 integers (the target VR as ('subject' class id,
+#            predicate id, 'object' class id); None for 'avrxxx')
+#   value : the new class id, predicate id or bbox, or the new VR
+#           dictionary (for 'avrxxx'); None for 'rvrxxx'
+Instruction = namedtuple('Instruction',
+                         ['line_num', 'op', 'vr_idx', 'target', 'value'])
+
+# The instructions for one image (one 'imname' line).
+#   imname : string (image name)
+#   line_num : integer (line number of the 'imname' line)
+#   remove_image : boolean (True if the line has a 'rimxxx' instruction)
+#   instructions : list of Instruction records
+ImageInstructions = namedtuple('ImageInstructions',
+                               ['imname', 'line_num', 'remove_image',
+                                'instructions'])
+
+
+im_instruction_imname = 'imname'  # image name declaration
+remove_image_instruction = 'rimxxx'  # remove image entry from anno dictionary
+
+vr_instruction_names_change = ['cvrsoc', # change vr 'subject' object class
+                               'cvrsbb', # change vr 'subject' bbox
+                               'cvrpxx', # change vr 'predicate'
+                               'cvrooc', # change vr 'object' object class
+                               'cvrobb'] # change vr 'object' bbox
+
+vr_instruction_names_remove = ['rvrxxx'] # remove vr from image annos
+
+vr_instruction_names_append = ['avrxxx'] # append (new) vr to image annos
+
+vr_instruction_names = vr_instruction_names_change + \
+                       vr_instruction_names_remove + \
+                       vr_instruction_names_append
+
+compiled_format_version = 2
+
+# the minimum number of per-image work units worth executing in parallel
+min_parallel_work_units = 1000
+
+
+#%% compilation
+
+def parse_target_vr(line_num, target_vr, instruction, vrd_objects,
+                    vrd_predicates):
+    '''
+    Resolve the target VR of an instruction, specified in readable form as
+    "('subject', 'predicate', 'object')", to integer ids.
+
+    The target VR must be written exactly as it would be printed by
+    vrdu.get_visual_relationships().
+
+    Returns:
+        target : tuple of 3 integers
+    '''
+
+    try:
+        names = ast.literal_eval(target_vr)
+    except (ValueError, SyntaxError):
+        names = None
+
+    if not (isinstance(names, tuple) and len(names) == 3 and
+            all(isinstance(name, str) for name in names) and
+            str(names) == target_vr):
+        raise ValueError(f"target vr for '{instruction}' instruction is malformed, line {line_num}")
+
+    sub_name, prd_name, obj_name = names
+    if not sub_name in vrd_objects:
+        raise ValueError(f"invalid object class name '{sub_name}' in target vr, line {line_num}")
+    if not prd_name in vrd_predicates:
+        raise ValueError(f"invalid predicate name '{prd_name}' in target vr, line {line_num}")
+    if not obj_name in vrd_objects:
+        raise ValueError(f"invalid object class name '{obj_name}' in target vr, line {line_num}")
+
+    return (vrd_objects.index(sub_name), vrd_predicates.index(prd_name),
+            vrd_objects.index(obj_name))
+
+
+def compile_anno_cust_instructions(anno_cust_lines, vrd_objects,
+                                   vrd_predicates):
+    '''
+    Parse and validate the lines of a NeSy4VRD protocol annotation
+    customisation instruction file and compile them into instruction
+    records grouped per image.
+
+    Everything that can be checked without reference to the annotations
+    themselves is checked here, and any error is reported by raising an
+    exception that gives the number of the offending line.
+
+    Returns:
+        compiled : list of ImageInstructions records (in file order)
+    '''
+
+    compiled = []
+    image_group = None
+    remove_vr_instruction_processed_for_image = False
+    big_num = 1000
+    last_remove_vr_idx = big_num
+
+    for line_num, line in enumerate(anno_cust_lines):
+
+        line = line.strip()
+        ln = line_num + 1
+
+        # blank lines and comment lines require no processing
+        if len(line) == 0 or line[0] == '#':
+            continue
+
+        instruction = line[0:6]
+
+        # an image name line starts the instructions for a new image
+        if instruction == im_instruction_imname:
+            imname, rim_instruction = vrdu3.parse_image_line(ln, line)
+            if rim_instruction == '':
+                remove_image = False
+            elif rim_instruction == remove_image_instruction:
+                remove_image = True
+            else:
+                raise ValueError(f'image instruction not recognised; line {ln}')
+            image_group = ImageInstructions(imname, ln, remove_image, [])
+            compiled.append(image_group)
+            remove_vr_instruction_processed_for_image = False
+            last_remove_vr_idx = big_num
+            continue
+
+        if not instruction in vr_instruction_names:
+            raise ValueError(f'Line type not recognised in source line {ln}')
+
+        # every vr instruction must be associated with an image that is
+        # being kept
+        if image_group is None or image_group.remove_image:
+            raise ValueError(f'orphan instruction encountered (no associated image); line {ln}')
+
+        if instruction in vr_instruction_names_change and \
+           remove_vr_instruction_processed_for_image:
+            raise Exception(f"'cvr...' instruction  after 'rvrxxx' instruction not allowed, line {ln}")
+
+        target_vr = None
+        if instruction == 'cvrsoc':
+            vr_idx, target_vr, value = vrdu3.parse_change_soc_instruction(ln, line, vrd_objects)
+        elif instruction == 'cvrsbb':
+            vr_idx, target_vr, value = vrdu3.parse_change_sbb_instruction(ln, line, vrd_objects)
+        elif instruction == 'cvrpxx':
+            vr_idx, target_vr, value = vrdu3.parse_change_predicate_instruction(ln, line, vrd_predicates)
+        elif instruction == 'cvrooc':
+            vr_idx, target_vr, value = vrdu3.parse_change_ooc_instruction(ln, line, vrd_objects)
+        elif instruction == 'cvrobb':
+            vr_idx, target_vr, value = vrdu3.parse_change_obb_instruction(ln, line, vrd_objects)
+        elif instruction == 'rvrxxx':
+            vr_idx, target_vr = vrdu3.parse_remove_vr_instruction(ln, line, vrd_objects)
+            value = None
+            if remove_vr_instruction_processed_for_image:
+                if not vr_idx < last_remove_vr_idx:
+                    raise Exception(f"'rvrxxx' instructions not in descending order by index, line {ln}")
+            remove_vr_instruction_processed_for_image = True
+            last_remove_vr_idx = vr_idx
+        else: # 'avrxxx'
+            vr_idx = None
+            value = vrdu3.parse_append_vr_instruction(ln, line, vrd_objects, vrd_predicates)
+
+        target = None
+        if target_vr is not None:
+            target = parse_target_vr(ln, target_vr, instruction, vrd_objects,
+                                     vrd_predicates)
+
+        image_group.instructions.append(Instruction(ln, instruction, vr_idx,
+                                                    target, value))
+
+    return compiled
+
+
+#%% caching of compiled instructions
+
+def get_compilation_key(anno_cust_bytes, vrd_objects, vrd_predicates):
+    '''
+    Get the key under which the compiled form of an instructions file is
+    cached: a hash of the content of the file and of the object class
+    names and predicate names against which it is compiled.
+    '''
+
+    hasher = hashlib.sha256()
+    hasher.update(anno_cust_bytes)
+    hasher.update(json.dumps([compiled_format_version, list(vrd_objects),
+                              list(vrd_predicates)]).encode('utf-8'))
+
+    return hasher.hexdigest()
+
+
+def encode_compiled_instructions(compiled):
+    '''
+    Convert compiled instructions to plain (JSON-serialisable) data.
+    '''
+    return [[group.imname, group.line_num, group.remove_image,
+             [list(instr) for instr in group.instructions]]
+            for group in compiled]
+
+
+def decode_compiled_instructions(data):
+    '''
+    Convert plain data produced by encode_compiled_instructions() back to
+    compiled instructions.
+    '''
+
+    compiled = []
+    for imname, line_num, remove_image, instructions in data:
+        group = ImageInstructions(imname, line_num, remove_image, [])
+        for ln, op, vr_idx, target, value in instructions:
+            if target is not None:
+                target = tuple(target)
+            group.instructions.append(Instruction(ln, op, vr_idx, target, value))
+        compiled.append(group)
+
+    return compiled
+
+
+def load_compiled_anno_cust_instructions(filename, vrd_objects,
+                                         vrd_predicates, cache_path=None):
+    '''
+    Get the compiled form of a NeSy4VRD protocol annotation customisation
+    instruction file, from the on-disk cache if it is up to date, or
+    otherwise by compiling the file (and saving the result to the cache).
+
+    The cache is a JSON file whose header (its first line) records the
+    compilation key; the body is decoded only if the key matches.
+
+    Parameters:
+        filename : string (path to the instructions file)
+        cache_path : string (path of the cache file; by default, a file
+                     named after the instructions file, with
+                     '.compiled.json' appended, in the cache directory
+                     alongside it (see vrdu.get_cache_path()))
+
+    Returns:
+        compiled : list of ImageInstructions records
+    '''
+
+    if cache_path is None:
+        cache_path = vrdu.get_cache_path(filename, '.compiled.json')
+
+    with open(filename, 'rb') as fp:
+        anno_cust_bytes = fp.read()
+
+    key = get_compilation_key(anno_cust_bytes, vrd_objects, vrd_predicates)
+    header = {'format_version': compiled_format_version, 'key': key}
+
+    data = vrdu.read_cache_file(cache_path, header)
+    if data is not None:
+        return decode_compiled_instructions(data)
+
+    anno_cust_lines = anno_cust_bytes.decode('utf-8').splitlines()
+
+    compiled = compile_anno_cust_instructions(anno_cust_lines, vrd_objects,
+                                              vrd_predicates)
+
+    vrdu.write_cache_file(cache_path, header,
+                          encode_compiled_instructions(compiled))
+
+    return compiled
+
+
+#%% checking bboxes against image bounds
+
+def check_compiled_bboxes_within_images(compiled, imagedir):
+    '''
+    Check that every bbox specified by the compiled instructions (the new
+    bboxes of 'cvrsbb' and 'cvrobb' instructions, and the 'subject' and
+    'object' bboxes of the new VRs of 'avrxxx' instructions) lies within
+    the bounds of its image.
+
+    The sizes of the images are taken from the image metadata manifest of
+    the image directory, or read from the headers of the image files (see
+    module nesy4vrd_image_manifest); no image is opened per instruction.
+    All of the bboxes are checked in one pass, and the first bbox (in file
+    order) found to be out of bounds is reported by raising an exception
+    that gives the number of the offending line.
+    '''
+
+    line_nums = []
+    img_idxs = []
+    bboxes = []
+    img_names = []
+
+    for image_group in compiled:
+        if image_group.remove_image:
+            continue
+        img_idx = len(img_names)
+        for instr in image_group.instructions:
+            if instr.op in ['cvrsbb', 'cvrobb']:
+                instr_bboxes = [instr.value]
+            elif instr.op == 'avrxxx':
+                instr_bboxes = [instr.value['subject']['bbox'],
+                                instr.value['object']['bbox']]
+            else:
+                continue
+            for bbox in instr_bboxes:
+                line_nums.append(instr.line_num)
+                img_idxs.append(img_idx)
+                bboxes.append(bbox)
+        if len(img_idxs) > 0 and img_idxs[-1] == img_idx:
+            img_names.append(image_group.imname)
+
+    if len(bboxes) == 0:
+        return None
+
+    image_sizes = vrdim.get_image_sizes(img_names, imagedir)
+    sizes = image_sizes[np.asarray(img_idxs)]
+    bboxes = np.asarray(bboxes, dtype=np.int64)
+
+    mask = vrdu.get_out_of_bounds_bbox_mask(bboxes, sizes)
+    if mask.any():
+        idx = int(np.argmax(mask))
+        imname = img_names[img_idxs[idx]]
+        width, height = sizes[idx]
+        raise ValueError(f'bbox {bboxes[idx].tolist()} out of bounds of image {imname} (W x H: {width} x {height}); line {line_nums[idx]}')
+
+    return None
+
+
+#%% execution
+
+def execute_image_instructions(imanno, instructions, vrd_objects,
+                               vrd_predicates):
+    '''
+    Apply the compiled instructions for an image to the image's VRs.
+
+    A single ImageVRView of the image's VRs is shared by all of the
+    instructions, so each target VR check compares integer ids in O(1).
+
+    Parameters:
+        imanno : list of dictionaries (vr annotations for an image); the
+                 list and its vrs are modified in place, so pass a copy
+
+    Returns:
+        imanno : list of dictionaries
+    '''
+
+    vr_view = vrdu3.ImageVRView(imanno, vrd_objects, vrd_predicates)
+
+    for line_num, op, vr_idx, target, value in instructions:
+
+        if op == 'cvrsoc':
+            vrdu3.change_vr_soc(imanno, vr_idx, target, value, vrd_objects,
+                                vrd_predicates, line_num, vr_view)
+        elif op == 'cvrsbb':
+            vrdu3.change_vr_sbb(imanno, vr_idx, target, list(value), vrd_objects,
+                                vrd_predicates, line_num, vr_view)
+        elif op == 'cvrpxx':
+            vrdu3.change_vr_predicate(imanno, vr_idx, target, value, vrd_objects,
+                                      vrd_predicates, line_num, vr_view)
+        elif op == 'cvrooc':
+            vrdu3.change_vr_ooc(imanno, vr_idx, target, value, vrd_objects,
+                                vrd_predicates, line_num, vr_view)
+        elif op == 'cvrobb':
+            vrdu3.change_vr_obb(imanno, vr_idx, target, list(value), vrd_objects,
+                                vrd_predicates, line_num, vr_view)
+        elif op == 'rvrxxx':
+            vrdu3.remove_vr(imanno, vr_idx, target, vrd_objects,
+                            vrd_predicates, line_num, vr_view)
+        else: # 'avrxxx'
+            vr_view.append_vr(copy.deepcopy(value))
+
+    return imanno
+
+
+def get_image_work_units(compiled):
+    '''
+    Split compiled instructions into independent per-image work units.
+
+    The instructions for different images are independent of one another,
+    so each image is a separate unit of work. An image named on more than
+    one 'imname' line has all of its instruction groups in a single unit,
+    in file order.
+
+    Returns:
+        work_units : list of lists of integers (the indices, into
+                     'compiled', of the instruction groups of each image;
+                     the units are in order of first appearance)
+    '''
+
+    unit_indices = {}
+    work_units = []
+
+    for group_idx, image_group in enumerate(compiled):
+        imname = image_group.imname
+        if not imname in unit_indices:
+            unit_indices[imname] = len(work_units)
+            work_units.append([])
+        work_units[unit_indices[imname]].append(group_idx)
+
+    return work_units
+
+
+def execute_image_work_unit(compiled, work_unit, vrd_anno, vrd_objects,
+                            vrd_predicates):
+    '''
+    Execute the instruction groups of a single image.
+
+    'vrd_anno' is only read, never changed. Any exception is caught and
+    returned, together with the index of the instruction group that raised
+    it, so that the caller can report the first failure in file order.
+
+    Returns:
+        imname : string
+        result : list of dictionaries (the customised annotations of the
+                 image), or None (the image is to be removed, or is
+                 unchanged)
+        changed : boolean (True if the image has staged changes)
+        notes : list of (group index, message) tuples
+        failure : None, or (group index, exception) tuple
+    '''
+
+    imname = compiled[work_unit[0]].imname
+    imanno = vrd_anno.get(imname)
+    changed = False
+    notes = []
+
+    for group_idx in work_unit:
+
+        image_group = compiled[group_idx]
+        ln = image_group.line_num
+
+        try:
+            if imanno is None:
+                raise ValueError(f"image name '{imname}' not recognised; line {ln}")
+
+            if image_group.remove_image:
+                imanno = None
+                changed = True
+                continue
+
+            if len(image_group.instructions) == 0:
+                notes.append((group_idx, f"orphan image name '{imname}' has no instructions; line {ln}"))
+                continue
+
+            # work on a new object (down to the individual vrs), not a 'view'
+            imanno = execute_image_instructions(copy.deepcopy(imanno),
+                                                image_group.instructions,
+                                                vrd_objects, vrd_predicates)
+            changed = True
+
+        except Exception as exc:
+            return imname, None, False, notes, (group_idx, exc)
+
+    if not changed:
+        imanno = None
+
+    return imname, imanno, changed, notes, None
+
+
+# The data shared, read-only, with the worker processes of a parallel
+# execution. Worker processes are forked, so they inherit it rather than
+# receiving a pickled copy.
+_shared_execution_data = None
+
+
+def _execute_work_unit_batch(work_unit_batch):
+    compiled, vrd_anno, vrd_objects, vrd_predicates = _shared_execution_data
+    return [execute_image_work_unit(compiled, work_unit, vrd_anno,
+                                    vrd_objects, vrd_predicates)
+            for work_unit in work_unit_batch]
+
+
+def execute_work_units_parallel(compiled, work_units, vrd_anno, vrd_objects,
+                                vrd_predicates, n_workers):
+    '''
+    Execute per-image work units in a pool of worker processes.
+
+    The work units are submitted in batches, and the results are returned
+    in the order of 'work_units', regardless of the order in which the
+    workers complete them.
+
+    Returns:
+        results : list of execute_image_work_unit() results
+    '''
+
+    global _shared_execution_data
+
+    batch_size = max(1, len(work_units) // (n_workers * 4))
+    batches = [work_units[idx:idx+batch_size]
+               for idx in range(0, len(work_units), batch_size)]
+
+    _shared_execution_data = (compiled, vrd_anno, vrd_objects, vrd_predicates)
+    try:
+        mp_context = multiprocessing.get_context('fork')
+        with ProcessPoolExecutor(max_workers=n_workers,
+                                 mp_context=mp_context) as executor:
+            batch_results = list(executor.map(_execute_work_unit_batch,
+                                              batches))
+    finally:
+        _shared_execution_data = None
+
+    return [result for results in batch_results for result in results]
+
+
+def get_n_workers(n_workers, n_work_units):
+    '''
+    Determine the number of worker processes for executing 'n_work_units'
+    per-image work units. A result of 1 means execute serially.
+    '''
+
+    # worker processes are forked; where fork is unavailable (e.g. Windows),
+    # the driver scripts could not safely be re-imported by spawned workers
+    if not 'fork' in multiprocessing.get_all_start_methods():
+        return 1
+
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+
+    # for small instruction files, starting workers costs more than it saves
+    if n_work_units < min_parallel_work_units:
+        return 1
+
+    return max(1, min(n_workers, n_work_units))
+
+
+def execute_compiled_instructions(compiled, vrd_anno, vrd_objects,
+                                  vrd_predicates, dry_run=False,
+                                  n_workers=1):
+    '''
+    Execute compiled NeSy4VRD protocol annotation customisation
+    instructions against an annotations dictionary.
+
+    The instructions are split into independent per-image work units
+    which, if 'n_workers' permits, are executed in a pool of worker
+    processes. The customised annotations are staged, merged in file order,
+    and applied to 'vrd_anno' only once every instruction has executed
+    successfully. If any instruction fails, the exception raised is the
+    one for the first failing instruction in file order (reporting its
+    line number), exactly as for serial execution.
+
+    Parameters:
+        compiled : list of ImageInstructions records
+        vrd_anno : dictionary (the annotations dictionary)
+        dry_run : boolean
+            - if True, every instruction is executed and checked, but
+              'vrd_anno' is left unchanged
+        n_workers : integer, or None
+            - the number of worker processes; 1 means execute serially;
+              None means use all available CPUs
+
+    Returns:
+        image_cnt : integer (number of images processed)
+    '''
+
+    work_units = get_image_work_units(compiled)
+
+    n_workers = get_n_workers(n_workers, len(work_units))
+
+    if n_workers > 1:
+        results = execute_work_units_parallel(compiled, work_units, vrd_anno,
+                                              vrd_objects, vrd_predicates,
+                                              n_workers)
+    else:
+        results = [execute_image_work_unit(compiled, work_unit, vrd_anno,
+                                           vrd_objects, vrd_predicates)
+                   for work_unit in work_units]
+
+    # find the first failure in file order
+    failure = None
+    for _, _, _, _, unit_failure in results:
+        if unit_failure is not None:
+            if failure is None or unit_failure[0] < failure[0]:
+                failure = unit_failure
+
+    # report notes in file order (up to the point of any failure)
+    notes = sorted(note for result in results for note in result[3])
+    for group_idx, message in notes:
+        if failure is not None and group_idx > failure[0]:
+            break
+        print(message)
+
+    if failure is not None:
+        raise failure[1]
+
+    if not dry_run:
+        for imname, imanno, changed, _, _ in results:
+            if not changed:
+                continue
+            if imanno is None:
+                vrdu3.remove_image(imname, vrd_anno)
+            else:
+                vrd_anno[imname] = imanno
+
+    return len(compiled)
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: David Herron
+"""
+
+'''
+This script is the runner script for the NeSy4VRD workflow.
+
+The NeSy4VRD workflow applies planned customisations to the NeSy4VRD
+visual relationship (VR) annotations of the images of the VRD image dataset
+in a configurable, managed, automated and repeatable process.
+
+Rather than running the script for each step of the workflow in turn (each
+of which loads the annotations data, performs its step, and saves the
+annotations data again), this script performs a complete run of the
+workflow in a single process. It:
+* loads the NeSy4VRD object class names, predicate names and visual
+  relationship annotations once,
+* performs the workflow steps listed in configuration parameter
+  'workflow_steps', in order, on the data held in memory,
+* optionally, saves a checkpoint copy of the customised annotations after
+  each of the steps listed in configuration parameter
+  'workflow_checkpoint_steps',
+* optionally, runs the quality verification checks on the customised
+  annotations after each of the steps listed in configuration parameter
+  'workflow_quality_check_steps', and reports the findings, and
+* saves the customised annotations (and, if Step 1 changed them, the
+  object class names and predicate names) once, at the end.
+
+If any step encounters a problem, the run aborts and reports it, and none
+of the NeSy4VRD annotations data files is changed (apart from any
+checkpoint files already saved).
+
+A protocol step (2, 7, 8 or 11) whose 'save customised annotations'
+configuration parameter is False is performed as a 'dry run': its
+instructions are validated and executed, but their effects are discarded,
+just as they would be if the protocol driver script did not save them.
+'''
+
+#%%
+
+import os
+import nesy4vrd_utils3 as vrdu3
+import nesy4vrd_anno_cust_steps as vrdsteps
+import nesy4vrd_quality_checks as vrdqc
+
+# Import the appropriate NeSy4VRD workflow configuration module
+# depending on whether we are doing a 'training set' or 'test set' run
+# of the NeSy4VRD workflow.
+
+import nesy4vrd_anno_cust_config_train as vrdcfg
+#import nesy4vrd_anno_cust_config_test as vrdcfg
+
+
+#%% get the NeSy4VRD annotations data
+
+# set the path to the directory in which the source NeSy4VRD annotations
+# data files reside
+anno_dir = os.path.join('..', '..', *vrdcfg.anno_dir)
+
+# get the NeSy4VRD object class names
+vrd_objects_path = os.path.join(anno_dir, vrdcfg.object_classes_file)
+vrd_objects = vrdu3.load_NeSy4VRD_object_class_names(vrd_objects_path)
+
+# get NeSy4VRD predicate names
+vrd_predicates_path = os.path.join(anno_dir, vrdcfg.predicates_file)
+vrd_predicates = vrdu3.load_NeSy4VRD_predicate_names(vrd_predicates_path)
+
+# get NeSy4VRD visual relationship annotations (indexed, because several
+# steps search them repeatedly)
+vrd_anno_path = os.path.join(anno_dir, vrdcfg.annotations_file)
+vrd_anno = vrdu3.load_NeSy4VRD_image_annotations_indexed(vrd_anno_path)
+
+print('Annotations data loaded ...')
+print(f'Number of image entries in VR annotations dictionary: {len(vrd_anno)}')
+print()
+
+
+#%% perform the configured workflow steps
+
+objects_changed = False
+predicates_changed = False
+annotations_changed = False
+
+for workflow_step_number in vrdcfg.workflow_steps:
+
+    print(f'Step {workflow_step_number}: processing begins ...')
+    print()
+
+    if workflow_step_number == 1:
+        results = vrdsteps.perform_step_1(vrd_objects, vrd_predicates, vrdcfg)
+        vrd_objects, vrd_predicates, objs_changed, prds_changed = results
+        objects_changed = objects_changed or objs_changed
+        predicates_changed = predicates_changed or prds_changed
+
+    elif workflow_step_number in vrdsteps.protocol_step_numbers:
+        _, save = vrdsteps.get_protocol_step_config(workflow_step_number, vrdcfg)
+        if save:
+            vrdsteps.perform_protocol_step(workflow_step_number, vrd_anno,
+                                           vrd_objects, vrd_predicates, vrdcfg)
+            annotations_changed = True
+        else:
+            vrdsteps.perform_protocol_step(workflow_step_number, vrd_anno,
+                                           vrd_objects, vrd_predicates, vrdcfg,
+                                           dry_run=True)
+            print('dry run; customisations discarded')
+            print()
+
+    else:
+        save_required = vrdsteps.perform_step(workflow_step_number, vrd_anno,
+                                              vrd_objects, vrd_predicates,
+                                              vrdcfg)
+        annotations_changed = annotations_changed or save_required
+
+    if workflow_step_number in vrdcfg.workflow_checkpoint_steps:
+        stem, ext = os.path.splitext(vrd_anno_path)
+        checkpoint_path = f'{stem}_step_{workflow_step_number:02d}{ext}'
+        vrdu3.write_customised_annotations_to_file(vrd_anno, checkpoint_path,
+                                                   vrd_objects, vrd_predicates)
+        print(f'Checkpoint annotations saved to file: {checkpoint_path}')
+        print()
+
+    if workflow_step_number in vrdcfg.workflow_quality_check_steps:
+        imagedir = None
+        if vrdcfg.protocol_image_dir is not None:
+            imagedir = os.path.join('..', '..', *vrdcfg.protocol_image_dir)
+        findings = vrdqc.run_quality_checks(list(vrd_anno.keys()), vrd_anno,
+                                            imagedir=imagedir)
+        print('Quality checks (images, VRs):')
+        for check_name, (n_images, n_vrs) in findings.summary().items():
+            print(f'    {check_name}: {n_images}, {n_vrs}')
+        print()
+
+    print(f'Step {workflow_step_number}: processing complete')
+    print()
+
+
+#%% save the customised annotations data to files on disk
+
+if objects_changed:
+    vrdu3.save_VRD_object_class_names(vrd_objects, vrd_objects_path)
+    print(f'Extended object class names saved to file: {vrd_objects_path}')
+
+if predicates_changed:
+    vrdu3.save_VRD_predicate_names(vrd_predicates, vrd_predicates_path)
+    print(f'Revised/extended predicate names saved to file: {vrd_predicates_path}')
+
+if annotations_changed:
+    vrdu3.write_customised_annotations_to_file(vrd_anno, vrd_anno_path,
+                                               vrd_objects, vrd_predicates)
+    print(f'Customised annotations saved to file: {vrd_anno_path}')
+
+print()
+print('Workflow run complete')
@@ -0,0 +1,475 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: David Herron
+"""
+
+'''
+This module defines functions that perform the steps of the NeSy4VRD
+workflow.
+
+Each function applies the annotation customisations of one step of the
+workflow, as configured in a NeSy4VRD workflow configuration module, to
+annotations data that have already been loaded into memory. None of the
+functions loads or saves anything. Loading and saving are left to the
+caller, which is either:
+* the script for an individual step of the workflow (e.g.
+  nesy4vrd_anno_cust_04.py), which loads the annotations, performs its
+  one step and saves the annotations, or
+* the workflow runner script (nesy4vrd_anno_cust_runner.py), which loads
+  the annotations once, performs all of the configured steps of the
+  workflow in sequence, and saves the annotations once.
+
+The functions that perform steps which modify the annotations return a
+value indicating whether the customised annotations need to be saved.
+'''
+
+#%%
+
+import os
+
+import nesy4vrd_utils3 as vrdu3
+import nesy4vrd_anno_cust_protocol as vrdprot
+
+
+#%% Step 1
+
+def perform_step_1(vrd_objects, vrd_predicates, vrdcfg):
+    '''
+    Step 1: modify the master lists of NeSy4VRD object class names and
+    predicate names.
+
+    Returns:
+        vrd_objects : list of strings (the object class names)
+        vrd_predicates : list of strings (the predicate names)
+        objects_changed : boolean
+        predicates_changed : boolean
+    '''
+
+    objects_changed = False
+
+    # introduce any new object class names
+    if len(vrdcfg.step_1_new_object_names) > 0:
+        vrd_objects = list(vrd_objects) # make object class names mutable
+        for name in vrdcfg.step_1_new_object_names:
+            if name in vrd_objects:
+                raise ValueError(f'new object class name already exists: {name}')
+            vrd_objects.append(name)
+        objects_changed = True
+
+    # adjust/extend predicate names
+    predicates_adjusted = False
+    predicates_added = False
+
+    if len(vrdcfg.step_1_predicate_name_adjustments) > 0:
+        vrd_predicates = list(vrd_predicates) # make predicate names mutable
+        for adjustment in vrdcfg.step_1_predicate_name_adjustments:
+            from_name, to_name = adjustment
+            if not from_name in vrd_predicates:
+                raise ValueError(f'predicate name not recognised: {from_name}')
+            from_name_idx = vrd_predicates.index(from_name)
+            vrd_predicates[from_name_idx] = to_name
+            predicates_adjusted = True
+
+    if len(vrdcfg.step_1_new_predicate_names) > 0:
+        if not predicates_adjusted:
+            vrd_predicates = list(vrd_predicates) # convert tuple to list
+        for name in vrdcfg.step_1_new_predicate_names:
+            if name in vrd_predicates:
+                raise ValueError(f'new predicate name already exists: {name}')
+            vrd_predicates.append(name)
+            predicates_added = True
+
+    predicates_changed = predicates_adjusted or predicates_added
+
+    return vrd_objects, vrd_predicates, objects_changed, predicates_changed
+
+
+#%% Steps 2, 7, 8 and 11
+
+protocol_step_numbers = [2, 7, 8, 11]
+
+
+def get_protocol_step_config(workflow_step_number, vrdcfg):
+    '''
+    Get the configuration of a workflow step that processes a NeSy4VRD
+    protocol annotation customisation instruction file.
+
+    Returns:
+        filename : string (name of the instructions file)
+        save_customised_annotations : boolean
+    '''
+
+    if workflow_step_number == 2:
+        filename = vrdcfg.step_2_vrd_anno_cust_instructions_file
+        save = vrdcfg.step_2_save_customised_annotations
+    elif workflow_step_number == 7:
+        filename = vrdcfg.step_7_vrd_anno_cust_instructions_file
+        save = vrdcfg.step_7_save_customised_annotations
+    elif workflow_step_number == 8:
+        filename = vrdcfg.step_8_vrd_anno_cust_instructions_file
+        save = vrdcfg.step_8_save_customised_annotations
+    elif workflow_step_number == 11:
+        filename = vrdcfg.step_11_vrd_anno_cust_instructions_file
+        save = vrdcfg.step_11_save_customised_annotations
+    else:
+        raise ValueError('invalid annotation customisation step number specified')
+
+    return filename, save
+
+
+def perform_protocol_step(workflow_step_number, vrd_anno, vrd_objects,
+                          vrd_predicates, vrdcfg, dry_run=False):
+    '''
+    Steps 2, 7, 8 and 11: process a NeSy4VRD protocol annotation
+    customisation instruction file.
+
+    The compiled form of the instructions file is taken from the on-disk
+    cache when the file is unchanged since it was last compiled (see
+    module nesy4vrd_anno_cust_protocol).
+
+    Parameters:
+        dry_run : boolean
+            - if True, the instructions are validated and executed, but
+              'vrd_anno' is left unchanged
+
+    Returns:
+        save_required : boolean
+            - the value of the step's 'save customised annotations'
+              configuration parameter
+    '''
+
+    filename, save = get_protocol_step_config(workflow_step_number, vrdcfg)
+
+    compiled = vrdprot.load_compiled_anno_cust_instructions(filename,
+                                                            vrd_objects,
+                                                            vrd_predicates)
+
+    print(f"Loaded annotation customisation instructions file '{filename}'")
+    print()
+
+    if vrdcfg.protocol_image_dir is not None:
+        imagedir = os.path.join('..', '..', *vrdcfg.protocol_image_dir)
+        vrdprot.check_compiled_bboxes_within_images(compiled, imagedir)
+        print('all instruction bboxes lie within the bounds of their images')
+        print()
+
+    image_cnt = vrdprot.execute_compiled_instructions(compiled, vrd_anno,
+                                                      vrd_objects,
+                                                      vrd_predicates, dry_run,
+                                                      vrdcfg.protocol_n_workers)
+
+    print()
+    print('all annotation customisation instructions were interpreted and executed!')
+    print()
+    print(f'number of images processed: {image_cnt}')
+    print()
+
+    return save
+
+
+#%% Step 3
+
+def perform_step_3(vrd_anno, vrd_objects, vrd_predicates, vrdcfg):
+    '''
+    Step 3: change object class A to B, for a specified set of images.
+
+    Returns:
+        save_required : boolean
+    '''
+
+    if len(vrdcfg.step_3_from_class_to_class) != \
+       len(vrdcfg.step_3_from_class_to_class_img_names):
+        raise ValueError('problem with from/to class configuration parameters')
+
+    for idx, from_class_to_class in enumerate(vrdcfg.step_3_from_class_to_class):
+        from_name, to_name = from_class_to_class
+        if not from_name in vrd_objects:
+            raise ValueError(f"Object class 'from name' not recognised: {from_name}")
+        if not to_name in vrd_objects:
+           raise ValueError(f"Object class 'to name' not recognised: {to_name}")
+        img_names = vrdcfg.step_3_from_class_to_class_img_names[idx]
+        if len(img_names) > 0:
+            print(f"Switching object class '{from_name}' to '{to_name}' in named images begins ...")
+            print()
+        else:
+            raise ValueError(f"no image names for from/to class pair: {from_name}, {to_name}")
+
+        vrdu3.switch_object_classes_in_named_images(from_name, to_name, img_names,
+                                                    vrd_anno, vrd_objects,
+                                                    vrd_predicates)
+
+        print(f"Switching object class '{from_name}' to '{to_name}' in named images complete")
+        print()
+
+    return len(vrdcfg.step_3_from_class_to_class) > 0
+
+
+#%% Step 4
+
+def perform_step_4(vrd_anno, vrd_objects, vrd_predicates, vrdcfg):
+    '''
+    Step 4: change object class (or predicate) C to D, globally.
+
+    Returns:
+        save_required : boolean
+    '''
+
+    vrd_img_names = list(vrd_anno.keys())
+
+    # process the object class merges, if any
+
+    if len(vrdcfg.step_4_object_classes_to_merge) > 0:
+        print('Processing of object class merges begins ...')
+        print()
+
+    for pair in vrdcfg.step_4_object_classes_to_merge:
+        from_name, to_name = pair
+
+        if not from_name in vrd_objects:
+            raise ValueError(f"Object class 'from name' not recognised: {from_name}")
+        if not to_name in vrd_objects:
+            raise ValueError(f"Object class 'to name' not recognised: {to_name}")
+
+        vrdu3.merge_object_classes(from_name, to_name, vrd_img_names,
+                                   vrd_anno, vrd_objects, vrd_predicates)
+
+        print(f'Merge of object class {from_name} into {to_name} complete')
+        print()
+
+    if len(vrdcfg.step_4_object_classes_to_merge) > 0:
+        print('Processing of object class merges complete')
+        print()
+
+    # process the predicate merges, if any
+
+    if len(vrdcfg.step_4_predicates_to_merge) > 0:
+        print('Processing of predicate merges begins ...')
+        print()
+
+    for pair in vrdcfg.step_4_predicates_to_merge:
+        from_name, to_name = pair
+
+        if not from_name in vrd_predicates:
+            raise ValueError(f"Predicate 'from name' not recognised: {from_name}")
+        if not to_name in vrd_predicates:
+            raise ValueError(f"Predicate 'to name' not recognised: {to_name}")
+
+        vrdu3.merge_predicates(from_name, to_name, vrd_img_names,
+                               vrd_anno, vrd_objects, vrd_predicates)
+
+        print(f'Merge of predicate {from_name} into {to_name} complete')
+        print()
+
+    if len(vrdcfg.step_4_predicates_to_merge) > 0:
+        print('Processing of predicate merges complete')
+        print()
+
+    return len(vrdcfg.step_4_object_classes_to_merge) > 0 or \
+           len(vrdcfg.step_4_predicates_to_merge) > 0
+
+
+#%% Step 5
+
+def perform_step_5(vrd_anno, vrd_objects, vrd_predicates, vrdcfg):
+    '''
+    Step 5: remove specified visual relationship 'types', globally.
+
+    Returns:
+        save_required : boolean
+    '''
+
+    vrd_img_names = list(vrd_anno.keys())
+
+    if len(vrdcfg.step_5_vrs_to_remove) > 0:
+        print('Processing of global vr removals begins ...')
+        print()
+
+    for vr in vrdcfg.step_5_vrs_to_remove:
+        sub_name, prd_name, obj_name = vr
+
+        if not sub_name in vrd_objects:
+            raise ValueError(f'Subject name not recognised: {sub_name}')
+        if not prd_name in vrd_predicates:
+            raise ValueError(f'Predicate name not recognised: {prd_name}')
+        if not obj_name in vrd_objects:
+            raise ValueError(f'Object name not recognised: {obj_name}')
+
+        nremoved = vrdu3.remove_vr_globally(vr, vrd_img_names, vrd_anno,
+                                            vrd_objects, vrd_predicates)
+
+        print(f'vr {vr} removed globally; {nremoved} instances')
+        print()
+
+    if len(vrdcfg.step_5_vrs_to_remove) > 0:
+        print('Processing of global vr removals complete')
+        print()
+
+    return len(vrdcfg.step_5_vrs_to_remove) > 0
+
+
+#%% Step 6
+
+def perform_step_6(vrd_anno):
+    '''
+    Step 6: remove entries from the annotations dictionary for images with
+    zero annotations, globally.
+
+    Returns:
+        save_required : boolean
+    '''
+
+    # get the names of the images whose annotations are empty lists
+    images_with_empty_annos = []
+    for imname in list(vrd_anno.keys()):
+        imanno = vrd_anno[imname]
+        if len(imanno) == 0:
+            images_with_empty_annos.append(imname)
+
+    print(f'number of image names with zero annotations: {len(images_with_empty_annos)}')
+
+    # remove the entries for these images from the annotations dictionary
+    for imname in images_with_empty_annos:
+        del vrd_anno[imname]
+
+    print(f'entries removed from annotations dictionary: {len(images_with_empty_annos)}')
+
+    return len(images_with_empty_annos) > 0
+
+
+#%% Step 9
+
+def perform_step_9(vrd_anno, vrd_objects, vrd_predicates, vrdcfg):
+    '''
+    Step 9: transform visual relationship 'type' A to 'type' B, globally.
+
+    Returns:
+        save_required : boolean
+    '''
+
+    vrd_img_names = list(vrd_anno.keys())
+
+    if len(vrdcfg.step_9_from_vr_to_vr) > 0:
+        print('Processing of global vr transformations begins ...')
+        print()
+
+    for vr_pair in vrdcfg.step_9_from_vr_to_vr:
+        from_vr, to_vr = vr_pair
+
+        if not from_vr[0] in vrd_objects:
+            raise ValueError(f'Subject name not recognised: {from_vr[0]}')
+        if not from_vr[1] in vrd_predicates:
+            raise ValueError(f'Predicate name not recognised: {from_vr[1]}')
+        if not from_vr[2] in vrd_objects:
+            raise ValueError(f'Object name not recognised: {from_vr[2]}')
+
+        objects_swap_positions = None
+        if from_vr[0] == to_vr[0] and from_vr[2] == to_vr[2]:
+            objects_swap_positions = False
+        elif from_vr[0] == to_vr[2] and from_vr[2] == to_vr[0]:
+            objects_swap_positions = True
+        else:
+            raise ValueError(f'from_vr -> to_vr specification not valid: {vr_pair}')
+
+        if not to_vr[1] in vrd_predicates:
+            raise ValueError(f'Predicate name not recognised: {to_vr[1]}')
+
+        predicate_changes = True
+        if from_vr[1] == to_vr[1]:
+            predicate_changes = False
+
+        if ((not objects_swap_positions) and (not predicate_changes)):
+            raise ValueError(f'from_vr -> to_vr specification invalid: {vr_pair}')
+
+        nchanged = vrdu3.change_vr_globally(from_vr, to_vr,
+                                            objects_swap_positions,
+                                            predicate_changes,
+                                            vrd_img_names, vrd_anno,
+                                            vrd_objects, vrd_predicates)
+
+        print(f'{vr_pair} processed globally; {nchanged} vr instances changed')
+        print()
+
+    if len(vrdcfg.step_9_from_vr_to_vr) > 0:
+        print('Processing of global vr transformations complete')
+        print()
+
+    return len(vrdcfg.step_9_from_vr_to_vr) > 0
+
+
+#%% Step 10
+
+def perform_step_10(vrd_anno):
+    '''
+    Step 10: check for and remove duplicate visual relationships, globally.
+
+    Returns:
+        save_required : boolean
+    '''
+
+    vrd_img_names = list(vrd_anno.keys())
+
+    im_cnt = 0
+    vr_cnt = 0
+
+    # find every group of duplicate vrs in every image, in a single pass
+    # over the vrs of each image (rather than comparing every pair of vrs)
+    dup_img_names, image_dup_groups = vrdu3.get_duplicate_vr_groups(vrd_img_names,
+                                                                    vrd_anno)
+
+    for imname, dup_groups in zip(dup_img_names, image_dup_groups):
+
+        imanno = vrd_anno[imname].copy() # we want a new object, not a 'view' object
+
+        # keep the first vr of each group of duplicates and remove the others;
+        # sort the indices of the vrs to be removed in ascending order
+        dup_vr_indices = sorted([idx for group in dup_groups for idx in group[1:]])
+
+        # remove any duplicate vrs in DESCENDING order of vr index so that
+        # no removal can invalidate the index of another duplicate vr yet
+        # to be removed
+        for idx in reversed(dup_vr_indices):
+            del imanno[idx]
+            vr_cnt += 1
+
+        # overwrite old annos with new annos
+        vrd_anno[imname] = imanno
+        im_cnt += 1
+
+    print(f'number of images with duplicate vrs: {im_cnt}')
+
+    print(f'number of duplicate vrs removed: {vr_cnt}')
+
+    return vr_cnt > 0
+
+
+#%% all steps
+
+def perform_step(workflow_step_number, vrd_anno, vrd_objects, vrd_predicates,
+                 vrdcfg):
+    '''
+    Perform a step of the NeSy4VRD workflow, other than Step 1, on
+    annotations data held in memory.
+
+    Returns:
+        save_required : boolean
+    '''
+
+    if workflow_step_number in protocol_step_numbers:
+        return perform_protocol_step(workflow_step_number, vrd_anno,
+                                     vrd_objects, vrd_predicates, vrdcfg)
+    elif workflow_step_number == 3:
+        return perform_step_3(vrd_anno, vrd_objects, vrd_predicates, vrdcfg)
+    elif workflow_step_number == 4:
+        return perform_step_4(vrd_anno, vrd_objects, vrd_predicates, vrdcfg)
+    elif workflow_step_number == 5:
+        return perform_step_5(vrd_anno, vrd_objects, vrd_predicates, vrdcfg)
+    elif workflow_step_number == 6:
+        return perform_step_6(vrd_anno)
+    elif workflow_step_number == 9:
+        return perform_step_9(vrd_anno, vrd_objects, vrd_predicates, vrdcfg)
+    elif workflow_step_number == 10:
+        return perform_step_10(vrd_anno)
+    else:
+        raise ValueError(f'invalid workflow step number: {workflow_step_number}')
+
@@ -14,6 +14,8 @@ import json
 import sys
 sys.path.insert(0, '../analysis')
 import nesy4vrd_utils as vrdu
+import nesy4vrd_anno_index as vrdai
+import nesy4vrd_anno_binary as vrdab
 
 #%%
 
@@ -29,9 +31,36 @@ def load_NeSy4VRD_predicate_names(path):
  
 #%% 
 
-def load_NeSy4VRD_image_annotations(path):
+def load_NeSy4VRD_image_annotations(path, img_names=None):
 
-    return vrdu.load_VRD_image_annotations(path)
+    return vrdu.load_VRD_image_annotations(path, img_names)
+
+#%%
+
+def iter_NeSy4VRD_image_annotations(path, img_names=None):
+
+    return vrdu.iter_VRD_image_annotations(path, img_names)
+
+#%%
+
+def load_NeSy4VRD_image_annotations_indexed(path):
+    '''
+    Load the NeSy4VRD visual relationship annotations as a dictionary that
+    maintains inverted indexes over its content. The indexes are kept up
+    to date as image entries are assigned or deleted, so workflow steps
+    that search the annotations repeatedly can answer each search in
+    time proportional to the size of its result.
+    
+    The index is built in memory and is not saved to disk, because each
+    workflow step rewrites the annotations file it loads.
+    '''
+
+    vrd_anno = vrdu.load_VRD_image_annotations(path)
+
+    if not isinstance(vrd_anno, dict):
+        vrd_anno = dict(vrd_anno.items())
+
+    return vrdai.IndexedVRDAnnotations(vrd_anno)
 
 #%%
 
@@ -382,10 +411,122 @@ def parse_append_vr_instruction(line_num, line, vrd_objects, vrd_predicates):
     return  new_vr
 
 
+#%%
+
+class ImageVRView():
+    '''
+    A view of the visual relationship (VR) annotations of a single image,
+    used while customising them.
+
+    The view caches the readable form of each VR, ('subject', 'predicate',
+    'object'), and its string form, as and when they are first needed, and
+    keeps the caches up to date incrementally as the VRs are changed through
+    the view. Checking that an instruction's target VR matches the VR at a
+    given index therefore costs O(1), rather than rebuilding the readable
+    form of every VR of the image with vrdu.get_visual_relationships().
+
+    A target VR can be given either as a tuple of integer ids,
+    ('subject' class id, predicate id, 'object' class id), in which case the
+    integer ids are compared, or as a string of the form
+    "('subject', 'predicate', 'object')", in which case the cached string
+    form of the VR is compared.
+
+    Attributes:
+        imanno : list of dictionaries (the vr annotations of the image;
+                 changed in place by the methods of the view)
+    '''
+
+    def __init__(self, imanno, vrd_objects, vrd_predicates):
+        self.imanno = imanno
+        self.vrd_objects = vrd_objects
+        self.vrd_predicates = vrd_predicates
+        self._vr_tuples = [None] * len(imanno)
+        self._vr_strings = [None] * len(imanno)
+
+    def __len__(self):
+        return len(self.imanno)
+
+    def is_valid_vr_idx(self, vr_idx):
+        return vr_idx in range(0, len(self.imanno))
+
+    def get_vr_ids(self, vr_idx):
+        '''
+        Return a VR as ('subject' class id, predicate id, 'object' class id).
+        '''
+        vr = self.imanno[vr_idx]
+        return (vr['subject']['category'], vr['predicate'],
+                vr['object']['category'])
+
+    def get_vr(self, vr_idx):
+        '''
+        Return a VR in readable form, ('subject', 'predicate', 'object').
+        '''
+        vr_tuple = self._vr_tuples[vr_idx]
+        if vr_tuple is None:
+            sub_idx, prd_idx, obj_idx = self.get_vr_ids(vr_idx)
+            vr_tuple = (self.vrd_objects[sub_idx], self.vrd_predicates[prd_idx],
+                        self.vrd_objects[obj_idx])
+            self._vr_tuples[vr_idx] = vr_tuple
+        return vr_tuple
+
+    def get_vr_string(self, vr_idx):
+        '''
+        Return the string form of a VR, "('subject', 'predicate', 'object')".
+        '''
+        vr_string = self._vr_strings[vr_idx]
+        if vr_string is None:
+            vr_string = str(self.get_vr(vr_idx))
+            self._vr_strings[vr_idx] = vr_string
+        return vr_string
+
+    def vr_matches_target(self, vr_idx, target_vr):
+        '''
+        Return True if the VR at index 'vr_idx' matches a target VR (a tuple
+        of integer ids or a string).
+        '''
+        if isinstance(target_vr, tuple):
+            return self.get_vr_ids(vr_idx) == target_vr
+        return self.get_vr_string(vr_idx) == target_vr
+
+    def _invalidate(self, vr_idx):
+        self._vr_tuples[vr_idx] = None
+        self._vr_strings[vr_idx] = None
+
+    def set_subject_class(self, vr_idx, sub_idx):
+        self.imanno[vr_idx]['subject']['category'] = sub_idx
+        self._invalidate(vr_idx)
+
+    def set_subject_bbox(self, vr_idx, bbox):
+        # the readable form of a VR does not include its bboxes
+        self.imanno[vr_idx]['subject']['bbox'] = bbox
+
+    def set_predicate(self, vr_idx, prd_idx):
+        self.imanno[vr_idx]['predicate'] = prd_idx
+        self._invalidate(vr_idx)
+
+    def set_object_class(self, vr_idx, obj_idx):
+        self.imanno[vr_idx]['object']['category'] = obj_idx
+        self._invalidate(vr_idx)
+
+    def set_object_bbox(self, vr_idx, bbox):
+        self.imanno[vr_idx]['object']['bbox'] = bbox
+
+    def remove_vr(self, vr_idx):
+        del self.imanno[vr_idx]
+        del self._vr_tuples[vr_idx]
+        del self._vr_strings[vr_idx]
+
+    def append_vr(self, vr):
+        self.imanno.append(vr)
+        self._vr_tuples.append(None)
+        self._vr_strings.append(None)
+
+
 #%%
 
 def change_vr_soc(imanno, vr_idx, target_vr, new_subj_idx,
-                  vrd_objects, vrd_predicates, line_num):
+                  vrd_objects, vrd_predicates, line_num,
+                  vr_view=None):
     '''
     For a given image and a particular visual relationship, replace the
     current subject object class with a new one.
@@ -393,6 +534,9 @@ def change_vr_soc(imanno, vr_idx, target_vr, new_subj_idx,
     Parameters:
         imanno : list of dictionaries (vr annotations for an image)
         vr_idx : integer  (index of visual relationship to be modified)
+        target_vr : string, or tuple of 3 integers (the target vr)
+        vr_view : ImageVRView (optional; a view of 'imanno' shared across
+                  the customisations of an image)
         new_prd_idx : integer (id of the new predicate)
     
     Returns
@@ -403,23 +547,24 @@ def change_vr_soc(imanno, vr_idx, target_vr, new_subj_idx,
 
     # safety check; ensure the target vr we plan to change actually
     # matches the actual current vr indicated by vr_idx
-    vrs = vrdu.get_visual_relationships(imanno, vrd_objects, vrd_predicates)
-    if not vr_idx in range(0, len(vrs)):
+    if vr_view is None:
+        vr_view = ImageVRView(imanno, vrd_objects, vrd_predicates)
+    if not vr_view.is_valid_vr_idx(vr_idx):
         raise Exception(f"invalid vr index in 'cvrsoc' instruction, line {line_num}")
-    current_vr = str(vrs[vr_idx])
-    if not current_vr == target_vr:
+    if not vr_view.vr_matches_target(vr_idx, target_vr):
         raise Exception(f"cvrsoc instruction failed; target vr mismatches actual vr, line {line_num}")
     
     # change the predicate in the target relationship
-    imanno[vr_idx]['subject']['category'] = new_subj_idx
+    vr_view.set_subject_class(vr_idx, new_subj_idx)
     
-    return imanno
+    return vr_view.imanno
 
 
 #%%
 
 def change_vr_sbb(imanno, vr_idx, target_vr, new_subj_bbox,
-                  vrd_objects, vrd_predicates, line_num):
+                  vrd_objects, vrd_predicates, line_num,
+                  vr_view=None):
     '''
     For a given image and a particular visual relationship, replace the
     current subject bounding box with a new one.
@@ -427,6 +572,9 @@ def change_vr_sbb(imanno, vr_idx, target_vr, new_subj_bbox,
     Parameters:
         imanno : list of dictionaries (vr annotations for an image)
         vr_idx : integer  (index of visual relationship to be modified)
+        target_vr : string, or tuple of 3 integers (the target vr)
+        vr_view : ImageVRView (optional; a view of 'imanno' shared across
+                  the customisations of an image)
         new_prd_idx : integer (id of the new predicate)
     
     Returns
@@ -437,22 +585,23 @@ def change_vr_sbb(imanno, vr_idx, target_vr, new_subj_bbox,
 
     # safety check; ensure the target vr we plan to change actually
     # matches the actual current vr indicated by vr_idx
-    vrs = vrdu.get_visual_relationships(imanno, vrd_objects, vrd_predicates)
-    if not vr_idx in range(0, len(vrs)):
+    if vr_view is None:
+        vr_view = ImageVRView(imanno, vrd_objects, vrd_predicates)
+    if not vr_view.is_valid_vr_idx(vr_idx):
         raise Exception(f"invalid vr index in 'cvrsbb' instruction, line {line_num}")
-    current_vr = str(vrs[vr_idx])
-    if not current_vr == target_vr:
+    if not vr_view.vr_matches_target(vr_idx, target_vr):
         raise Exception(f"cvrsbb instruction failed; target vr mismatches actual vr, line {line_num}")
     
     # change the predicate in the target relationship
-    imanno[vr_idx]['subject']['bbox'] = new_subj_bbox
+    vr_view.set_subject_bbox(vr_idx, new_subj_bbox)
     
-    return imanno
+    return vr_view.imanno
 
 #%%
 
 def change_vr_predicate(imanno, vr_idx, target_vr, new_prd_idx,
-                        vrd_objects, vrd_predicates, line_num):
+                        vrd_objects, vrd_predicates, line_num,
+                        vr_view=None):
     '''
     For a given image and a particular visual relationship, replace the
     current predicate with a new one.
@@ -460,6 +609,9 @@ def change_vr_predicate(imanno, vr_idx, target_vr, new_prd_idx,
     Parameters:
         imanno : list of dictionaries (vr annotations for an image)
         vr_idx : integer  (index of visual relationship to be modified)
+        target_vr : string, or tuple of 3 integers (the target vr)
+        vr_view : ImageVRView (optional; a view of 'imanno' shared across
+                  the customisations of an image)
         new_prd_idx : integer (id of the new predicate)
     
     Returns
@@ -470,22 +622,23 @@ def change_vr_predicate(imanno, vr_idx, target_vr, new_prd_idx,
 
     # safety check; ensure the target vr we plan to change actually
     # matches the actual current vr indicated by vr_idx
-    vrs = vrdu.get_visual_relationships(imanno, vrd_objects, vrd_predicates)
-    if not vr_idx in range(0, len(vrs)):
+    if vr_view is None:
+        vr_view = ImageVRView(imanno, vrd_objects, vrd_predicates)
+    if not vr_view.is_valid_vr_idx(vr_idx):
         raise Exception(f"invalid vr index in 'cvrpxx' instruction, line {line_num}")
-    current_vr = str(vrs[vr_idx])
-    if not current_vr == target_vr:
+    if not vr_view.vr_matches_target(vr_idx, target_vr):
         raise Exception(f"cvrpxx instruction failed; expected vr mismatches actual vr; line {line_num}")
     
     # change the predicate in the target relationship
-    imanno[vr_idx]['predicate'] = new_prd_idx
+    vr_view.set_predicate(vr_idx, new_prd_idx)
     
-    return imanno
+    return vr_view.imanno
 
 #%%
 
 def change_vr_ooc(imanno, vr_idx, target_vr, new_obj_idx,
-                  vrd_objects, vrd_predicates, line_num):
+                  vrd_objects, vrd_predicates, line_num,
+                  vr_view=None):
     '''
     For a given image and a particular visual relationship, replace the
     current 'object' object class with a new one.
@@ -493,6 +646,9 @@ def change_vr_ooc(imanno, vr_idx, target_vr, new_obj_idx,
     Parameters:
         imanno : list of dictionaries (vr annotations for an image)
         vr_idx : integer  (index of visual relationship to be modified)
+        target_vr : string, or tuple of 3 integers (the target vr)
+        vr_view : ImageVRView (optional; a view of 'imanno' shared across
+                  the customisations of an image)
         new_prd_idx : integer (id of the new predicate)
     
     Returns
@@ -503,23 +659,24 @@ def change_vr_ooc(imanno, vr_idx, target_vr, new_obj_idx,
 
     # safety check; ensure the target vr we plan to change actually
     # matches the actual current vr indicated by vr_idx
-    vrs = vrdu.get_visual_relationships(imanno, vrd_objects, vrd_predicates)
-    if not vr_idx in range(0, len(vrs)):
+    if vr_view is None:
+        vr_view = ImageVRView(imanno, vrd_objects, vrd_predicates)
+    if not vr_view.is_valid_vr_idx(vr_idx):
         raise Exception(f"invalid vr index in 'cvrooc' instruction, line {line_num}")
-    current_vr = str(vrs[vr_idx])
-    if not current_vr == target_vr:
+    if not vr_view.vr_matches_target(vr_idx, target_vr):
         raise Exception(f"'cvrooc' instruction failed; expected vr mismatches actual vr, line {line_num}")
     
     # change the predicate in the target relationship
-    imanno[vr_idx]['object']['category'] = new_obj_idx
+    vr_view.set_object_class(vr_idx, new_obj_idx)
     
-    return imanno
+    return vr_view.imanno
 
 
 #%%
 
 def change_vr_obb(imanno, vr_idx, target_vr, new_obj_bbox,
-                  vrd_objects, vrd_predicates, line_num):
+                  vrd_objects, vrd_predicates, line_num,
+                  vr_view=None):
     '''
     For a given image and a particular visual relationship, replace the
     current 'object' bounding box with a new one.
@@ -527,6 +684,9 @@ def change_vr_obb(imanno, vr_idx, target_vr, new_obj_bbox,
     Parameters:
         imanno : list of dictionaries (vr annotations for an image)
         vr_idx : integer  (index of visual relationship to be modified)
+        target_vr : string, or tuple of 3 integers (the target vr)
+        vr_view : ImageVRView (optional; a view of 'imanno' shared across
+                  the customisations of an image)
         new_prd_idx : integer (id of the new predicate)
     
     Returns
@@ -537,23 +697,24 @@ def change_vr_obb(imanno, vr_idx, target_vr, new_obj_bbox,
 
     # safety check; ensure the target vr we plan to change actually
     # matches the actual current vr indicated by vr_idx
-    vrs = vrdu.get_visual_relationships(imanno, vrd_objects, vrd_predicates)
-    if not vr_idx in range(0, len(vrs)):
+    if vr_view is None:
+        vr_view = ImageVRView(imanno, vrd_objects, vrd_predicates)
+    if not vr_view.is_valid_vr_idx(vr_idx):
         raise Exception(f"invalid vr index in 'cvrobb' instruction, line {line_num}")
-    current_vr = str(vrs[vr_idx])
-    if not current_vr == target_vr:
+    if not vr_view.vr_matches_target(vr_idx, target_vr):
         raise Exception(f"'cvrobb' instruction failed; expected vr mismatches actual vr, line {line_num}")
     
     # change the predicate in the target relationship
-    imanno[vr_idx]['object']['bbox'] = new_obj_bbox
+    vr_view.set_object_bbox(vr_idx, new_obj_bbox)
     
-    return imanno
+    return vr_view.imanno
 
 
 #%%
 
 def remove_vr(imanno, vr_idx, target_vr,
-              vrd_objects, vrd_predicates, line_num):
+              vrd_objects, vrd_predicates, line_num,
+              vr_view=None):
     '''
     For a given image and a particular visual relationship, remove the
     visual relationship from the annotations.
@@ -561,7 +722,9 @@ def remove_vr(imanno, vr_idx, target_vr,
     Parameters:
         imanno : list of dictionaries (vr annotations for an image)
         vr_idx : integer  (index of visual relationship to be modified)
-        target_vr : string 
+        target_vr : string, or tuple of 3 integers (the target vr)
+        vr_view : ImageVRView (optional; a view of 'imanno' shared across
+                  the customisations of an image)
     
     Returns
         imanno : list of dictionaries
@@ -571,16 +734,16 @@ def remove_vr(imanno, vr_idx, target_vr,
 
     # safety check; ensure the target vr we plan to change actually
     # matches the actual current vr indicated by vr_idx
-    vrs = vrdu.get_visual_relationships(imanno, vrd_objects, vrd_predicates)
-    if not vr_idx in range(0, len(vrs)):
+    if vr_view is None:
+        vr_view = ImageVRView(imanno, vrd_objects, vrd_predicates)
+    if not vr_view.is_valid_vr_idx(vr_idx):
         raise Exception(f"invalid vr index in 'rvrxxx' instruction, line {line_num}")
-    current_vr = str(vrs[vr_idx])
-    if not current_vr == target_vr:
+    if not vr_view.vr_matches_target(vr_idx, target_vr):
         raise Exception(f"'rvrxxx' instruction failed; expected vr mismatches actual vr, line {line_num}")
 
-    del imanno[vr_idx]
+    vr_view.remove_vr(vr_idx)
     
-    return imanno
+    return vr_view.imanno
 
 
 #%%
@@ -621,13 +784,23 @@ def remove_image(imname, vrd_anno):
 
 #%%
 
-def write_customised_annotations_to_file(vrd_anno, path):
+def write_customised_annotations_to_file(vrd_anno, path, vrd_objects=None,
+                                         vrd_predicates=None):
     '''
     Write visual relationship annotations dictionary to file in json format.
     
+    If the file name has the NeSy4VRD binary annotations file extension
+    (see module nesy4vrd_anno_binary), the annotations are written in 
+    binary format instead, with the object class names and predicate names
+    recorded in the file header.
+    
     Parameters:
         vrd_anno : dictionary (VRD annotations)
         path : string (path and filename to which to write)
+        vrd_objects : list of strings (object class names; used only for
+                      the binary format)
+        vrd_predicates : list of strings (predicate names; used only for
+                         the binary format)
     
     Returns:
         None
@@ -635,6 +808,16 @@ def write_customised_annotations_to_file(vrd_anno, path):
             calling this function; no return value required
     '''
 
+    if vrdab.is_binary_annotations_file(path):
+        vrdab.write_VRD_annotations_binary(vrd_anno, path, vrd_objects,
+                                           vrd_predicates)
+        return None
+
+    # a VRDAnnotationView is dictionary-like but is not a 'dict', so
+    # convert it to one that the json module can serialise
+    if not isinstance(vrd_anno, dict):
+        vrd_anno = dict(vrd_anno.items())
+
     with open(path, 'w') as fp:
         json.dump(vrd_anno, fp)
 
@@ -980,5 +1163,17 @@ def check_if_vrs_are_duplicates(vr1, vr2):
 
 #%%
 
+def find_duplicate_vr_groups(imanno):
+    
+    return vrdu.find_duplicate_vr_groups(imanno)
+
+#%%
+
+def get_duplicate_vr_groups(vrd_img_names, vrd_anno):
+    
+    return vrdu.get_duplicate_vr_groups(vrd_img_names, vrd_anno)
+
+#%%
+
 
 
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: David Herron
+"""
+
+'''
+This script is part of NeSy4VRD. It is sample code for demonstrating the
+augmentation of NeSy4VRD visual relationship (VR) annotations by
+partitioned materialisation of RDF knowledge graphs (KGs).
+
+It produces the same augmented VR annotations as script
+load_and_augment.py. But rather than loading the VRs of all images into
+one KG and materialising it with one call to OWLRL (whose cost grows
+super-linearly with the size of the KG, and which runs on one core), it
+exploits the fact that inferences about VRs never cross image boundaries:
+* the images are split into batches
+* for each batch, a worker process builds a small KG holding the
+  VRD-World OWL ontology plus the VR triples of the batch's images,
+  materialises it with OWLRL, extracts the VR-related triples of each
+  image, and converts them back into NeSy4VRD VR annotations
+* the augmented VR annotations of the batches are merged and saved to a
+  disk file in JSON format
+
+In incremental mode, only the images whose VR annotations have changed
+since the last run are augmented again, and their augmented VR annotations
+are spliced into those saved by the last run.
+
+The batches are processed in parallel, across all available cores, and
+peak memory use is bounded by the batch size, regardless of the size of
+the dataset.
+
+NOTE: This script is designed to be executed in an IDE, cell by cell. But
+it can be run in batch mode.
+
+DEPENDENCIES:
+This module has dependencies on Python packages:
+    RDFLib
+    OWLRL
+'''
+
+#%% imports
+
+import os
+import json
+
+import nesy4vrd_utils4 as vrdu4
+
+
+#%% get the NeSy4VRD visual relationship annotations data
+
+# set the path to the directory where the NeSy4VRD visual relationship
+# annotations files reside
+anno_dir = os.path.join('..', 'data', 'annotations')
+
+# get the master list of NeSy4VRD object class names
+vrd_objects_path = os.path.join(anno_dir, 'nesy4vrd_objects.json')
+vrd_objects = vrdu4.load_NeSy4VRD_object_class_names(vrd_objects_path)
+
+# get the master list of NeSy4VRD predicate names
+vrd_predicates_path = os.path.join(anno_dir, 'nesy4vrd_predicates.json')
+vrd_predicates = vrdu4.load_NeSy4VRD_predicate_names(vrd_predicates_path)
+
+# set the path to the desired set of NeSy4VRD visual relationship annotations
+vrd_annotations_path = os.path.join(anno_dir, 'nesy4vrd_annotations_train.json')
+
+# to process a subset of images only, specify their names here
+img_name_subset = None
+
+vrd_anno = vrdu4.load_NeSy4VRD_image_annotations(vrd_annotations_path,
+                                                 img_names=img_name_subset)
+
+vrd_img_names = list(vrd_anno.keys())
+
+print(f'We will be processing VRs for {len(vrd_img_names)} images')
+
+
+#%% convert NeSy4VRD object class and predicate names to VRD-World ontology names
+
+ontoClassNames = vrdu4.convert_NeSy4VRD_classNames_to_ontology_classNames(vrd_objects)
+
+ontoPropNames = vrdu4.convert_NeSy4VRD_predicateNames_to_ontology_propertyNames(vrd_predicates)
+
+
+#%% specify a VRD-World OWL ontology with which to work
+
+# set the name the VRD-World OWL ontology file to work with
+target_ontology = 'vrd_world_v1.owl'
+
+ontology_dir = os.path.join('..', 'ontology')
+ontology_path = os.path.join(ontology_dir, target_ontology)
+
+
+#%% set the path of the augmented VR annotations file
+
+filename = 'nesy4vrd_augmented_annotations.json'
+anno_augmented_dir = os.path.join('..', 'data', 'annotations')
+path = os.path.join(anno_augmented_dir, filename)
+
+
+#%% augment the VR annotations by partitioned materialisation
+
+# the number of images whose VRs are loaded into each (small) KG
+batch_size = 100
+
+# the number of worker processes; None means use all available CPUs
+n_workers = None
+
+# In incremental mode, only the images whose VR annotations have changed
+# since the augmented VR annotations file was last saved (by a run in
+# incremental mode) are augmented again; the augmented VRs of the others
+# are taken from that file. A manifest of per-image content hashes is
+# saved alongside the augmented VR annotations file for this purpose.
+incremental = True
+
+if incremental:
+    results = vrdu4.augment_VR_annotations_incremental(vrd_anno,
+                                                       vrd_img_names,
+                                                       ontology_path,
+                                                       ontoClassNames,
+                                                       ontoPropNames,
+                                                       path,
+                                                       batch_size=batch_size,
+                                                       n_workers=n_workers)
+    vrd_anno_augmented, changed_img_names = results
+    print(f'Number of images augmented again: {len(changed_img_names)}')
+else:
+    vrd_anno_augmented = vrdu4.augment_VR_annotations_partitioned(vrd_anno,
+                                                                  vrd_img_names,
+                                                                  ontology_path,
+                                                                  ontoClassNames,
+                                                                  ontoPropNames,
+                                                                  batch_size,
+                                                                  n_workers)
+
+n_vrs = sum(len(vrd_anno[imname]) for imname in vrd_img_names)
+n_vrs_augmented = sum(len(imanno) for imanno in vrd_anno_augmented.values())
+
+print(f'Number of original VRs: {n_vrs}')
+print(f'Number of augmented VRs: {n_vrs_augmented}')
+
+
+#%% save augmented set of VR annotations to file on disk
+
+# (in incremental mode, the augmented VR annotations file and its manifest
+# have already been saved)
+if not incremental:
+    with open(path, 'w') as fp:
+        json.dump(vrd_anno_augmented, fp)
+
+print()
+print(f'Augmented VR annotations saved to file: {path}')
+print()
+print('Processing completed successfully!')
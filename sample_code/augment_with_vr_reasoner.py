@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: David Herron
+"""
+
+'''
+This script is part of NeSy4VRD. It is sample code for demonstrating the
+augmentation of NeSy4VRD visual relationship (VR) annotations with the VRs
+entailed by the object property axioms of the NeSy4VRD OWL ontology,
+VRD-World, using the native Python VR reasoner of module
+nesy4vrd_vr_reasoner.
+
+It produces the same augmented VR annotations as script
+load_and_augment.py, but without building an RDF knowledge graph (KG) or
+materialising it with OWLRL. Instead, it:
+* compiles the object property axioms of the ontology (subproperties,
+  equivalent, inverse, symmetric and transitive properties, and property
+  chains) into integer rule tables
+* applies the rule tables directly to the VR annotations of each image,
+  by forward chaining
+* saves the augmented NeSy4VRD visual relationship annotations to a disk
+  file in JSON format
+
+NOTE: This script is designed to be executed in an IDE, cell by cell. But
+it can be run in batch mode.
+
+DEPENDENCIES:
+This module has dependencies on Python packages:
+    NumPy
+    RDFLib
+'''
+
+#%% imports
+
+import os
+import json
+
+import nesy4vrd_utils4 as vrdu4
+import nesy4vrd_vr_reasoner as vrdr
+
+
+#%% get the NeSy4VRD visual relationship annotations data
+
+# set the path to the directory where the NeSy4VRD visual relationship
+# annotations files reside
+anno_dir = os.path.join('..', 'data', 'annotations')
+
+# get the master list of NeSy4VRD object class names
+vrd_objects_path = os.path.join(anno_dir, 'nesy4vrd_objects.json')
+vrd_objects = vrdu4.load_NeSy4VRD_object_class_names(vrd_objects_path)
+
+# get the master list of NeSy4VRD predicate names
+vrd_predicates_path = os.path.join(anno_dir, 'nesy4vrd_predicates.json')
+vrd_predicates = vrdu4.load_NeSy4VRD_predicate_names(vrd_predicates_path)
+
+# set the path to the desired set of NeSy4VRD visual relationship annotations
+vrd_annotations_path = os.path.join(anno_dir, 'nesy4vrd_annotations_train.json')
+
+# to process a subset of images only, specify their names here
+img_name_subset = None
+
+vrd_anno = vrdu4.load_NeSy4VRD_image_annotations(vrd_annotations_path,
+                                                 img_names=img_name_subset)
+
+vrd_img_names = list(vrd_anno.keys())
+
+print(f'We will be processing VRs for {len(vrd_img_names)} images')
+
+
+#%% convert NeSy4VRD predicate names to VRD-World ontology property names
+
+ontoPropNames = vrdu4.convert_NeSy4VRD_predicateNames_to_ontology_propertyNames(vrd_predicates)
+
+
+#%% compile the object property axioms of the VRD-World OWL ontology
+
+# set the name the VRD-World OWL ontology file to work with
+target_ontology = 'vrd_world_v1_2.owl'
+
+ontology_dir = os.path.join('..', 'ontology')
+ontology_path = os.path.join(ontology_dir, target_ontology)
+
+rule_tables = vrdr.compile_VR_rule_tables(ontology_path, ontoPropNames,
+                                          vrdu4.url_base)
+
+print(f"Ontology '{target_ontology}' compiled into rule tables")
+print(f'Number of object properties: {len(rule_tables.prop_names)}')
+print(f'Number of transitive properties: {len(rule_tables.trans_ids)}')
+print(f'Number of symmetric properties: {len(rule_tables.sym_ids)}')
+print(f'Number of property chains: {len(rule_tables.chains)}')
+
+
+#%% augment the VR annotations of each image
+
+vrd_anno_augmented = vrdr.augment_VR_annotations(vrd_anno, rule_tables,
+                                                 vrd_img_names)
+
+n_vrs = sum(len(vrd_anno[imname]) for imname in vrd_img_names)
+n_vrs_augmented = sum(len(imanno) for imanno in vrd_anno_augmented.values())
+
+print(f'Number of original VRs: {n_vrs}')
+print(f'Number of augmented VRs: {n_vrs_augmented}')
+
+
+#%% save augmented set of VR annotations to file on disk
+
+filename = 'nesy4vrd_augmented_annotations.json'
+anno_augmented_dir = os.path.join('..', 'data', 'annotations')
+path = os.path.join(anno_augmented_dir, filename)
+
+with open(path, 'w') as fp:
+    json.dump(vrd_anno_augmented, fp)
+
+print()
+print(f'Augmented VR annotations saved to file: {path}')
+print()
+print('Processing completed successfully!')
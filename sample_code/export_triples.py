@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: David Herron
+"""
+
+'''
+This script is part of NeSy4VRD. It is sample code for demonstrating the
+export of NeSy4VRD visual relationship (VR) annotations as RDF triples,
+in N-Triples or Turtle format, for bulk loading into an RDF triplestore
+(such as GraphDB).
+
+It produces the same triples that script load_and_augment.py loads into
+an RDFLib knowledge graph (KG), but it streams them to a file (or pipe)
+a chunk of images at a time, so the triples for the full set of VR
+annotations are never held in memory together.
+
+NOTE: This script is designed to be executed in an IDE, cell by cell. But
+it can be run in batch mode.
+
+DEPENDENCIES:
+This module has dependencies on Python packages:
+    RDFLib
+'''
+
+#%% imports
+
+import os
+
+import nesy4vrd_utils4 as vrdu4
+
+
+#%% get the NeSy4VRD visual relationship annotations data
+
+# set the path to the directory where the NeSy4VRD visual relationship
+# annotations files reside
+anno_dir = os.path.join('..', 'data', 'annotations')
+
+# get the master list of NeSy4VRD object class names
+vrd_objects_path = os.path.join(anno_dir, 'nesy4vrd_objects.json')
+vrd_objects = vrdu4.load_NeSy4VRD_object_class_names(vrd_objects_path)
+
+# get the master list of NeSy4VRD predicate names
+vrd_predicates_path = os.path.join(anno_dir, 'nesy4vrd_predicates.json')
+vrd_predicates = vrdu4.load_NeSy4VRD_predicate_names(vrd_predicates_path)
+
+# set the path to the desired set of NeSy4VRD visual relationship annotations
+vrd_annotations_path = os.path.join(anno_dir, 'nesy4vrd_annotations_train.json')
+
+# to process a subset of images only, specify their names here
+img_name_subset = None
+
+vrd_anno = vrdu4.load_NeSy4VRD_image_annotations(vrd_annotations_path,
+                                                 img_names=img_name_subset)
+
+vrd_img_names = list(vrd_anno.keys())
+
+print(f'We will be exporting VRs for {len(vrd_img_names)} images')
+
+
+#%% convert NeSy4VRD object class and predicate names to VRD-World ontology names
+
+ontoClassNames = vrdu4.convert_NeSy4VRD_classNames_to_ontology_classNames(vrd_objects)
+
+ontoPropNames = vrdu4.convert_NeSy4VRD_predicateNames_to_ontology_propertyNames(vrd_predicates)
+
+
+#%% establish the allocator of ids for individuals
+
+# use mode='deterministic' for ids that are stable across exports (and so
+# can be reloaded into a triplestore without creating duplicate individuals)
+id_allocator = vrdu4.IdAllocator(len(vrd_objects), mode='sequential')
+
+
+#%% export the VR annotations as RDF triples
+
+# set the RDF format: 'nt' (N-Triples) or 'ttl' (Turtle)
+rdf_format = 'nt'
+
+filename = 'nesy4vrd_annotations_triples.' + rdf_format
+triples_dir = os.path.join('..', 'data', 'annotations')
+path = os.path.join(triples_dir, filename)
+
+results = vrdu4.write_VR_annotations_as_triples(path, vrd_img_names, vrd_anno,
+                                                ontoClassNames, ontoPropNames,
+                                                rdf_format=rdf_format,
+                                                chunk_size=1000,
+                                                id_allocator=id_allocator)
+
+kg_vrd_img_ids, objects_per_image, vrd_img_vr_cnts, image_triple_cnts = results
+
+print(f'Number of VRs exported: {sum(vrd_img_vr_cnts)}')
+print(f'Number of triples exported: {sum(image_triple_cnts)}')
+print()
+print(f'RDF triples saved to file: {path}')
+print()
+print('Processing completed successfully!')
@@ -11,7 +11,8 @@ might be used in conjunction with the NeSy4VRD OWL ontology, VRD-World, an
 RDF knowledge graph and OWL reasoning.
 
 This script does the following:
-* instantiates an empty RDFLib knowledge graph (KG)
+* instantiates an empty RDFLib knowledge graph (KG) (or connects to a
+  remote triplestore, via a graph store backend)
 * loads the NeSy4VRD VRD-World OWL ontology into the KG
 * converts NeSy4VRD visual relationship annotations into RDF triples 
   and loads them into the KG
@@ -37,14 +38,11 @@ This module has dependencies on Python packages:
 
 #%% imports
 
-from rdflib import Graph
-
-from owlrl import DeductiveClosure, OWLRL_Semantics
-
 import os
 import json
 
 import nesy4vrd_utils4 as vrdu4
+import nesy4vrd_graph_store as vrdgs
 
 
 #%% get the NeSy4VRD visual relationship annotations data
@@ -61,12 +59,8 @@ vrd_objects = vrdu4.load_NeSy4VRD_object_class_names(vrd_objects_path)
 vrd_predicates_path = os.path.join(anno_dir, 'nesy4vrd_predicates.json')
 vrd_predicates = vrdu4.load_NeSy4VRD_predicate_names(vrd_predicates_path)
 
-# get the desired set of NeSy4VRD visual relationship annotations
+# set the path to the desired set of NeSy4VRD visual relationship annotations
 vrd_annotations_path = os.path.join(anno_dir, 'nesy4vrd_annotations_train.json')
-vrd_anno = vrdu4.load_NeSy4VRD_image_annotations(vrd_annotations_path)
-
-# get a list of the VRD image names from the NeSy4VRD annotations dictionary
-vrd_img_names = list(vrd_anno.keys())
 
 
 #%% convert NeSy4VRD object class and predicate names to VRD-World ontology names
@@ -76,16 +70,39 @@ ontoClassNames = vrdu4.convert_NeSy4VRD_classNames_to_ontology_classNames(vrd_ob
 ontoPropNames = vrdu4.convert_NeSy4VRD_predicateNames_to_ontology_propertyNames(vrd_predicates)
 
 
-#%% initialise sequence numbers for individual objects to be loaded into KG
+#%% establish the allocator of ids for individuals to be loaded into KG
+
+# Individual images, objects and bboxes are named with sequence numbers,
+# starting from 10001. To extend a KG loaded in an earlier run without id
+# collisions, restore the allocator state saved by that run instead
+# (see the optional cell below), e.g.
+#   id_allocator = vrdu4.load_id_allocator('kg_id_allocator_state.json')
+# For ids that are stable across runs (derived from the image name and
+# bbox), use mode='deterministic'.
 
 number_of_vrd_object_classes = len(vrd_objects)
-vrdu4.initialise_object_sequence_numbers(number_of_vrd_object_classes)
+id_allocator = vrdu4.IdAllocator(number_of_vrd_object_classes)
 
 
 #%% instantiate a new KG
 
-kg = Graph()
-print(f'Newly instantiated KG has {len(kg)} triples')
+# The KG is accessed through a graph store backend. By default, it is an
+# in-process RDFLib KG, materialised with OWLRL. To work with a remote
+# triplestore instead (such as GraphDB or Apache Jena Fuseki), via its
+# SPARQL 1.1 endpoints, use, e.g.
+#   graph_store = vrdgs.get_graph_store('sparql',
+#                     query_url='http://localhost:3030/vrd/query',
+#                     update_url='http://localhost:3030/vrd/update')
+# (the remote store is not materialised by this script; a store configured
+#  with an OWL 2 RL ruleset materialises the triples as they are loaded)
+
+# For the RDFLib KG, set the method for extracting the VR-related triples
+# of each image from the KG: 'triples' walks the KG's triple indexes
+# directly; 'sparql' executes a single prepared (parsed once) SPARQL query,
+# binding the image for each execution; both yield the same rows
+
+graph_store = vrdgs.get_graph_store('rdflib', extraction_method='triples')
+print(f'Newly instantiated KG has {len(graph_store)} triples')
 
 
 #%% specify a VRD-World OWL ontology with which to work
@@ -101,9 +118,12 @@ print(f"Ontology '{target_ontology}' is to be loaded into the KG")
 
 #%% load the target VRD-World OWL ontology into the KG
 
-kg.parse(ontology_path, format='ttl')
+# the ontology is loaded in its parsed and pre-materialised form, from a
+# cache file saved alongside the ontology file (which is created, or
+# refreshed, whenever the ontology file has changed)
+graph_store.add_TBox(ontology_path)
 print(f"Ontology '{target_ontology}' loaded into KG")
-print(f'The KG now has {len(kg)} triples')
+print(f'The KG now has {len(graph_store)} triples')
 
 
 #%% (optionally) prepare subsets of images for testing purposes
@@ -117,8 +137,10 @@ print(f'The KG now has {len(kg)} triples')
 #
 #       The image names used here are all associated with the NeSy4VRD
 #       training set visual relationship annotations that live in file 
-#       'nesy4vrd_annotations_train.json'.  If you loaded a different
+#       'nesy4vrd_annotations_train.json'.  If you selected a different
 #       annotations file they likely won't be recognised.
+#
+#       To process the full annotations file, set img_name_subset = None.
 
 #img_name_subset = ['3493152457_8dde981cc9_b.jpg']
 #
@@ -135,11 +157,16 @@ img_name_subset = ['8054281885_ebbbfa2672_b.jpg',
                   '9862618725_b271b9973f_b.jpg',
                   '324950887_a2c8d26083_b.jpg']
 
-# override the original (full) list of image names with your small subset
-vrd_img_names = img_name_subset
 
+#%% get the NeSy4VRD visual relationship annotations to be processed
 
-#%%
+# if a subset of images has been specified, only the annotations for the 
+# images in the subset are read from the annotations file
+vrd_anno = vrdu4.load_NeSy4VRD_image_annotations(vrd_annotations_path,
+                                                 img_names=img_name_subset)
+
+# get a list of the VRD image names from the NeSy4VRD annotations dictionary
+vrd_img_names = list(vrd_anno.keys())
 
 print(f'We will be processing VRs for {len(vrd_img_names)} images')
 
@@ -158,148 +185,52 @@ print(f'verbose mode is: {verbose_mode}')
 
 #%% convert VR annotations into RDF triples and load into KG 
 
-image_cnt = 0
-total_object_cnt = 0
-total_triple_cnt = 0
-
-# maintain a list of the unique ids created to represent each VRD image
-# when it is loaded into the KG; there will be positional correspondence
-# between image_id entries in this list and image filename entries in
-# the list (variable) named 'vrd_img_names'
-kg_vrd_img_ids = []
-
-# maintain a list of the counts of the number of human-annotated VRs
-# per VRD dataset image; there will be positional correspondence
-# between vr count entries in this list and image filename entries in
-# the list (variable) named 'vrd_img_names'
-vrd_img_vr_cnts = []
-
-# maintain a list of dictionaries, one dictionary per image; the dictionary 
-# for a particular image contains one entry for each object annotated 
-# as appearing in the image; the 'key' for an entry is the object's bbox
-# (in the form of a tuple); the 'value' is a list of 3 elements:
-# [kg_object_id, kg_object_uriref, object_idx], where object_idx is the
-# VRD object class label (integer index) identifying the object class of the 
-# corresponding bbox
-objects_per_image = []
-
-
-# iterate over the images whose visual relationships we wish to process
-for imname in vrd_img_names:
-    
-    imanno = vrd_anno[imname]
-    image_objects = {}
-    image_cnt += 1
-    image_triple_cnt = 0
-    
-    if verbose_mode:
+# The VR annotations of the images are converted into RDF triples and
+# added to the KG in bulk, a chunk of images at a time.  For each image,
+# the triples describe the image itself, each distinct object (bbox)
+# annotated as appearing in the image (about 11 triples per object), and
+# each VR (1 triple per VR, linking the 'subject' object to the 'object'
+# object via the ontology object property that corresponds to the VRD
+# predicate of the VR).
+
+# The following lists all have positional correspondence with the image
+# filename entries in the list (variable) named 'vrd_img_names':
+# * kg_vrd_img_ids : the unique ids created to represent each VRD image
+#   when it is loaded into the KG
+# * objects_per_image : one dictionary per image; the dictionary for a
+#   particular image contains one entry for each object annotated as
+#   appearing in the image; the 'key' for an entry is the object's bbox
+#   (in the form of a tuple); the 'value' is a list of 3 elements:
+#   [kg_object_id, kg_object_uriref, object_idx], where object_idx is the
+#   VRD object class label (integer index) identifying the object class of
+#   the corresponding bbox
+# * vrd_img_vr_cnts : the number of human-annotated VRs per image (prior
+#   to KG materialisation)
+# * image_triple_cnts : the number of triples loaded to the KG per image
+
+# We keep the 'image_objects' dictionary for each image so we can reuse
+# this info later when we extract triples from the expanded (materialised)
+# KG for this image and convert them back into VR annotations; 
+# the reason we use this tactic is simply for processing efficiency;
+# the reasoning (materialisation) of the KG won't invent new objects
+# or affect the bounding boxes of existing objects in any way;
+# so it's more efficient to keep track the bounding boxes for each 
+# object in a given image externally from the KG, and then reuse them
+# as appropriate when reconstituting the augmented set of visual
+# relationship annotations for each image.
+
+results = graph_store.load_image_annotations(vrd_img_names, vrd_anno,
+                                             ontoClassNames, ontoPropNames,
+                                             id_allocator=id_allocator)
+kg_vrd_img_ids, objects_per_image, vrd_img_vr_cnts, image_triple_cnts = results
+
+if verbose_mode:
+    for imname, image_triple_cnt in zip(vrd_img_names, image_triple_cnts):
         print(f'\nprocessing image: {imname}')
-    
-    # create RDF triples describing the current VRD image object 
-    # and add these to the KG
-    results = vrdu4.build_triples_for_image(imname)
-    kg_image_id, kg_image_uriref, triples = results
-    kg_vrd_img_ids.append(kg_image_id)
-    image_triple_cnt += len(triples)  
-    for triple in triples:
-        kg.add(triple)
-
-    #
-    # iterate over the VR annotations for the current image; convert
-    # them into RDF triples and add them to the KG
-    #
-
-    vr_cnt = 0 
-
-    for vr in imanno:
-        
-        vr_cnt += 1
-        vr_triple_cnt = 0
-        
-        # get the elements of the current annotated VR 
-        sub_idx = vr['subject']['category']
-        sub_bbox = tuple(vr['subject']['bbox'])
-        prd_idx = vr['predicate']
-        obj_idx = vr['object']['category']
-        obj_bbox = tuple(vr['object']['bbox'])
-        
-        # process the 'subject' object of the VR
-        if sub_bbox in image_objects:
-            # the triples defining this object have already been added to
-            # the KG; just retrieve its URI for reuse below
-            _, kg_subject_uriref, _ = image_objects[sub_bbox]
-            triple_cnt = 0
-        else:
-            # this is the first time we've encountered this particular object,
-            # so build triples for defining it and add them to the KG
-            results = vrdu4.build_triples_for_object(sub_idx, sub_bbox,
-                                                     ontoClassNames,
-                                                     kg_image_uriref)
-            kg_subject_id, kg_subject_uriref, triples = results
-            triple_cnt = len(triples)
-            image_objects[sub_bbox] = [kg_subject_id, kg_subject_uriref, sub_idx]
-            for triple in triples:
-                kg.add(triple)
-        
-        vr_triple_cnt += triple_cnt
-        
-        # process the 'object' object of the VR
-        if obj_bbox in image_objects:
-            # the triples defining this object have already been added to
-            # the KG; just retrieve its URI for reuse below
-            _, kg_object_uriref, _ = image_objects[obj_bbox]
-            triple_cnt = 0
-        else:
-            # this is the first time we've encountered this particular object,
-            # so build triples for defining it and add them to the KG            
-            results = vrdu4.build_triples_for_object(obj_idx, obj_bbox,
-                                                     ontoClassNames,
-                                                     kg_image_uriref)
-            kg_object_id, kg_object_uriref, triples = results
-            triple_cnt = len(triples)
-            image_objects[obj_bbox] = [kg_object_id, kg_object_uriref, obj_idx]
-            for triple in triples:
-                kg.add(triple)
-        
-        vr_triple_cnt += triple_cnt
-        
-        # link the 'subject' object to the 'object' object of the VR;
-        # use the ontology object property that corresponds to the VRD
-        # predicate in the annotated VR; the resulting single triple is the 
-        # key triple that represents (expresses) the visual relationship 
-        # between the particular ordered pair of objects referenced in the
-        # current annotated VR
-        triples = vrdu4.build_triple_linking_subject_to_object(kg_subject_uriref,
-                                                               prd_idx,
-                                                               kg_object_uriref,
-                                                               ontoPropNames)
-        vr_triple_cnt += len(triples)
-        for triple in triples:
-            kg.add(triple)
-        
-        image_triple_cnt += vr_triple_cnt
-    
-     
-    # save the 'image_objects' dictionary for the current image; we'll reuse 
-    # this info later when we extract triples from the expanded (materialised)
-    # KG for this image and convert them back into VR annotations; 
-    # the reason we use this tactic is simply for processing efficiency;
-    # the reasoning (materialisation) of the KG won't invent new objects
-    # or affect the bounding boxes of existing objects in any way;
-    # so it's more efficient to keep track the bounding boxes for each 
-    # object in a given image externally from the KG, and then reuse them
-    # as appropriate when reconstituting the augmented set of visual
-    # relationship annotations for each image.
-    objects_per_image.append(image_objects)
-    
-    # save the number of VRs associated with the current image (prior to
-    # KG materialisation)
-    vrd_img_vr_cnts.append(vr_cnt)
-    
-    if verbose_mode:    
         print(f'triples loaded to KG for image: {image_triple_cnt}')
-    
-    total_triple_cnt += image_triple_cnt
+
+image_cnt = len(vrd_img_names)
+total_triple_cnt = sum(image_triple_cnts)
 
 
 print(f'\nNumber of images processed: {image_cnt}')
@@ -308,32 +239,39 @@ print(f'\nTotal VR-related triples loaded to KG: {total_triple_cnt}')
 
 #%%
 
-print(f'After loading the VR triples, the KG has {len(kg)} triples')
+print(f'After loading the VR triples, the KG has {len(graph_store)} triples')
 
 
-#%% expand (materialise) the KG
+#%% optionally, save the state of the id allocator
+
+#filename = 'kg_id_allocator_state.json'
+
+#id_allocator.save(filename)
+
+#print(f"The id allocator state was saved to file '{filename}'")
 
-# configure the form of expansion (materialisation) we wish to perform
-dc = DeductiveClosure(OWLRL_Semantics,
-                      rdfs_closure = False,
-                      axiomatic_triples = False,
-                      datatype_axioms = False)
+
+#%% expand (materialise) the KG
 
 # perform the expansion (materialisation)
 # (IE invoke OWL reasoning to infer all triples entailed by the current 
 #  contents of the KG, given the inference semantics of the VRD-World
 #  OWL ontology governing the KG and that data triples that have been
 #  loaded into it.)
-dc.expand(kg)
-
-print(f'The expanded (materialised) KG has {len(kg)} triples')
+# (For the RDFLib KG, OWLRL is used, configured to perform OWL RL
+#  reasoning without RDFS closure, axiomatic triples or datatype axioms.)
+if graph_store.materialise():
+    print(f'The expanded (materialised) KG has {len(graph_store)} triples')
+else:
+    print('Materialisation of the KG skipped (left to the graph store)')
 
 
 #%% optionally, save the expanded KG
 
 #filename = 'vrd_world_v1_loaded_and_materialised.ttl'
 
-#kg.serialize(destination=filename, format='ttl')
+# (for the RDFLib KG only)
+#graph_store.kg.serialize(destination=filename, format='ttl')
 
 #print(f"The expanded (materialised) KG was serialised to file '{filename}'")
 
@@ -344,38 +282,30 @@ print(f'The expanded (materialised) KG has {len(kg)} triples')
 # (VRs) for each image in the VRD dataset
 vrd_anno_augmented = {}
 
+vr_triples_per_image = graph_store.query_VR_triples(vrd_img_names,
+                                                    kg_vrd_img_ids)
 
 # iterate over the image names whose visual relationships we wish to process
-for idx, imname in enumerate(vrd_img_names): 
+for idx, (imname, qres) in enumerate(vr_triples_per_image): 
     
     # get the original VRs for the current image
     imanno = vrd_anno[imname]     
 
-    # get the unique id used in the KG to represent the current VRD image
-    kg_image_id = kg_vrd_img_ids[idx]
- 
-    # build a SPARQL query designed to retrieve the triples in the KG 
-    # associated with the visual relationships for the current image
-    query = vrdu4.assemble_SPARQL_query(imname, kg_image_id)
-
     if verbose_mode:    
         print(f"\nextracting triples from KG for image '{imname}'")
     else:
         if idx % 100 == 0:
             print(f"extracting VRs from KG for image idx {idx}")
-    
-    # execute the SPARQL query
-    qres = kg.query(query)
 
-    # The query result set is a set of (subObj, property, objObj) triples.
+    # The extracted rows are a set of (subObj, property, objObj) triples.
     # Each triple is an abstract representation of a unique visual relationship
     # associated with the current image. Some triples will be representations
     # of the original VRs; others will be representations of new VRs
     # inferred by the KG materialisation process.
     
     # NOTE: if you are processing the visual relationships for just a small 
-    #       number of images, you may be interested to see the result set
-    #       of the SPARQL query; if so, uncomment
+    #       number of images, you may be interested to see the extracted
+    #       rows; if so, uncomment
     #
     #print(f"displaying extracted triples:")
     #for row in qres:
@@ -392,10 +322,10 @@ for idx, imname in enumerate(vrd_img_names):
     # get the objects and their bboxes for current image that were saved earlier
     image_objects = objects_per_image[idx]
     
-    # create an inverted dictionary keyed by the kg_object_id value
-    # (nb: we can ignore the middle 'value' element, v[1],
-    #      so each entry will be: 'kg_object_id : [bbox, obj_idx]')
-    inverted_image_objects = { v[0]: [k, v[2]] for k, v in image_objects.items() }
+    # create an inverted dictionary keyed by the kg_object_uriref value
+    # (nb: we can ignore the first 'value' element, v[0],
+    #      so each entry will be: 'kg_object_uriref : [bbox, obj_idx]')
+    inverted_image_objects = { v[1]: [k, v[2]] for k, v in image_objects.items() }
 
     # establish a list to hold the soon-to-be reconstructed set of VRs 
     # for the current image
@@ -416,24 +346,21 @@ for idx, imname in enumerate(vrd_img_names):
         # convert the KG URI for the property linking the two objects to its 
         # corresponding VRD predicate integer index representation
         # - nb: since the ontoPropNames have positional correspondence
-        #   with the VRD predicate names, the index position of the 
-        #   ontoProperty within the ontoPropNames list will be the
-        #   correct VRD predicate integer label
-        # - nb: if an ontoProperty is not recognised as valid, an Exception
+        #   with the VRD predicate names, the id of the property's URI
+        #   (a dictionary lookup) will be the correct VRD predicate integer
+        #   label
+        # - nb: if a property URI is not recognised as valid, an Exception
         #   will automatically be thrown which stops processing
-        ontoProperty = row.property.split('#')[1]
-        prd_idx = ontoPropNames.index(ontoProperty)
+        prd_idx = ontoPropNames.get_id(row.property)
         
         # convert the KG URI for the 'subject' object to its corresponding
         # representation as a pair: bbox and class label index
-        kg_object_id = row.subObj.split('#')[1]
-        sub_bbox, sub_idx = inverted_image_objects[kg_object_id]
+        sub_bbox, sub_idx = inverted_image_objects[row.subObj]
         sub_bbox = list(sub_bbox)
 
         # convert the KG URI for the 'object' object to its corresponding
         # representation as a pair: bbox and class label index
-        kg_object_id = row.objObj.split('#')[1]
-        obj_bbox, obj_idx = inverted_image_objects[kg_object_id]
+        obj_bbox, obj_idx = inverted_image_objects[row.objObj]
         obj_bbox = list(obj_bbox)
 
         # assemble the elements into the dictionary format used for 
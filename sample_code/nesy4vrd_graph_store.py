@@ -0,0 +1,434 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: David Herron
+"""
+
+'''
+This module contains the graph store backends used for working with
+NeSy4VRD visual relationship (VR) annotations in an RDF knowledge graph
+(KG) governed by the NeSy4VRD OWL ontology, VRD-World.
+
+A graph store backend covers the three operations that scripts such as
+load_and_augment.py need, whatever kind of KG they work with:
+1) bulk loading: loading the ontology TBox and the RDF triples that
+   represent the VR annotations of a set of images,
+2) materialisation: expanding the KG with the triples entailed by the
+   ontology, or skipping that step where the store reasons for itself,
+   and
+3) batched query: extracting the VR-related triples of each of a set of
+   images, so they can be converted back into VR annotations.
+
+Two backends are provided:
+* RDFLibGraphStore - an in-process RDFLib KG, materialised with OWLRL
+* SPARQLEndpointGraphStore - a remote triplestore (such as GraphDB or
+  Apache Jena Fuseki) accessed over HTTP via the SPARQL 1.1 Protocol;
+  triples are loaded with batched INSERT DATA updates, and the query for
+  each image is executed concurrently, over a pool of persistent
+  (keep-alive) HTTP connections
+
+Both backends produce the same triples (see
+nesy4vrd_utils4.generate_triples_for_images()) and yield the same rows
+from their queries, so the VR annotations reconstituted from either are
+identical.
+
+DEPENDENCIES:
+This module has dependencies on Python packages:
+    RDFLib
+    OWLRL (for RDFLibGraphStore materialisation only)
+'''
+
+#%% imports
+
+import http.client
+import json
+import queue
+import threading
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+from rdflib.term import URIRef, Literal, BNode
+
+import nesy4vrd_utils4 as vrdu4
+
+
+#%% the graph store interface
+
+class GraphStore():
+    '''
+    The interface of a graph store backend.
+
+    Subclasses implement load_triples(), materialise(), query_VR_triples()
+    and __len__(); the loading of the ontology TBox and of VR annotations
+    is built on load_triples().
+    '''
+
+    def load_triples(self, triples):
+        '''
+        Load RDF triples, in the RDFLib format, into the store.
+
+        Parameters:
+            triples : iterable - of RDFLib (s, p, o) triples
+        '''
+        raise NotImplementedError
+
+    def materialise(self):
+        '''
+        Expand (materialise) the KG with the triples entailed by the
+        ontology, if the backend does so.
+
+        Returns:
+            materialised : boolean - False if the backend skipped the step
+        '''
+        raise NotImplementedError
+
+    def query_VR_triples(self, img_names, kg_img_ids):
+        '''
+        Extract the VR-related triples of a sequence of images, grouped by
+        image.
+
+        Parameters:
+            img_names : list - of VRD image filenames
+            kg_img_ids : list - the id of each image in the KG (with
+                         positional correspondence with 'img_names')
+
+        Returns:
+            a generator of (imname, rows) tuples, in the order of
+            'img_names', where 'rows' is a list of VRTripleRow
+        '''
+        raise NotImplementedError
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def add_TBox(self, ontology_path, ontology_format='ttl', cache_path=None):
+        '''
+        Load the triples of the materialised TBox of an ontology (see
+        nesy4vrd_utils4.load_TBox_triples()) into the store.
+        '''
+
+        triples = vrdu4.load_TBox_triples(ontology_path, ontology_format,
+                                          cache_path)
+        self.load_triples(triples)
+
+    def load_image_annotations(self, img_names, vrd_anno, ontoClassNames,
+                               ontoPropNames, chunk_size=1000,
+                               id_allocator=None):
+        '''
+        Convert the VR annotations of a sequence of VRD images into RDF
+        triples and load them into the store, a chunk of images at a time.
+
+        Returns:
+            kg_vrd_img_ids, objects_per_image, vrd_img_vr_cnts,
+            image_triple_cnts : as for
+            nesy4vrd_utils4.load_image_annotations_into_kg()
+        '''
+
+        kg_vrd_img_ids = []
+        objects_per_image = []
+        vrd_img_vr_cnts = []
+        image_triple_cnts = []
+
+        for start in range(0, len(img_names), chunk_size):
+            triples = vrdu4.generate_triples_for_images(img_names[start:start+chunk_size],
+                                                        vrd_anno, ontoClassNames,
+                                                        ontoPropNames,
+                                                        kg_vrd_img_ids,
+                                                        objects_per_image,
+                                                        vrd_img_vr_cnts,
+                                                        image_triple_cnts,
+                                                        id_allocator)
+            self.load_triples(triples)
+
+        return kg_vrd_img_ids, objects_per_image, vrd_img_vr_cnts, image_triple_cnts
+
+    def close(self):
+        pass
+
+
+#%% in-process RDFLib backend
+
+class RDFLibGraphStore(GraphStore):
+    '''
+    A graph store backed by an in-process RDFLib KG.
+
+    Attributes:
+        kg : rdflib.Graph - the KG
+        extraction_method : string - 'triples' or 'sparql' (see
+                            nesy4vrd_utils4.iter_VR_triples_for_images())
+    '''
+
+    def __init__(self, kg=None, extraction_method='triples'):
+        if kg is None:
+            from rdflib import Graph
+            kg = Graph()
+        self.kg = kg
+        self.extraction_method = extraction_method
+
+    def load_triples(self, triples):
+        kg = self.kg
+        kg.addN((s, p, o, kg) for s, p, o in triples)
+
+    def add_TBox(self, ontology_path, ontology_format='ttl', cache_path=None):
+        vrdu4.add_TBox_to_KG(self.kg, ontology_path, ontology_format,
+                             cache_path)
+
+    def materialise(self):
+        vrdu4.materialise_KG(self.kg)
+        return True
+
+    def query_VR_triples(self, img_names, kg_img_ids):
+        return vrdu4.iter_VR_triples_for_images(self.kg, img_names, kg_img_ids,
+                                                self.extraction_method)
+
+    def __len__(self):
+        return len(self.kg)
+
+
+#%% HTTP SPARQL 1.1 endpoint backend
+
+class HTTPConnectionPool():
+    '''
+    A thread-safe pool of persistent (keep-alive) HTTP connections to a
+    single host.
+
+    A connection is taken from the pool for each request, and returned to
+    it once the response has been read; if a pooled connection turns out
+    to have been closed by the server, the request is retried once on a
+    new connection.
+    '''
+
+    def __init__(self, url, maxsize=8, timeout=60):
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme == 'https':
+            self.connection_class = http.client.HTTPSConnection
+        elif parts.scheme == 'http':
+            self.connection_class = http.client.HTTPConnection
+        else:
+            raise ValueError(f'URL scheme not recognised: {url}')
+        self.host = parts.netloc
+        self.timeout = timeout
+        self.pool = queue.LifoQueue(maxsize)
+
+    def _get_connection(self):
+        try:
+            return self.pool.get_nowait()
+        except queue.Empty:
+            return self.connection_class(self.host, timeout=self.timeout)
+
+    def _put_connection(self, conn):
+        try:
+            self.pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def request(self, method, path, body=None, headers=None):
+        '''
+        Send an HTTP request and read its response.
+
+        Returns:
+            status : integer - the HTTP status code
+            data : bytes - the body of the response
+        '''
+
+        for attempt in range(2):
+            conn = self._get_connection()
+            try:
+                conn.request(method, path, body=body, headers=headers or {})
+                response = conn.getresponse()
+                data = response.read()
+            except (http.client.HTTPException, OSError):
+                conn.close()
+                if attempt == 1:
+                    raise
+                continue
+            if response.will_close:
+                conn.close()
+            else:
+                self._put_connection(conn)
+            return response.status, data
+
+    def close(self):
+        while True:
+            try:
+                self.pool.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+def convert_SPARQL_JSON_term(binding):
+    '''
+    Convert a term of a SPARQL 1.1 JSON query result into an RDFLib term.
+    '''
+
+    if binding['type'] == 'uri':
+        return URIRef(binding['value'])
+    if binding['type'] == 'bnode':
+        return BNode(binding['value'])
+    return Literal(binding['value'], lang=binding.get('xml:lang'),
+                   datatype=binding.get('datatype'))
+
+
+class SPARQLEndpointGraphStore(GraphStore):
+    '''
+    A graph store backed by a remote triplestore, accessed over HTTP via
+    the SPARQL 1.1 Protocol.
+
+    Triples are loaded with INSERT DATA updates of up to 'batch_size'
+    triples each, except that all the triples of a load_triples() call
+    that involve blank nodes are sent in one update of their own. The
+    query for each image is sent as a separate request, with up to
+    'n_workers' requests in flight at once, over a pool of persistent
+    HTTP connections.
+
+    The store is not materialised by this backend: a triplestore
+    configured with an OWL 2 RL ruleset (such as GraphDB) materialises the
+    triples as they are loaded; for other stores, materialise() is skipped.
+
+    Parameters:
+        query_url : string - the URL of the SPARQL query endpoint (e.g.
+                    'http://localhost:3030/vrd/query' for Fuseki, or
+                    'http://localhost:7200/repositories/vrd' for GraphDB)
+        update_url : string - the URL of the SPARQL update endpoint (e.g.
+                     'http://localhost:3030/vrd/update', or
+                     'http://localhost:7200/repositories/vrd/statements');
+                     by default, the same as 'query_url'
+        batch_size : integer - the maximum number of triples per update
+        n_workers : integer - the maximum number of concurrent queries
+        timeout : integer - the timeout of each HTTP request, in seconds
+        headers : dictionary - extra headers for every request (e.g. an
+                  'Authorization' header)
+    '''
+
+    def __init__(self, query_url, update_url=None, batch_size=10000,
+                 n_workers=8, timeout=60, headers=None):
+        if update_url is None:
+            update_url = query_url
+        self.query_url = query_url
+        self.update_url = update_url
+        self.batch_size = batch_size
+        self.n_workers = n_workers
+        self.headers = dict(headers or {})
+        self.query_pool = HTTPConnectionPool(query_url, n_workers, timeout)
+        if urllib.parse.urlsplit(update_url).netloc == urllib.parse.urlsplit(query_url).netloc:
+            self.update_pool = self.query_pool
+        else:
+            self.update_pool = HTTPConnectionPool(update_url, 1, timeout)
+        self.format_term = vrdu4.get_RDF_term_formatter('nt')
+        self.lock = threading.Lock()
+
+    def _post(self, pool, url, body, content_type, accept=None):
+        headers = dict(self.headers)
+        headers['Content-Type'] = content_type
+        if accept is not None:
+            headers['Accept'] = accept
+        parts = urllib.parse.urlsplit(url)
+        path = parts.path or '/'
+        if parts.query:
+            path = path + '?' + parts.query
+        status, data = pool.request('POST', path, body.encode('utf-8'),
+                                    headers)
+        if status >= 300:
+            message = data.decode('utf-8', errors='replace')[:500]
+            raise Exception(f'SPARQL endpoint {url} returned HTTP status {status}: {message}')
+        return data
+
+    def update(self, update):
+        '''
+        Execute a SPARQL 1.1 update.
+        '''
+        self._post(self.update_pool, self.update_url, update,
+                   'application/sparql-update')
+
+    def query(self, query):
+        '''
+        Execute a SPARQL 1.1 SELECT query.
+
+        Returns:
+            bindings : list - of dictionaries, one per result row, mapping
+                       each variable name to an RDFLib term
+        '''
+        data = self._post(self.query_pool, self.query_url,
+                          urllib.parse.urlencode({'query': query}),
+                          'application/x-www-form-urlencoded',
+                          accept='application/sparql-results+json')
+        results = json.loads(data)
+        return [{var: convert_SPARQL_JSON_term(term) for var, term in row.items()}
+                for row in results['results']['bindings']]
+
+    def _insert_data(self, lines):
+        self.update('INSERT DATA {\n' + ''.join(lines) + '}\n')
+
+    def load_triples(self, triples):
+        # a blank node label is scoped to the update request in which it
+        # appears, so the triples involving blank nodes (such as the OWL
+        # restrictions and lists of the TBox) are held back and sent
+        # together, in a single update, to keep each blank node whole
+        format_term = self.format_term
+        lines = []
+        bnode_lines = []
+        with self.lock:
+            for s, p, o in triples:
+                line = (format_term(s) + ' ' + format_term(p) + ' ' +
+                        format_term(o) + ' .\n')
+                if isinstance(s, BNode) or isinstance(o, BNode):
+                    bnode_lines.append(line)
+                    continue
+                lines.append(line)
+                if len(lines) == self.batch_size:
+                    self._insert_data(lines)
+                    lines = []
+                    format_term.clear()
+            if lines:
+                self._insert_data(lines)
+            if bnode_lines:
+                self._insert_data(bnode_lines)
+            format_term.clear()
+
+    def materialise(self):
+        return False
+
+    def _query_image(self, imname, image_id):
+        query = vrdu4.assemble_SPARQL_query(imname, image_id)
+        rows = [vrdu4.VRTripleRow(row['subObj'], row['property'], row['objObj'])
+                for row in self.query(query)]
+        return imname, rows
+
+    def query_VR_triples(self, img_names, kg_img_ids):
+        with ThreadPoolExecutor(max_workers=self.n_workers) as executor:
+            # Executor.map() submits every query up front, so submit them
+            # in chunks, to bound the results held in memory
+            chunk_size = self.n_workers * 64
+            for start in range(0, len(img_names), chunk_size):
+                yield from executor.map(self._query_image,
+                                        img_names[start:start+chunk_size],
+                                        kg_img_ids[start:start+chunk_size])
+
+    def __len__(self):
+        rows = self.query('SELECT (COUNT(*) AS ?n) WHERE { ?s ?p ?o }')
+        return int(rows[0]['n'])
+
+    def close(self):
+        self.query_pool.close()
+        self.update_pool.close()
+
+
+#%% backend selection
+
+graph_stores = {'rdflib': RDFLibGraphStore,
+                'sparql': SPARQLEndpointGraphStore}
+
+
+def get_graph_store(graphStore='rdflib', **kwargs):
+    '''
+    Instantiate a graph store backend.
+
+    Parameters:
+        graphStore : string - 'rdflib' or 'sparql'
+        kwargs : the keyword arguments of the backend's class
+    '''
+
+    if not graphStore in graph_stores:
+        raise ValueError('graphStore not recognised')
+
+    return graph_stores[graphStore](**kwargs)
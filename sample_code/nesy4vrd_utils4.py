@@ -8,10 +8,14 @@
 This module contains utility functions that support:
 1) the loading of NeSy4VRD visual relationship annotations into an 
    RDFLib knowledge graph governed by the NeSy4VRD OWL ontology VRD-world,
-   and
 2) the extraction from that knowledge graph (via a SPARQL query) of all
    triples associated with specified images (so that they those triples
-   can be converted back into NeSy4VRD visual relationship annotations).
+   can be converted back into NeSy4VRD visual relationship annotations),
+3) the export of the RDF triples for NeSy4VRD visual relationship
+   annotations to a file in N-Triples or Turtle format, for bulk loading
+   into an RDF triplestore, and
+4) the augmentation of visual relationship annotations by materialising
+   such knowledge graphs for independent batches of images, in parallel.
 
 A visual relationship annotation can be described informally as a 
 (subject, predicate, object) 3-tuple, where both the 'subject' and
@@ -38,17 +42,29 @@ category IDs of (0, 35, 43). This corresponds to (person, ride, horse).
 DEPENDENCIES:
 This module has dependencies on Python packages:
     RDFLib
+    OWLRL (for partitioned materialisation only)
 '''
 
 #%% imports
 
-from rdflib.term import URIRef, Literal
+import hashlib
+import json
+import multiprocessing
+import os
+import threading
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+from rdflib.term import URIRef, Literal, BNode
 from rdflib.namespace import RDF, RDFS, OWL, XSD
+from rdflib.plugins.sparql import prepareQuery
 
 import sys
 sys.path.insert(0, '../extensibility/analysis')
 
 import nesy4vrd_utils as vrdu
+import nesy4vrd_scene_graph as vrdsg
  
 
 #%% global variables
@@ -61,32 +77,195 @@ url_base = "http://www.semanticweb.org/nesy4vrd/ontologies/vrd_world#"
 # graph store with which we interact
 prefix = 'vrd:'
 
-# Sequence numbers are used to generate unique names for all 
-# individuals (owl:NamedIndividuals, such as images, objects and
-# bounding boxes) pertaining to VRD image visual relationship 
-# annotations that are loaded into the ABox of the KG 
+# Unique names are generated for all individuals (owl:NamedIndividuals,
+# such as images, objects and bounding boxes) pertaining to VRD image
+# visual relationship annotations that are loaded into the ABox of the KG.
+# The names are allocated by an IdAllocator (see below).
 
-image_seq_num_key = 'image_seq_num'
-object_seq_nums_key = 'object_seq_nums'
-bbox_seq_num_key = 'bbox_seq_num'
+# the id allocator used by the triple-building functions when none is
+# passed to them explicitly (see initialise_object_sequence_numbers())
+default_id_allocator = None
+
+
+#%%
+
+class IdAllocator():
+    '''
+    Allocates the unique ids used to name the individual images, objects
+    and bounding boxes loaded into a KG.
+
+    In 'sequential' mode (the default), an id is a class name followed by
+    a sequence number (e.g. 'Image10001', 'Person10005', 'Bbox10002'), as
+    in the original NeSy4VRD sample code. Objects have a separate sequence
+    for each object class. The allocator can be:
+    * sharded: the allocator for shard k of n allocates only the sequence
+      numbers congruent to k modulo n, so n allocators (e.g. one per
+      worker process) never allocate the same id
+    * persisted: its state can be saved to and restored from a .json file
+      (see get_state() and save()/load_id_allocator()), so that a KG can be
+      extended incrementally, in later runs, without id collisions; the
+      states of the shards of a run can be combined (see
+      combine_id_allocator_states()) to resume allocation after all of them
+
+    In 'deterministic' mode, an id is a class name followed by a hash of
+    the image name (and, for objects and bboxes, of the bbox), so the same
+    image or object always receives the same id, in any run, in any
+    process, in any order, and no state needs to be shared or persisted.
+
+    The allocator is thread-safe.
+    '''
+
+    def __init__(self, number_of_vrd_object_classes, mode='sequential',
+                 start_seq_num=10000, shard=0, n_shards=1):
+
+        if not mode in ['sequential', 'deterministic']:
+            raise ValueError(f'id allocator mode not recognised: {mode}')
+
+        if not shard in range(0, n_shards):
+            raise ValueError(f'invalid shard {shard} for {n_shards} shards')
+
+        self.mode = mode
+        self.shard = shard
+        self.n_shards = n_shards
+
+        # the last sequence number allocated; the first allocated by shard k
+        # is start_seq_num + 1 + k
+        last_seq_num = start_seq_num + 1 + shard - n_shards
+        self.image_seq_num = last_seq_num
+        self.object_seq_nums = [last_seq_num] * number_of_vrd_object_classes
+        self.bbox_seq_num = last_seq_num
+
+        self._lock = threading.Lock()
+
+    def _get_hash(self, imname, *parts):
+        # a deterministic id is derived from the image name, so it cannot
+        # be allocated without one
+        if imname is None:
+            raise ValueError('a deterministic id allocator requires the image name')
+        text = '|'.join(str(part) for part in (imname,) + parts)
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()[:16]
+
+    def get_image_id(self, imname):
+        '''
+        Allocate the id for an image.
+        '''
+        if self.mode == 'deterministic':
+            return 'Image' + self._get_hash(imname)
+        with self._lock:
+            self.image_seq_num += self.n_shards
+            return 'Image' + str(self.image_seq_num)
+
+    def get_object_id(self, cls_idx, class_name, imname, bbox):
+        '''
+        Allocate the id for an object (of class 'class_name', with class
+        index 'cls_idx', annotated by 'bbox' in image 'imname').
+        '''
+        if self.mode == 'deterministic':
+            return class_name + self._get_hash(imname, *bbox)
+        with self._lock:
+            self.object_seq_nums[cls_idx] += self.n_shards
+            return class_name + str(self.object_seq_nums[cls_idx])
+
+    def get_bbox_id(self, imname, bbox):
+        '''
+        Allocate the id for the bounding box 'bbox' of an object in image
+        'imname'.
+        '''
+        if self.mode == 'deterministic':
+            return 'Bbox' + self._get_hash(imname, *bbox)
+        with self._lock:
+            self.bbox_seq_num += self.n_shards
+            return 'Bbox' + str(self.bbox_seq_num)
+
+    def get_state(self):
+        '''
+        Return the state of the allocator, as a dictionary.
+        '''
+        with self._lock:
+            return {'mode': self.mode,
+                    'shard': self.shard,
+                    'n_shards': self.n_shards,
+                    'image_seq_num': self.image_seq_num,
+                    'object_seq_nums': list(self.object_seq_nums),
+                    'bbox_seq_num': self.bbox_seq_num}
+
+    def set_state(self, state):
+        '''
+        Restore the state of the allocator from a dictionary returned by
+        get_state().
+
+        The whole state is restored, so the mode and the shard settings of
+        the allocator ('mode', 'shard' and 'n_shards') are replaced by those
+        of the state, whatever the allocator was constructed with.
+        '''
+        if len(state['object_seq_nums']) != len(self.object_seq_nums):
+            raise ValueError('id allocator state has wrong number of object classes')
+        if not state['mode'] in ['sequential', 'deterministic']:
+            raise ValueError(f"id allocator mode not recognised: {state['mode']}")
+        if not state['shard'] in range(0, state['n_shards']):
+            raise ValueError(f"invalid shard {state['shard']} for {state['n_shards']} shards")
+        with self._lock:
+            self.mode = state['mode']
+            self.shard = state['shard']
+            self.n_shards = state['n_shards']
+            self.image_seq_num = state['image_seq_num']
+            self.object_seq_nums = list(state['object_seq_nums'])
+            self.bbox_seq_num = state['bbox_seq_num']
+
+    def save(self, path):
+        '''
+        Save the state of the allocator to a .json file (see
+        save_json_file()).
+        '''
+        save_json_file(self.get_state(), path)
+
+
+def load_id_allocator(path):
+    '''
+    Restore an IdAllocator from a state file saved by IdAllocator.save().
+    '''
+
+    with open(path, 'r') as fp:
+        state = json.load(fp)
+
+    id_allocator = IdAllocator(len(state['object_seq_nums']))
+    id_allocator.set_state(state)
+
+    return id_allocator
+
+
+def combine_id_allocator_states(states):
+    '''
+    Combine the states of the shards of a sharded IdAllocator into the
+    state of a single (unsharded) allocator that allocates only ids not
+    allocated by any of the shards.
+    '''
+
+    return {'mode': states[0]['mode'],
+            'shard': 0,
+            'n_shards': 1,
+            'image_seq_num': max(state['image_seq_num'] for state in states),
+            'object_seq_nums': [max(seq_nums) for seq_nums in
+                                zip(*[state['object_seq_nums'] for state in states])],
+            'bbox_seq_num': max(state['bbox_seq_num'] for state in states)}
 
-seq_nums = {}
-    
 
 #%% 
 
 def initialise_object_sequence_numbers(number_of_vrd_object_classes):
-    
-    start_seq_num = 10000
-    
-    seq_nums[image_seq_num_key] = start_seq_num
-    
-    object_seq_nums = [start_seq_num] * number_of_vrd_object_classes
-    seq_nums[object_seq_nums_key] = object_seq_nums
+    '''
+    Establish a new (sequential) default IdAllocator, used by the triple
+    building functions when no allocator is passed to them.
+
+    Returns:
+        id_allocator : IdAllocator
+    '''
+
+    global default_id_allocator
 
-    seq_nums[bbox_seq_num_key] = start_seq_num
+    default_id_allocator = IdAllocator(number_of_vrd_object_classes)
 
-    return
+    return default_id_allocator
 
 
 #%%
@@ -105,9 +284,72 @@ def load_NeSy4VRD_predicate_names(path):
     
 #%% 
 
-def load_NeSy4VRD_image_annotations(path):
+def load_NeSy4VRD_image_annotations(path, img_names=None):
 
-    return vrdu.load_VRD_image_annotations(path)
+    return vrdu.load_VRD_image_annotations(path, img_names)
+
+
+#%%
+
+class OntologyNames(list):
+    '''
+    An ordered list of ontology class names or object property names, with
+    positional correspondence with the NeSy4VRD object class names or
+    predicate names, that also provides O(1) lookups in both directions
+    between NeSy4VRD ids (list positions), ontology names, and the RDFLib
+    URIRefs of those names.
+
+    An OntologyNames is used exactly like a list of names (which it is);
+    its index() method is a dictionary lookup rather than a linear search.
+    It is built once and cannot be modified, since modifying it would leave
+    its lookups out of step with its names; its mutating list methods
+    raise TypeError.
+    '''
+
+    def __init__(self, names):
+        super().__init__(names)
+        self.name_to_id = {}
+        for idx, name in enumerate(names):
+            self.name_to_id.setdefault(name, idx)
+        self.urirefs = [URIRef(url_base + name) for name in names]
+        self.uriref_to_id = {}
+        for idx, uriref in enumerate(self.urirefs):
+            self.uriref_to_id.setdefault(uriref, idx)
+
+    def __reduce__(self):
+        return (OntologyNames, (list(self),))
+
+    def _immutable(self, *args, **kwargs):
+        raise TypeError('an OntologyNames cannot be modified')
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _immutable
+    append = extend = insert = remove = pop = clear = _immutable
+    sort = reverse = _immutable
+
+    def index(self, name, *args):
+        if args:
+            return super().index(name, *args)
+        try:
+            return self.name_to_id[name]
+        except KeyError:
+            raise ValueError(f"'{name}' is not in list") from None
+
+    def get_id(self, uriref):
+        '''
+        Return the NeSy4VRD id that corresponds to the URIRef of an ontology
+        class or object property.
+        '''
+        try:
+            return self.uriref_to_id[uriref]
+        except KeyError:
+            raise ValueError(f"'{uriref}' not recognised") from None
+
+    def get_uriref(self, idx):
+        '''
+        Return the URIRef of the ontology class or object property that
+        corresponds to a NeSy4VRD id.
+        '''
+        return self.urirefs[idx]
 
 
 #%%
@@ -119,6 +361,9 @@ def convert_NeSy4VRD_classNames_to_ontology_classNames(vrd_objects):
     
     The VRD-World class names are all camel case, with the
     first word capitalised as well, and no spaces between words.
+
+    Returns:
+        onto_class_names : OntologyNames
     '''
     
     onto_class_names = []
@@ -131,7 +376,7 @@ def convert_NeSy4VRD_classNames_to_ontology_classNames(vrd_objects):
             onto_class_name = onto_class_name + word.capitalize()
         onto_class_names.append(onto_class_name)
 
-    return onto_class_names
+    return OntologyNames(onto_class_names)
 
 
 #%%
@@ -143,6 +388,9 @@ def convert_NeSy4VRD_predicateNames_to_ontology_propertyNames(vrd_predicates):
     
     The VRD-World ontology object property names are all camel case, with
     the first word uncapitalised, and no spaces between words.
+
+    Returns:
+        onto_property_names : OntologyNames
     '''
     
     onto_property_names = []
@@ -158,18 +406,20 @@ def convert_NeSy4VRD_predicateNames_to_ontology_propertyNames(vrd_predicates):
                 onto_property_name = onto_property_name + word.capitalize()
         onto_property_names.append(onto_property_name)
 
-    return onto_property_names   
+    return OntologyNames(onto_property_names)
 
 
 #%%
 
-def build_triples_for_image(imname, graphStore='rdflib'):
+def build_triples_for_image(imname, id_allocator=None):
     '''
     Construct and return the triples that will represent an individual
     VRD image within a KG.
     
     Parameters:
         imname : string - the filename of a VRD image
+        id_allocator : IdAllocator - allocates the id of the image (if None,
+                       the default allocator is used)
     
     Returns:
         image_id : string - the id assigned to represent the image in the KG
@@ -177,13 +427,11 @@ def build_triples_for_image(imname, graphStore='rdflib'):
         triples : list - of RDF triples in the RDFLib format used for
                   representing triples to be 'added' to a KG
     
-    Note: the seq_numbers are updated here, 'in place'; that update  
-    represents an essential supplementary 'return value' to be aware of.
+    Note: the state of the id allocator is updated here, 'in place'; that
+    update represents an essential supplementary 'return value' to be
+    aware of.
     '''
     
-    if not graphStore in ['rdflib', 'graphdb']:
-        raise ValueError('graphStore not recognised')
-
     triples = []
  
     #
@@ -194,20 +442,16 @@ def build_triples_for_image(imname, graphStore='rdflib'):
     # class hierarchy of the VRD-World OWL ontology
     class_name = 'Image'
 
-    # get the sequence number that will uniquely identify the new
-    # individual VRD image within a KG
-    seq_num_key = image_seq_num_key
-    seq_nums[seq_num_key] += 1
-    seq_num = seq_nums[seq_num_key]   
+    if id_allocator is None:
+        id_allocator = default_id_allocator
+
+    # get the id that will uniquely identify the new individual VRD image
+    # within a KG
+    image_id = id_allocator.get_image_id(imname)
     
     # construct the triple
-    image_id = class_name + str(seq_num)
-    if graphStore == 'rdflib':
-        image_uriref = URIRef(url_base + image_id)
-        triple = (image_uriref, RDF.type, OWL.NamedIndividual)
-    else:
-        image_uriref = prefix + image_id
-        triple = image_uriref + ' rdf:type owl:NamedIndividual .'
+    image_uriref = URIRef(url_base + image_id)
+    triple = (image_uriref, RDF.type, OWL.NamedIndividual)
     triples.append(triple)
      
     #
@@ -215,12 +459,8 @@ def build_triples_for_image(imname, graphStore='rdflib'):
     #
 
     # construct the triple
-    if graphStore == 'rdflib':
-        class_uriref = URIRef(url_base + class_name)
-        triple = (image_uriref, RDF.type, class_uriref)
-    else:
-        class_uriref = prefix + class_name
-        triple = image_uriref + ' rdf:type ' + class_uriref + ' .'     
+    class_uriref = URIRef(url_base + class_name)
+    triple = (image_uriref, RDF.type, class_uriref)
     triples.append(triple)
 
     #
@@ -229,11 +469,8 @@ def build_triples_for_image(imname, graphStore='rdflib'):
     #
 
     # construct the triple
-    if graphStore == 'rdflib':
-        literal = Literal(imname, datatype=XSD.string)
-        triple = (image_uriref, RDFS.label, literal)
-    else:
-        triple = image_uriref + ' rdfs:label ' + '"' + imname + '"' + '^^xsd:string' + ' .'
+    literal = Literal(imname, datatype=XSD.string)
+    triple = (image_uriref, RDFS.label, literal)
     triples.append(triple)
     
     return image_id, image_uriref, triples
@@ -242,7 +479,8 @@ def build_triples_for_image(imname, graphStore='rdflib'):
 #%%
 
 def build_triples_for_object(cls_idx, bbox, ontoClassNames, 
-                             image_uriref, graphStore='rdflib'):
+                             image_uriref, id_allocator=None,
+                             imname=None):
     '''
     Construct and return the triples for representing a new, individual
     object of a VRD image within a KG.
@@ -256,6 +494,10 @@ def build_triples_for_object(cls_idx, bbox, ontoClassNames,
         image_uriref : string - the RDFLib URIREF for the particular VRD image
                        in which the object represented by arguments 'cls_idx'
                        and 'bbox' appears
+        id_allocator : IdAllocator - allocates the ids of the object and its
+                       bbox (if None, the default allocator is used)
+        imname : string - the filename of the VRD image (required only by
+                 a 'deterministic' id allocator)
     
     Returns:
         object_id : string - the id assigned to represent the object in the KG
@@ -269,9 +511,6 @@ def build_triples_for_object(cls_idx, bbox, ontoClassNames,
     just for the clarity that might come from specificity.
     '''
     
-    if not graphStore in ['rdflib', 'graphdb']:
-        raise ValueError('graphStore not recognised')
-    
     triples = []
     
     #
@@ -282,20 +521,16 @@ def build_triples_for_object(cls_idx, bbox, ontoClassNames,
     # category ID (NeSy4VRD object class index) for the current object   
     class_name = ontoClassNames[cls_idx]
     
-    # get the sequence number that will uniquely identify the new
-    # individual VRD image within a KG
-    seq_num_key = object_seq_nums_key
-    seq_nums[seq_num_key][cls_idx] += 1
-    seq_num = seq_nums[seq_num_key][cls_idx] 
+    if id_allocator is None:
+        id_allocator = default_id_allocator
+
+    # get the id that will uniquely identify the new individual object
+    # within a KG
+    object_id = id_allocator.get_object_id(cls_idx, class_name, imname, bbox)
 
     # construct the triple
-    object_id = class_name + str(seq_num)
-    if graphStore == 'rdflib':
-        object_uriref = URIRef(url_base + object_id)
-        triple = (object_uriref, RDF.type, OWL.NamedIndividual)
-    else:
-        object_uriref = prefix + object_id
-        triple = object_uriref + ' rdf:type owl:NamedIndividual .'
+    object_uriref = URIRef(url_base + object_id)
+    triple = (object_uriref, RDF.type, OWL.NamedIndividual)
     triples.append(triple)
 
     #
@@ -303,12 +538,8 @@ def build_triples_for_object(cls_idx, bbox, ontoClassNames,
     #
 
     # construct the triple
-    if graphStore == 'rdflib':
-        class_uri = URIRef(url_base + class_name)
-        triple = (object_uriref, RDF.type, class_uri)
-    else:
-        class_uri = prefix + class_name
-        triple = object_uriref + ' rdf:type ' + class_uri + ' .'
+    class_uri = URIRef(url_base + class_name)
+    triple = (object_uriref, RDF.type, class_uri)
     triples.append(triple)
 
 
@@ -318,12 +549,8 @@ def build_triples_for_object(cls_idx, bbox, ontoClassNames,
 
     # construct the triple
     property_name = 'hasObject'
-    if graphStore == 'rdflib':
-        property_uriref = URIRef(url_base + property_name)
-        triple = (image_uriref, property_uriref, object_uriref)
-    else:
-        property_uriref = prefix + property_name
-        triple = image_uriref + ' ' + property_uriref + ' ' + object_uriref + ' .'
+    property_uriref = URIRef(url_base + property_name)
+    triple = (image_uriref, property_uriref, object_uriref)
     triples.append(triple)
 
     #
@@ -332,12 +559,8 @@ def build_triples_for_object(cls_idx, bbox, ontoClassNames,
 
     # construct the triple
     property_name = 'sourceImage'
-    if graphStore == 'rdflib':
-        property_uriref = URIRef(url_base + property_name)
-        triple = (object_uriref, property_uriref, image_uriref)
-    else:
-        property_uriref = prefix + property_name
-        triple = object_uriref + ' ' + property_uriref + ' ' + image_uriref + ' .'       
+    property_uriref = URIRef(url_base + property_name)
+    triple = (object_uriref, property_uriref, image_uriref)
     triples.append(triple)
 
     #
@@ -347,20 +570,13 @@ def build_triples_for_object(cls_idx, bbox, ontoClassNames,
     # name of VRD-World class used for bounding boxes
     class_name = 'Bbox'
 
-    # get the sequence number that will uniquely identify the bounding
-    # box for the new, individual object
-    seq_num_key = bbox_seq_num_key
-    seq_nums[seq_num_key] += 1
-    seq_num = seq_nums[seq_num_key]
+    # get the id that will uniquely identify the bounding box for the new,
+    # individual object
+    object_bbox_id = id_allocator.get_bbox_id(imname, bbox)
 
     # construct the triple
-    object_bbox_id = class_name + str(seq_num)
-    if graphStore == 'rdflib':
-        object_bbox_uriref = URIRef(url_base + object_bbox_id)
-        triple = (object_bbox_uriref, RDF.type, OWL.NamedIndividual)
-    else:
-        object_bbox_uriref = prefix + object_bbox_id
-        triple = object_bbox_uriref + ' rdf:type owl:NamedIndividual .'
+    object_bbox_uriref = URIRef(url_base + object_bbox_id)
+    triple = (object_bbox_uriref, RDF.type, OWL.NamedIndividual)
     triples.append(triple)
 
     #
@@ -368,12 +584,8 @@ def build_triples_for_object(cls_idx, bbox, ontoClassNames,
     #
 
     # construct the triple
-    if graphStore == 'rdflib':
-        class_uri = URIRef(url_base + class_name)
-        triple = (object_bbox_uriref, RDF.type, class_uri)
-    else:
-        class_uri = prefix + class_name
-        triple = object_bbox_uriref + ' rdf:type ' + class_uri + ' .'
+    class_uri = URIRef(url_base + class_name)
+    triple = (object_bbox_uriref, RDF.type, class_uri)
     triples.append(triple)
 
     #
@@ -382,13 +594,9 @@ def build_triples_for_object(cls_idx, bbox, ontoClassNames,
 
     # construct the triple
     property_name = 'hasCoordinateYmin'
-    if graphStore == 'rdflib':
-        property_uri = URIRef(url_base + property_name)    
-        literal = Literal(bbox[0], datatype=XSD.integer)
-        triple = (object_bbox_uriref, property_uri, literal)
-    else:
-        property_uri = prefix + property_name
-        triple = object_bbox_uriref + ' ' + property_uri + ' ' + '"' + str(bbox[0]) + '"' + '^^xsd:integer' + ' .'
+    property_uri = URIRef(url_base + property_name)    
+    literal = Literal(bbox[0], datatype=XSD.integer)
+    triple = (object_bbox_uriref, property_uri, literal)
     triples.append(triple)
 
     #
@@ -397,13 +605,9 @@ def build_triples_for_object(cls_idx, bbox, ontoClassNames,
 
     # construct the triple
     property_name = 'hasCoordinateYmax'
-    if graphStore == 'rdflib':
-        property_uri = URIRef(url_base + property_name)    
-        literal = Literal(bbox[1], datatype=XSD.integer)
-        triple = (object_bbox_uriref, property_uri, literal)
-    else:
-        property_uri = prefix + property_name
-        triple = object_bbox_uriref + ' ' + property_uri + ' ' + '"' + str(bbox[1]) + '"' + '^^xsd:integer' + ' .'
+    property_uri = URIRef(url_base + property_name)    
+    literal = Literal(bbox[1], datatype=XSD.integer)
+    triple = (object_bbox_uriref, property_uri, literal)
     triples.append(triple)
 
     #
@@ -412,13 +616,9 @@ def build_triples_for_object(cls_idx, bbox, ontoClassNames,
 
     # construct the triple
     property_name = 'hasCoordinateXmin'
-    if graphStore == 'rdflib':
-        property_uri = URIRef(url_base + property_name)    
-        literal = Literal(bbox[2], datatype=XSD.integer)
-        triple = (object_bbox_uriref, property_uri, literal)
-    else:
-        property_uri = prefix + property_name
-        triple = object_bbox_uriref + ' ' + property_uri + ' ' + '"' + str(bbox[2]) + '"' + '^^xsd:integer' + ' .'        
+    property_uri = URIRef(url_base + property_name)    
+    literal = Literal(bbox[2], datatype=XSD.integer)
+    triple = (object_bbox_uriref, property_uri, literal)
     triples.append(triple)
 
     #
@@ -427,13 +627,9 @@ def build_triples_for_object(cls_idx, bbox, ontoClassNames,
 
     # construct the triple
     property_name = 'hasCoordinateXmax'
-    if graphStore == 'rdflib':
-        property_uri = URIRef(url_base + property_name)    
-        literal = Literal(bbox[3], datatype=XSD.integer)
-        triple = (object_bbox_uriref, property_uri, literal)
-    else:
-        property_uri = prefix + property_name
-        triple = object_bbox_uriref + ' ' + property_uri + ' ' + '"' + str(bbox[3]) + '"' + '^^xsd:integer' + ' .'                
+    property_uri = URIRef(url_base + property_name)    
+    literal = Literal(bbox[3], datatype=XSD.integer)
+    triple = (object_bbox_uriref, property_uri, literal)
     triples.append(triple)
 
     #
@@ -442,12 +638,8 @@ def build_triples_for_object(cls_idx, bbox, ontoClassNames,
 
     # construct the triple
     property_name = 'hasBbox'
-    if graphStore == 'rdflib':
-        property_uriref = URIRef(url_base + property_name)    
-        triple = (object_uriref, property_uriref, object_bbox_uriref)
-    else:
-        property_uriref = prefix + property_name
-        triple = object_uriref + ' ' + property_uriref + ' ' + object_bbox_uriref + ' .'
+    property_uriref = URIRef(url_base + property_name)    
+    triple = (object_uriref, property_uriref, object_bbox_uriref)
     triples.append(triple)
 
     return object_id, object_uriref, triples
@@ -458,8 +650,7 @@ def build_triples_for_object(cls_idx, bbox, ontoClassNames,
 def build_triple_linking_subject_to_object(subject_uriref,
                                            prop_idx,
                                            object_uriref,
-                                           ontoPropNames,
-                                           graphStore='rdflib'): 
+                                           ontoPropNames): 
     '''
     Construct and return the single triple that links a 'subject'
     individual object with an 'object' individual object.
@@ -484,9 +675,6 @@ def build_triple_linking_subject_to_object(subject_uriref,
                   to a KG
     '''
 
-    if not graphStore in ['rdflib', 'graphdb']:
-        raise ValueError('graphStore not recognised')
-    
     triples = []
     
     #
@@ -497,17 +685,199 @@ def build_triple_linking_subject_to_object(subject_uriref,
     property_name = ontoPropNames[prop_idx]
 
     # construct the triple
-    if graphStore == 'rdflib':
-        property_uriref = URIRef(url_base + property_name)
-        triple = (subject_uriref, property_uriref, object_uriref)
-    else:
-        property_uriref = prefix + property_name
-        triple = subject_uriref + ' ' + property_uriref + ' ' + object_uriref + ' .'
+    property_uriref = URIRef(url_base + property_name)
+    triple = (subject_uriref, property_uriref, object_uriref)
     triples.append(triple)
 
     return triples
 
 
+#%% batched KG ingest
+
+# The per-triple functions above build and return small lists of triples
+# that are then added to a KG one at a time. For loading the annotations
+# of many images into an RDFLib KG, the functions below instead generate
+# all of the triples for a chunk of images as one stream, reusing
+# (interning) the URIRefs of the VRD-World classes and properties and the
+# Literals for bbox coordinates, and add them to the KG in bulk, with
+# Graph.addN(). The individuals, their ids and the triples are identical
+# to those produced by the per-triple functions.
+
+@lru_cache(maxsize=None)
+def get_vrd_uriref(name):
+    '''
+    Return the (interned) RDFLib URIRef for a VRD-World class or property.
+    '''
+    return URIRef(url_base + name)
+
+
+@lru_cache(maxsize=None)
+def get_integer_literal(value):
+    '''
+    Return the (interned) RDFLib Literal for an xsd:integer value, such as
+    a bbox coordinate.
+    '''
+    return Literal(value, datatype=XSD.integer)
+
+
+def generate_triples_for_images(img_names, vrd_anno, ontoClassNames,
+                                ontoPropNames, kg_vrd_img_ids,
+                                objects_per_image, vrd_img_vr_cnts,
+                                image_triple_cnts, id_allocator=None):
+    '''
+    Generate the RDF triples (in RDFLib format) that represent the VR
+    annotations of a sequence of VRD images within a KG.
+
+    The triples generated for each image are the same, and appear in the
+    same order, as those built by build_triples_for_image(),
+    build_triples_for_object() and build_triple_linking_subject_to_object().
+    The ids are allocated by 'id_allocator' (if None, the default
+    allocator is used) in the same order as those functions allocate them.
+
+    The objects of each image (identified, as in the KG, by their bboxes)
+    are taken from a scene graph form of the annotations, in which each
+    distinct bbox of an image is already recorded just once.
+
+    Parameters:
+        img_names : list - of VRD image filenames
+        vrd_anno : dictionary - the NeSy4VRD VR annotations
+        ontoClassNames : list - ordered list of ontology class names
+        ontoPropNames : list - ordered list of ontology property names
+        kg_vrd_img_ids : list - to which the id of each image is appended
+        objects_per_image : list - to which the 'image_objects' dictionary
+                            of each image is appended (see
+                            load_and_augment.py)
+        vrd_img_vr_cnts : list - to which the number of VRs of each image
+                          is appended
+        image_triple_cnts : list - to which the number of triples of each
+                            image is appended
+
+    Returns:
+        a generator of RDF triples
+    '''
+
+    rdf_type = RDF.type
+    named_individual = OWL.NamedIndividual
+    image_class = get_vrd_uriref('Image')
+    bbox_class = get_vrd_uriref('Bbox')
+    has_object = get_vrd_uriref('hasObject')
+    source_image = get_vrd_uriref('sourceImage')
+    has_bbox = get_vrd_uriref('hasBbox')
+    coord_props = [get_vrd_uriref('hasCoordinateYmin'),
+                   get_vrd_uriref('hasCoordinateYmax'),
+                   get_vrd_uriref('hasCoordinateXmin'),
+                   get_vrd_uriref('hasCoordinateXmax')]
+    class_urirefs = [get_vrd_uriref(name) for name in ontoClassNames]
+    prop_urirefs = [get_vrd_uriref(name) for name in ontoPropNames]
+
+    if id_allocator is None:
+        id_allocator = default_id_allocator
+
+    scene_graph = vrdsg.get_scene_graph(img_names, vrd_anno)
+
+    for imname in img_names:
+
+        image_id = id_allocator.get_image_id(imname)
+        image_uriref = URIRef(url_base + image_id)
+        kg_vrd_img_ids.append(image_id)
+
+        yield (image_uriref, rdf_type, named_individual)
+        yield (image_uriref, rdf_type, image_class)
+        yield (image_uriref, RDFS.label, Literal(imname, datatype=XSD.string))
+        triple_cnt = 3
+
+        image_objects = {}
+        bboxes, classes, vr_nodes = scene_graph.get_image_nodes(imname)
+        node_urirefs = [None] * len(bboxes)
+
+        for sub_node, prd_idx, obj_node in vr_nodes.tolist():
+
+            uriref_pair = []
+
+            for node in (sub_node, obj_node):
+
+                if node_urirefs[node] is not None:
+                    uriref_pair.append(node_urirefs[node])
+                    continue
+
+                bbox = bboxes[node]
+                cls_idx = classes[node]
+                object_id = id_allocator.get_object_id(cls_idx,
+                                                       ontoClassNames[cls_idx],
+                                                       imname, bbox)
+                object_uriref = URIRef(url_base + object_id)
+                bbox_id = id_allocator.get_bbox_id(imname, bbox)
+                bbox_uriref = URIRef(url_base + bbox_id)
+
+                yield (object_uriref, rdf_type, named_individual)
+                yield (object_uriref, rdf_type, class_urirefs[cls_idx])
+                yield (image_uriref, has_object, object_uriref)
+                yield (object_uriref, source_image, image_uriref)
+                yield (bbox_uriref, rdf_type, named_individual)
+                yield (bbox_uriref, rdf_type, bbox_class)
+                for coord_prop, coord in zip(coord_props, bbox):
+                    yield (bbox_uriref, coord_prop, get_integer_literal(coord))
+                yield (object_uriref, has_bbox, bbox_uriref)
+                triple_cnt += 11
+
+                image_objects[bbox] = [object_id, object_uriref, cls_idx]
+                node_urirefs[node] = object_uriref
+                uriref_pair.append(object_uriref)
+
+            subject_uriref, object_uriref = uriref_pair
+            yield (subject_uriref, prop_urirefs[prd_idx], object_uriref)
+            triple_cnt += 1
+
+        objects_per_image.append(image_objects)
+        vrd_img_vr_cnts.append(len(vr_nodes))
+        image_triple_cnts.append(triple_cnt)
+
+
+def load_image_annotations_into_kg(kg, img_names, vrd_anno, ontoClassNames,
+                                   ontoPropNames, chunk_size=1000,
+                                   id_allocator=None):
+    '''
+    Convert the VR annotations of a sequence of VRD images into RDF triples
+    and add them to an RDFLib KG in bulk, a chunk of images at a time.
+
+    Parameters:
+        kg : rdflib.Graph - the KG
+        img_names : list - of VRD image filenames
+        vrd_anno : dictionary - the NeSy4VRD VR annotations
+        ontoClassNames : list - ordered list of ontology class names
+        ontoPropNames : list - ordered list of ontology property names
+        chunk_size : integer - the number of images per bulk addition
+        id_allocator : IdAllocator - allocates the ids of the individuals
+                       (if None, the default allocator is used)
+
+    Returns:
+        kg_vrd_img_ids : list - the id of each image in the KG
+        objects_per_image : list - the 'image_objects' dictionary of each
+                            image (see load_and_augment.py)
+        vrd_img_vr_cnts : list - the number of VRs of each image
+        image_triple_cnts : list - the number of triples loaded for each
+                            image
+
+    The lists have positional correspondence with 'img_names'.
+    '''
+
+    kg_vrd_img_ids = []
+    objects_per_image = []
+    vrd_img_vr_cnts = []
+    image_triple_cnts = []
+
+    for start in range(0, len(img_names), chunk_size):
+        triples = generate_triples_for_images(img_names[start:start+chunk_size],
+                                              vrd_anno, ontoClassNames,
+                                              ontoPropNames, kg_vrd_img_ids,
+                                              objects_per_image,
+                                              vrd_img_vr_cnts,
+                                              image_triple_cnts, id_allocator)
+        kg.addN((s, p, o, kg) for s, p, o in triples)
+
+    return kg_vrd_img_ids, objects_per_image, vrd_img_vr_cnts, image_triple_cnts
+
+
 #%% 
 
 def assemble_SPARQL_query_original(imname, image_id):
@@ -567,7 +937,7 @@ def assemble_SPARQL_query_original(imname, image_id):
 
 #%%
 
-def assemble_SPARQL_query(imname, image_id, graphStore='rdflib'):
+def assemble_SPARQL_query(imname, image_id):
     '''
     Construct a SPARQL query customised for the particular VRD image.
     
@@ -602,46 +972,706 @@ def assemble_SPARQL_query(imname, image_id, graphStore='rdflib'):
     }
     "
     '''
-    
-    if graphStore == 'rdflib':
-        
-        img_uri = "<" + url_base + image_id + "> "
-        hasobject_prop_uri = "<" + url_base + "hasObject> "
-        label_prop_uri = '<http://www.w3.org/2000/01/rdf-schema#label> '
-        img_label_uri = '"' + imname + '"' + \
-                        "^^<http://www.w3.org/2001/XMLSchema#string>"
-              
-        query = "PREFIX vrd: <" + url_base + "> " \
-              + "SELECT ?subObj ?property ?objObj " \
-              + "WHERE { " \
-              + "?subObj ?property ?objObj . " \
-              + img_uri + hasobject_prop_uri + "?subObj . " \
-              + img_uri + hasobject_prop_uri + "?objObj . " \
-              + img_uri + label_prop_uri + img_label_uri + " . " \
-              + "FILTER ( ?subObj != ?objObj ) " \
-              + " }"
-              
-    else:
-        
-        img_uri = prefix + image_id
-        hasobject_prop_uri = prefix + "hasObject"
-        label_prop_uri = '<http://www.w3.org/2000/01/rdf-schema#label> '
-        img_label_uri = '"' + imname + '"' + \
-                        "^^<http://www.w3.org/2001/XMLSchema#string>"
-        
-        query = "PREFIX vrd: <" + url_base + "> " \
-              + "SELECT ?subObj ?property ?objObj " \
-              + "WHERE { " \
-              + "?subObj ?property ?objObj . " \
-              + img_uri + ' ' + hasobject_prop_uri + ' ' + "?subObj . " \
-              + img_uri + ' ' + hasobject_prop_uri + ' ' + "?objObj . " \
-              + img_uri + ' ' + label_prop_uri + ' ' + img_label_uri + " . " \
-              + "FILTER ( ?subObj != ?objObj ) " \
-              + " }" 
-    
+
+    img_uri = "<" + url_base + image_id + "> "
+    hasobject_prop_uri = "<" + url_base + "hasObject> "
+    label_prop_uri = '<http://www.w3.org/2000/01/rdf-schema#label> '
+    # (the Literal's N3 form escapes any quotes in the image filename)
+    img_label_uri = Literal(imname, datatype=XSD.string).n3()
+
+    query = "PREFIX vrd: <" + url_base + "> " \
+          + "SELECT ?subObj ?property ?objObj " \
+          + "WHERE { " \
+          + "?subObj ?property ?objObj . " \
+          + img_uri + hasobject_prop_uri + "?subObj . " \
+          + img_uri + hasobject_prop_uri + "?objObj . " \
+          + img_uri + label_prop_uri + img_label_uri + " . " \
+          + "FILTER ( ?subObj != ?objObj ) " \
+          + " }"
+
     return query
 
 
+#%% streaming RDF export
+
+# Rather than loading the triples for the VR annotations into an RDFLib KG,
+# the functions below serialise them, as N-Triples ('nt') or Turtle
+# ('ttl'), to a file or pipe, for bulk loading into a triplestore. The
+# triples are generated (see generate_triples_for_images()) and written
+# a chunk of images at a time, so the full set of triples is never held
+# in memory.
+
+# the namespace prefixes used in Turtle output
+rdf_export_prefixes = [('rdf', str(RDF)), ('rdfs', str(RDFS)),
+                       ('owl', str(OWL)), ('xsd', str(XSD)),
+                       (prefix.rstrip(':'), url_base)]
+
+
+def get_RDF_term_formatter(rdf_format):
+    '''
+    Return a function that formats an RDFLib term (URIRef or Literal) as
+    N-Triples ('nt') or Turtle ('ttl') text, caching the text of each
+    term it formats; the cache can be cleared with the function's
+    'clear' attribute.
+    '''
+
+    if not rdf_format in ['nt', 'ttl']:
+        raise ValueError('RDF format not recognised')
+
+    cache = {}
+
+    def format_term(term):
+        text = cache.get(term)
+        if text is not None:
+            return text
+        if isinstance(term, URIRef):
+            # work with the plain string, as concatenating a URIRef makes
+            # a new (validated) URIRef
+            uri = str(term)
+            text = '<' + uri + '>'
+            if rdf_format == 'ttl':
+                for pfx, namespace in rdf_export_prefixes:
+                    if uri.startswith(namespace):
+                        local_name = uri[len(namespace):]
+                        if local_name.isalnum():
+                            text = pfx + ':' + local_name
+                        break
+        else:
+            text = term.n3()
+        cache[term] = text
+        return text
+
+    format_term.clear = cache.clear
+
+    return format_term
+
+
+def write_VR_annotations_as_triples(destination, img_names, vrd_anno,
+                                    ontoClassNames, ontoPropNames,
+                                    rdf_format='nt', chunk_size=1000,
+                                    id_allocator=None):
+    '''
+    Serialise the RDF triples for the VR annotations of a sequence of VRD
+    images (the same triples that load_image_annotations_into_kg() adds to
+    a KG) as N-Triples or Turtle.
+
+    Parameters:
+        destination : string (the path of the file to write), or a text
+                      file object (e.g. sys.stdout, or a pipe)
+        img_names : list - of VRD image filenames
+        vrd_anno : dictionary - the NeSy4VRD VR annotations
+        ontoClassNames : list - ordered list of ontology class names
+        ontoPropNames : list - ordered list of ontology property names
+        rdf_format : string - 'nt' (N-Triples) or 'ttl' (Turtle)
+        chunk_size : integer - the number of images per write
+        id_allocator : IdAllocator - allocates the ids of the individuals
+                       (if None, the default allocator is used)
+
+    Returns:
+        kg_vrd_img_ids, objects_per_image, vrd_img_vr_cnts,
+        image_triple_cnts : as for load_image_annotations_into_kg()
+    '''
+
+    format_term = get_RDF_term_formatter(rdf_format)
+
+    kg_vrd_img_ids = []
+    objects_per_image = []
+    vrd_img_vr_cnts = []
+    image_triple_cnts = []
+
+    if isinstance(destination, str):
+        fp = open(destination, 'w', encoding='utf-8', buffering=1 << 20)
+    else:
+        fp = destination
+
+    try:
+        if rdf_format == 'ttl':
+            for pfx, namespace in rdf_export_prefixes:
+                fp.write(f'@prefix {pfx}: <{namespace}> .\n')
+            fp.write('\n')
+
+        for start in range(0, len(img_names), chunk_size):
+            triples = generate_triples_for_images(img_names[start:start+chunk_size],
+                                                  vrd_anno, ontoClassNames,
+                                                  ontoPropNames, kg_vrd_img_ids,
+                                                  objects_per_image,
+                                                  vrd_img_vr_cnts,
+                                                  image_triple_cnts,
+                                                  id_allocator)
+            fp.write(''.join([format_term(s) + ' ' + format_term(p) + ' ' +
+                              format_term(o) + ' .\n' for s, p, o in triples]))
+            # the cache holds the terms of the chunk's individuals, too
+            format_term.clear()
+    finally:
+        if isinstance(destination, str):
+            fp.close()
+
+    return kg_vrd_img_ids, objects_per_image, vrd_img_vr_cnts, image_triple_cnts
+
+
+#%% batched KG extraction
+
+# Rather than assembling, parsing and executing a separate SPARQL query
+# for each image (see assemble_SPARQL_query()), the functions below
+# extract the VR-related triples of all images in a single pass, either by
+# walking the KG's triple indexes directly ('triples' method) or by
+# executing a single, prepared (parsed once) SPARQL query with the image
+# bound via initBindings ('sparql' method). Both methods return the same
+# rows as the per-image query.
+
+# A row of the result of extracting the VR-related triples of an image;
+# the field names match the variable names of the SPARQL query, so a row
+# can be used in place of a row of a SPARQL query result set.
+VRTripleRow = namedtuple('VRTripleRow', ['subObj', 'property', 'objObj'])
+
+
+@lru_cache(maxsize=None)
+def get_prepared_VR_query():
+    '''
+    Return the prepared (parsed once) SPARQL query for extracting the
+    VR-related triples of an image; variables ?img (the URIRef of the
+    image) and ?label (its rdfs:label Literal) are bound when the query is
+    executed.
+    '''
+
+    query = "SELECT ?subObj ?property ?objObj " \
+          + "WHERE { " \
+          + "?subObj ?property ?objObj . " \
+          + "?img vrd:hasObject ?subObj . " \
+          + "?img vrd:hasObject ?objObj . " \
+          + "?img rdfs:label ?label . " \
+          + "FILTER ( ?subObj != ?objObj ) " \
+          + " }"
+
+    return prepareQuery(query, initNs={'vrd': url_base, 'rdfs': RDFS})
+
+
+def get_VR_triples_for_image(kg, imname, image_id):
+    '''
+    Get the VR-related triples of an image by walking the triple indexes
+    of an RDFLib KG directly.
+
+    Returns:
+        rows : list - of VRTripleRow, one per (subObj, property, objObj)
+               triple linking two different objects of the image
+    '''
+
+    image_uriref = URIRef(url_base + image_id)
+
+    label = Literal(imname, datatype=XSD.string)
+    if not (image_uriref, RDFS.label, label) in kg:
+        return []
+
+    image_objects = set(kg.objects(image_uriref, get_vrd_uriref('hasObject')))
+
+    rows = []
+    for sub_obj in image_objects:
+        for property_uriref, obj_obj in kg.predicate_objects(sub_obj):
+            if obj_obj in image_objects and obj_obj != sub_obj:
+                rows.append(VRTripleRow(sub_obj, property_uriref, obj_obj))
 
+    return rows
 
 
+def iter_VR_triples_for_images(kg, img_names, kg_img_ids, method='triples'):
+    '''
+    Extract the VR-related triples of a sequence of images from an RDFLib
+    KG, grouped by image.
+
+    Parameters:
+        kg : rdflib.Graph - the KG
+        img_names : list - of VRD image filenames
+        kg_img_ids : list - the id of each image in the KG (with positional
+                     correspondence with 'img_names')
+        method : string - 'triples' (walk the triple indexes) or 'sparql'
+                 (execute the prepared SPARQL query)
+
+    Returns:
+        a generator of (imname, rows) tuples, in the order of 'img_names',
+        where 'rows' is a list of rows with attributes 'subObj', 'property'
+        and 'objObj'
+    '''
+
+    if not method in ['triples', 'sparql']:
+        raise ValueError('extraction method not recognised')
+
+    if method == 'sparql':
+        query = get_prepared_VR_query()
+
+    for imname, image_id in zip(img_names, kg_img_ids):
+        if method == 'triples':
+            rows = get_VR_triples_for_image(kg, imname, image_id)
+        else:
+            bindings = {'img': URIRef(url_base + image_id),
+                        'label': Literal(imname, datatype=XSD.string)}
+            rows = list(kg.query(query, initBindings=bindings))
+        yield imname, rows
+
+
+#%% conversion of extracted triples back to VR annotations
+
+def convert_VR_triples_to_annotations(imname, rows, image_objects,
+                                      ontoPropNames):
+    '''
+    Convert the VR-related triples extracted from a KG for an image back
+    into NeSy4VRD VR annotations (as in load_and_augment.py).
+
+    Parameters:
+        imname : string - the filename of the VRD image
+        rows : list - of rows with attributes 'subObj', 'property' and
+               'objObj'
+        image_objects : dictionary - the 'image_objects' dictionary of the
+                        image (see load_and_augment.py)
+        ontoPropNames : OntologyNames - ordered list of ontology property
+                        names
+
+    Returns:
+        imanno_aug : list of dictionaries (the VR annotations)
+    '''
+
+    if not isinstance(ontoPropNames, OntologyNames):
+        ontoPropNames = OntologyNames(ontoPropNames)
+
+    # objects are looked up by the identity of their URIRefs
+    inverted_image_objects = { v[1]: [k, v[2]] for k, v in image_objects.items() }
+
+    imanno_aug = []
+
+    for row in rows:
+
+        if row.subObj == row.objObj:
+            raise ValueError(f'subObj same as objObj on image f{imname}')
+
+        prd_idx = ontoPropNames.get_id(row.property)
+
+        sub_bbox, sub_idx = inverted_image_objects[row.subObj]
+
+        obj_bbox, obj_idx = inverted_image_objects[row.objObj]
+
+        vr = {'predicate': prd_idx,
+              'object': {'category': obj_idx, 'bbox': list(obj_bbox)},
+              'subject': {'category': sub_idx, 'bbox': list(sub_bbox)}}
+
+        imanno_aug.append(vr)
+
+    return imanno_aug
+
+
+#%% TBox cache
+
+# Every KG built to augment VR annotations starts from the same VRD-World
+# ontology (the TBox), which must be parsed and whose own OWL RL closure is
+# re-derived whenever the KG is materialised. The functions below cache the
+# parsed and pre-materialised TBox triples, on disk (in a JSON cache file
+# in the cache directory alongside the ontology file, keyed by a hash of
+# the ontology file's content) and in memory, so that a new KG can be seeded with them
+# instantly. Since materialisation is monotone, materialising a KG seeded
+# with the pre-materialised TBox yields the same KG as materialising one
+# seeded with the parsed ontology.
+
+tbox_cache_format_version = 2
+
+# in-memory cache; a cache key maps to the list of TBox triples
+tbox_cache = {}
+
+
+def materialise_KG(kg):
+    '''
+    Expand (materialise) a KG with OWLRL, in the configuration used for
+    augmenting VR annotations.
+    '''
+
+    from owlrl import DeductiveClosure, OWLRL_Semantics
+
+    dc = DeductiveClosure(OWLRL_Semantics,
+                          rdfs_closure = False,
+                          axiomatic_triples = False,
+                          datatype_axioms = False)
+    dc.expand(kg)
+
+    return kg
+
+
+def get_TBox_cache_key(ontology_bytes, ontology_format):
+
+    config = json.dumps([tbox_cache_format_version, ontology_format])
+
+    sha = hashlib.sha256()
+    sha.update(ontology_bytes)
+    sha.update(config.encode('utf-8'))
+
+    return sha.hexdigest()
+
+
+def encode_RDF_term(term):
+    '''
+    Encode an RDFLib term (URIRef, BNode or Literal) as a JSON-serialisable
+    list.
+    '''
+
+    if isinstance(term, URIRef):
+        return ['u', str(term)]
+    if isinstance(term, BNode):
+        return ['b', str(term)]
+    datatype = None if term.datatype is None else str(term.datatype)
+    return ['l', str(term), datatype, term.language]
+
+
+def decode_RDF_term(data):
+    '''
+    Decode an RDFLib term encoded by encode_RDF_term().
+    '''
+
+    if data[0] == 'u':
+        return URIRef(data[1])
+    if data[0] == 'b':
+        return BNode(data[1])
+    datatype = None if data[2] is None else URIRef(data[2])
+    return Literal(data[1], datatype=datatype, lang=data[3])
+
+
+def load_TBox_triples(ontology_path, ontology_format='ttl', cache_path=None):
+    '''
+    Get the triples of the materialised TBox of an ontology, from the
+    in-memory cache, the on-disk cache, or (if neither is up to date) by
+    parsing and materialising the ontology (and saving the result to the
+    caches).
+
+    Parameters:
+        ontology_path : string - path to the ontology file
+        cache_path : string - path of the cache file; by default, a file
+                     in the cache directory alongside the ontology file
+                     (see nesy4vrd_utils.get_cache_path()) named after the
+                     ontology file, with '.tbox.json' appended
+
+    Returns:
+        triples : list - of RDF triples in the RDFLib format
+    '''
+
+    from rdflib import Graph
+
+    if cache_path is None:
+        cache_path = vrdu.get_cache_path(ontology_path, '.tbox.json')
+
+    with open(ontology_path, 'rb') as fp:
+        ontology_bytes = fp.read()
+
+    key = get_TBox_cache_key(ontology_bytes, ontology_format)
+
+    if key in tbox_cache:
+        return tbox_cache[key]
+
+    # the header is checked before the cached triples are decoded
+    header = {'format_version': tbox_cache_format_version, 'key': key}
+    data = vrdu.read_cache_file(cache_path, header)
+    if data is not None:
+        terms = [decode_RDF_term(term) for term in data['terms']]
+        triples = [(terms[s], terms[p], terms[o]) for s, p, o in data['triples']]
+        tbox_cache[key] = triples
+        return triples
+
+    tbox = Graph()
+    tbox.parse(data=ontology_bytes, format=ontology_format)
+    materialise_KG(tbox)
+    triples = list(tbox)
+
+    # each distinct term is saved once; a triple is saved as the positions
+    # of its terms in the list of distinct terms
+    term_idx = {}
+    for triple in triples:
+        for term in triple:
+            term_idx.setdefault(term, len(term_idx))
+    vrdu.write_cache_file(cache_path, header,
+                          {'terms': [encode_RDF_term(term) for term in term_idx],
+                           'triples': [[term_idx[term] for term in triple]
+                                       for triple in triples]})
+
+    tbox_cache[key] = triples
+
+    return triples
+
+
+def add_TBox_to_KG(kg, ontology_path, ontology_format='ttl', cache_path=None):
+    '''
+    Seed a KG with the triples of the materialised TBox of an ontology
+    (see load_TBox_triples()), and bind the ontology's namespace prefix.
+    '''
+
+    triples = load_TBox_triples(ontology_path, ontology_format, cache_path)
+
+    kg.addN((s, p, o, kg) for s, p, o in triples)
+    kg.bind(prefix.rstrip(':'), url_base)
+
+    return kg
+
+
+#%% partitioned materialisation
+
+# Inferences about the VRs of VRD images never cross image boundaries, so
+# the images can be augmented in independent batches: a small KG is built
+# for each batch, holding the ontology TBox plus the VR triples of the
+# batch's images, and is materialised and queried on its own. The batches
+# are processed in a pool of worker processes, and at most a few batches
+# are in flight at any time, so peak memory is bounded by the batch size
+# rather than by the size of the dataset.
+
+def augment_image_batch(img_names, vrd_anno, ontology_path, ontoClassNames,
+                        ontoPropNames, ontology_format='ttl',
+                        tbox_cache_path=None):
+    '''
+    Augment the VR annotations of a batch of images by materialising a KG
+    holding the ontology and the VR triples of those images only.
+
+    Parameters:
+        img_names : list - of VRD image filenames
+        vrd_anno : dictionary - VR annotations (for at least the images in
+                   'img_names')
+        ontology_path : string - path to the VRD-World ontology file
+        tbox_cache_path : string - path of the TBox cache file (see
+                          load_TBox_triples())
+
+    Returns:
+        vrd_anno_augmented : dictionary - the augmented VR annotations of
+                             the images, in the order of 'img_names'
+    '''
+
+    from rdflib import Graph
+
+    kg = Graph()
+    add_TBox_to_KG(kg, ontology_path, ontology_format, tbox_cache_path)
+
+    id_allocator = IdAllocator(len(ontoClassNames))
+    results = load_image_annotations_into_kg(kg, img_names, vrd_anno,
+                                             ontoClassNames, ontoPropNames,
+                                             id_allocator=id_allocator)
+    kg_img_ids, objects_per_image, _, _ = results
+
+    materialise_KG(kg)
+
+    vrd_anno_augmented = {}
+    vr_triples_per_image = iter_VR_triples_for_images(kg, img_names, kg_img_ids)
+    for idx, (imname, rows) in enumerate(vr_triples_per_image):
+        imanno_aug = convert_VR_triples_to_annotations(imname, rows,
+                                                       objects_per_image[idx],
+                                                       ontoPropNames)
+        vrd_anno_augmented[imname] = imanno_aug
+
+    return vrd_anno_augmented
+
+
+def augment_VR_annotations_partitioned(vrd_anno, img_names, ontology_path,
+                                       ontoClassNames, ontoPropNames,
+                                       batch_size=100, n_workers=None,
+                                       ontology_format='ttl',
+                                       tbox_cache_path=None):
+    '''
+    Augment the VR annotations of a set of images by partitioned
+    materialisation: the images are processed in independent batches (see
+    augment_image_batch()), in a pool of worker processes.
+
+    Parameters:
+        vrd_anno : dictionary - the NeSy4VRD VR annotations
+        img_names : list - of the VRD image filenames to augment
+        ontology_path : string - path to the VRD-World ontology file
+        batch_size : integer - the number of images per batch
+        n_workers : integer, or None - the number of worker processes;
+                    1 means process the batches serially; None means use
+                    all available CPUs
+        tbox_cache_path : string - path of the TBox cache file (see
+                          load_TBox_triples())
+
+    Returns:
+        vrd_anno_augmented : dictionary - the augmented VR annotations, in
+                             the order of 'img_names'
+    '''
+
+    batches = [img_names[idx:idx+batch_size]
+               for idx in range(0, len(img_names), batch_size)]
+
+    def get_batch_args(batch):
+        batch_anno = {imname: vrd_anno[imname] for imname in batch}
+        return (batch, batch_anno, ontology_path, ontoClassNames,
+                ontoPropNames, ontology_format, tbox_cache_path)
+
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+
+    # worker processes are forked; where fork is unavailable (e.g. Windows),
+    # the calling script could not safely be re-imported by spawned workers
+    if not 'fork' in multiprocessing.get_all_start_methods():
+        n_workers = 1
+
+    n_workers = max(1, min(n_workers, len(batches)))
+
+    # load the TBox once, here, so that forked workers inherit it
+    load_TBox_triples(ontology_path, ontology_format, tbox_cache_path)
+
+    vrd_anno_augmented = {}
+
+    if n_workers == 1:
+        for batch in batches:
+            vrd_anno_augmented.update(augment_image_batch(*get_batch_args(batch)))
+        return vrd_anno_augmented
+
+    # keep only a bounded number of batches in flight, and merge their
+    # results in batch order as they complete
+    max_in_flight = 2 * n_workers
+    mp_context = multiprocessing.get_context('fork')
+    with ProcessPoolExecutor(max_workers=n_workers,
+                             mp_context=mp_context) as executor:
+        in_flight = deque()
+        for batch in batches:
+            if len(in_flight) == max_in_flight:
+                vrd_anno_augmented.update(in_flight.popleft().result())
+            in_flight.append(executor.submit(augment_image_batch,
+                                             *get_batch_args(batch)))
+        while in_flight:
+            vrd_anno_augmented.update(in_flight.popleft().result())
+
+    return vrd_anno_augmented
+
+
+#%% incremental augmentation
+
+# When only some images' VR annotations have changed since the augmented
+# VR annotations were last produced, only those images need augmenting
+# again. A manifest file, saved alongside the augmented annotations file,
+# records a content hash of the (unaugmented) VR annotations of each image
+# and a hash of the ontology and names against which they were augmented.
+
+incremental_manifest_format_version = 1
+
+
+def save_json_file(data, path):
+    '''
+    Save data to a .json file, writing to a temporary file first and then
+    moving it into place, so that an interrupted save never leaves a
+    partially written file behind.
+    '''
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as fp:
+        json.dump(data, fp)
+    os.replace(tmp_path, path)
+
+    return None
+
+
+def get_image_annotations_hash(imanno):
+    '''
+    Return a hash of the content of the VR annotations of an image.
+    '''
+
+    text = json.dumps(imanno, sort_keys=True, separators=(',', ':'))
+
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def get_augmentation_key(ontology_path, ontoClassNames, ontoPropNames,
+                         ontology_format='ttl'):
+    '''
+    Return a hash of everything, other than the VR annotations themselves,
+    on which the augmented VR annotations depend.
+    '''
+
+    with open(ontology_path, 'rb') as fp:
+        ontology_bytes = fp.read()
+
+    names = json.dumps([incremental_manifest_format_version,
+                        ontoClassNames, ontoPropNames])
+
+    sha = hashlib.sha256()
+    sha.update(get_TBox_cache_key(ontology_bytes, ontology_format).encode('utf-8'))
+    sha.update(names.encode('utf-8'))
+
+    return sha.hexdigest()
+
+
+def augment_VR_annotations_incremental(vrd_anno, img_names, ontology_path,
+                                       ontoClassNames, ontoPropNames,
+                                       augmented_path, manifest_path=None,
+                                       batch_size=100, n_workers=None,
+                                       ontology_format='ttl',
+                                       tbox_cache_path=None):
+    '''
+    Augment the VR annotations of a set of images incrementally: only the
+    images whose VR annotations have changed since the augmented VR
+    annotations file was last saved (or that are new) are augmented again
+    (by partitioned materialisation); the augmented VR annotations of the
+    others are taken from that file. The augmented VR annotations file and
+    its manifest are then saved.
+
+    If the manifest is missing, or the ontology or the names have changed,
+    all of the images are augmented.
+
+    Parameters:
+        vrd_anno : dictionary - the NeSy4VRD VR annotations
+        img_names : list - of the VRD image filenames to augment
+        ontology_path : string - path to the VRD-World ontology file
+        augmented_path : string - path to the augmented VR annotations file
+        manifest_path : string - path to the manifest file; by default, the
+                        augmented VR annotations file path with
+                        '.manifest.json' appended
+        tbox_cache_path : string - path of the TBox cache file (see
+                          load_TBox_triples())
+
+    Returns:
+        vrd_anno_augmented : dictionary - the augmented VR annotations, in
+                             the order of 'img_names'
+        changed_img_names : list - the names of the images augmented again
+    '''
+
+    if manifest_path is None:
+        manifest_path = augmented_path + '.manifest.json'
+
+    key = get_augmentation_key(ontology_path, ontoClassNames, ontoPropNames,
+                               ontology_format)
+
+    image_hashes = {imname: get_image_annotations_hash(vrd_anno[imname])
+                    for imname in img_names}
+
+    # a manifest or augmented VR annotations file that cannot be decoded
+    # is treated as if there were no previous run
+    previous_hashes = {}
+    previous_augmented = {}
+    if os.path.exists(manifest_path) and os.path.exists(augmented_path):
+        try:
+            with open(manifest_path, 'r') as fp:
+                manifest = json.load(fp)
+            if manifest['key'] == key:
+                with open(augmented_path, 'r') as fp:
+                    previous_augmented = json.load(fp)
+                previous_hashes = manifest['image_hashes']
+        except (ValueError, KeyError, TypeError):
+            previous_hashes = {}
+            previous_augmented = {}
+
+    changed_img_names = [imname for imname in img_names
+                         if image_hashes[imname] != previous_hashes.get(imname) or
+                         not imname in previous_augmented]
+
+    changed_augmented = augment_VR_annotations_partitioned(vrd_anno,
+                                                           changed_img_names,
+                                                           ontology_path,
+                                                           ontoClassNames,
+                                                           ontoPropNames,
+                                                           batch_size,
+                                                           n_workers,
+                                                           ontology_format,
+                                                           tbox_cache_path)
+
+    vrd_anno_augmented = {}
+    for imname in img_names:
+        if imname in changed_augmented:
+            vrd_anno_augmented[imname] = changed_augmented[imname]
+        else:
+            vrd_anno_augmented[imname] = previous_augmented[imname]
+
+    # each file is replaced whole, and the manifest is saved last; if a run
+    # is interrupted between the two saves, the previous manifest is kept,
+    # and the images changed since the previous run are augmented again
+    save_json_file(vrd_anno_augmented, augmented_path)
+    manifest = {'key': key, 'image_hashes': image_hashes}
+    save_json_file(manifest, manifest_path)
+
+    return vrd_anno_augmented, changed_img_names
@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: David Herron
+"""
+
+'''
+This module is a native Python reasoner for augmenting NeSy4VRD visual
+relationship (VR) annotations with the VRs entailed by the object property
+axioms of the NeSy4VRD OWL ontology, VRD-World.
+
+The only inferences of OWL reasoning over a VRD-World knowledge graph (KG)
+that are used when augmenting VR annotations (see load_and_augment.py) are
+new object property links between pairs of objects of the same image.
+Those links are entailed by the following object property axioms (the
+corresponding OWL 2 RL rules are given in brackets):
+* rdfs:subPropertyOf (prp-spo1) and owl:equivalentProperty (prp-eqp1/2)
+* owl:inverseOf (prp-inv1/2)
+* owl:SymmetricProperty (prp-symp)
+* owl:TransitiveProperty (prp-trp)
+* owl:propertyChainAxiom (prp-spo2)
+
+Rather than loading the VRs into an RDF KG and materialising the whole KG,
+this module:
+1) compiles those axioms, once, from the ontology into integer rule
+   tables indexed by property id, where the ids of the VRD-World object
+   properties that correspond to NeSy4VRD predicates are the NeSy4VRD
+   predicate indices, and
+2) applies the rule tables to the VRs of each image, represented as a
+   boolean (property, subject object, object object) array, by vectorised
+   forward chaining to a fixpoint.
+
+The augmented VRs are the same as those produced by OWLRL materialisation
+of the KG and extraction of the VR-related triples of each image: objects
+are identified by their bboxes (the first class annotated for a bbox being
+the class of the object), and duplicate VRs are merged.
+
+DEPENDENCIES:
+This module has dependencies on Python packages:
+    NumPy
+    RDFLib (for compiling the rule tables only)
+'''
+
+#%%
+
+from collections import namedtuple
+
+import numpy as np
+
+import sys
+sys.path.insert(0, '../extensibility/analysis')
+
+import nesy4vrd_scene_graph as vrdsg
+
+
+#%%
+
+# The object property axioms of an ontology, compiled into integer rule
+# tables. P is the number of properties.
+#   prop_names : list of strings (the ontology object property names, the
+#                first n_predicates of which correspond to the NeSy4VRD
+#                predicates, in order)
+#   n_predicates : integer
+#   sup : P x P boolean array; sup[p, q] is True if p is a (reflexive,
+#         transitive) subproperty of q
+#   inv : P x P boolean array; inv[p, q] is True if p is an inverse of q
+#   sym_ids : array of integers (the ids of the symmetric properties)
+#   trans_ids : array of integers (the ids of the transitive properties)
+#   chains : list of (tuple of integers, integer) tuples; a property chain
+#            (p1, ..., pn) and the id of the property it implies
+#   has_object_id : integer, or None (the id of property 'hasObject', if
+#                   any rule involves it)
+#   source_image_id : integer, or None (the id of property 'sourceImage',
+#                     if any rule involves it)
+VRRuleTables = namedtuple('VRRuleTables',
+                          ['prop_names', 'n_predicates', 'sup', 'inv',
+                           'sym_ids', 'trans_ids', 'chains',
+                           'has_object_id', 'source_image_id'])
+
+
+def compile_VR_rule_tables(ontology_path, ontoPropNames, url_base,
+                           ontology_format='ttl'):
+    '''
+    Compile the object property axioms of an OWL ontology into integer
+    rule tables.
+
+    Parameters:
+        ontology_path : string - path to the ontology file
+        ontoPropNames : list - of ontology object property names, with
+                        positional correspondence with the NeSy4VRD
+                        predicate names
+        url_base : string - the base URL of the ontology's names
+
+    Returns:
+        rule_tables : VRRuleTables
+    '''
+
+    from rdflib import Graph, URIRef
+    from rdflib.collection import Collection
+    from rdflib.namespace import RDF, RDFS, OWL
+
+    tbox = Graph()
+    tbox.parse(ontology_path, format=ontology_format)
+
+    prop_names = list(ontoPropNames)
+    prop_ids = {name: idx for idx, name in enumerate(prop_names)}
+
+    def get_prop_id(uri):
+        # properties that are not NeSy4VRD predicates, but through which
+        # links may be inferred, are given ids after the predicates
+        if not isinstance(uri, URIRef) or not str(uri).startswith(url_base):
+            return None
+        name = str(uri)[len(url_base):]
+        if not name in prop_ids:
+            prop_ids[name] = len(prop_names)
+            prop_names.append(name)
+        return prop_ids[name]
+
+    sub_pairs = []
+    for p, q in tbox.subject_objects(RDFS.subPropertyOf):
+        sub_pairs.append((get_prop_id(p), get_prop_id(q)))
+    for p, q in tbox.subject_objects(OWL.equivalentProperty):
+        sub_pairs.append((get_prop_id(p), get_prop_id(q)))
+        sub_pairs.append((get_prop_id(q), get_prop_id(p)))
+
+    inv_pairs = []
+    for p, q in tbox.subject_objects(OWL.inverseOf):
+        inv_pairs.append((get_prop_id(p), get_prop_id(q)))
+
+    sym_ids = [get_prop_id(p) for p in tbox.subjects(RDF.type, OWL.SymmetricProperty)]
+    trans_ids = [get_prop_id(p) for p in tbox.subjects(RDF.type, OWL.TransitiveProperty)]
+
+    chains = []
+    for q, chain_list in tbox.subject_objects(OWL.propertyChainAxiom):
+        chain = tuple(get_prop_id(p) for p in Collection(tbox, chain_list))
+        chains.append((chain, get_prop_id(q)))
+
+    # axioms involving property expressions other than named properties
+    # of the ontology are ignored
+    sub_pairs = [pair for pair in sub_pairs if not None in pair]
+    inv_pairs = [pair for pair in inv_pairs if not None in pair]
+    sym_ids = [p for p in sym_ids if p is not None]
+    trans_ids = [p for p in trans_ids if p is not None]
+    chains = [(chain, q) for chain, q in chains
+              if q is not None and len(chain) > 0 and not None in chain]
+
+    n_props = len(prop_names)
+
+    # the reflexive, transitive closure of the subproperty relation
+    sup = np.eye(n_props, dtype=bool)
+    for p, q in sub_pairs:
+        sup[p, q] = True
+    while True:
+        new_sup = np.matmul(sup, sup)
+        if np.array_equal(new_sup, sup):
+            break
+        sup = new_sup
+
+    inv = np.zeros((n_props, n_props), dtype=bool)
+    for p, q in inv_pairs:
+        inv[p, q] = True
+        inv[q, p] = True
+
+    # the image-level properties matter only if some rule involves them
+    used_ids = set(p for pair in sub_pairs + inv_pairs for p in pair)
+    used_ids.update(sym_ids, trans_ids, *[chain for chain, _ in chains])
+    has_object_id = prop_ids.get('hasObject')
+    if not has_object_id in used_ids:
+        has_object_id = None
+    source_image_id = prop_ids.get('sourceImage')
+    if not source_image_id in used_ids:
+        source_image_id = None
+
+    return VRRuleTables(prop_names, len(ontoPropNames), sup, inv,
+                        np.array(sorted(set(sym_ids)), dtype=int),
+                        np.array(sorted(set(trans_ids)), dtype=int),
+                        chains, has_object_id, source_image_id)
+
+
+#%%
+
+def get_image_objects(imanno):
+    '''
+    Identify the distinct objects of an image by their bboxes.
+
+    Returns:
+        bboxes : list of tuples (the bbox of each object, in order of first
+                 appearance)
+        classes : list of integers (the class of each object; the first
+                  class annotated for the bbox)
+        vr_nodes : integer array of shape (n_vrs, 3) - the (subject object,
+                   predicate, object object) of each VR, with objects given
+                   by their positions in 'bboxes'
+    '''
+
+    object_positions = {}
+    bboxes = []
+    classes = []
+    vr_nodes = np.zeros((len(imanno), 3), dtype=int)
+
+    for vr_idx, vr in enumerate(imanno):
+        for col, role in ((0, 'subject'), (2, 'object')):
+            bbox = tuple(vr[role]['bbox'])
+            if not bbox in object_positions:
+                object_positions[bbox] = len(bboxes)
+                bboxes.append(bbox)
+                classes.append(vr[role]['category'])
+            vr_nodes[vr_idx, col] = object_positions[bbox]
+        vr_nodes[vr_idx, 1] = vr['predicate']
+
+    return bboxes, classes, vr_nodes
+
+
+def infer_links(links, rule_tables):
+    '''
+    Apply the rule tables to a set of links between the nodes of an image,
+    by forward chaining to a fixpoint.
+
+    Parameters:
+        links : P x N x N boolean array; links[p, i, j] is True if node i
+                is linked to node j by property p (changed in place)
+        rule_tables : VRRuleTables
+
+    Returns:
+        links : P x N x N boolean array (the closure of the links)
+    '''
+
+    n_props, n_nodes, _ = links.shape
+    sup_t = rule_tables.sup.T.astype(np.uint8)
+    inv_t = rule_tables.inv.T.astype(np.uint8)
+    sym_ids = rule_tables.sym_ids
+    trans_ids = rule_tables.trans_ids
+
+    n_links = np.count_nonzero(links)
+
+    while True:
+
+        # subproperties and equivalent properties
+        flat = links.reshape(n_props, -1).astype(np.uint8)
+        links = (sup_t @ flat > 0).reshape(n_props, n_nodes, n_nodes)
+
+        # inverse properties
+        flat = links.transpose(0, 2, 1).reshape(n_props, -1).astype(np.uint8)
+        links |= (inv_t @ flat > 0).reshape(n_props, n_nodes, n_nodes)
+
+        # symmetric properties
+        if len(sym_ids) > 0:
+            links[sym_ids] |= links[sym_ids].transpose(0, 2, 1)
+
+        # transitive properties
+        if len(trans_ids) > 0:
+            trans_links = links[trans_ids]
+            while True:
+                new_trans_links = trans_links | np.matmul(trans_links, trans_links)
+                if np.array_equal(new_trans_links, trans_links):
+                    break
+                trans_links = new_trans_links
+            links[trans_ids] = trans_links
+
+        # property chains
+        for chain, q in rule_tables.chains:
+            chain_links = links[chain[0]]
+            for p in chain[1:]:
+                chain_links = np.matmul(chain_links, links[p])
+            links[q] |= chain_links
+
+        new_n_links = np.count_nonzero(links)
+        if new_n_links == n_links:
+            break
+        n_links = new_n_links
+
+    return links
+
+
+def augment_image_VRs(imanno, rule_tables, imname=''):
+    '''
+    Augment the VRs of an image with all of the VRs entailed by the rule
+    tables.
+
+    Returns:
+        imanno_aug : list of dictionaries (the augmented VRs, ordered by
+                     'subject' object, predicate and 'object' object)
+    '''
+
+    bboxes, classes, vr_nodes = get_image_objects(imanno)
+
+    return augment_image_nodes(bboxes, classes, vr_nodes, rule_tables, imname)
+
+
+def augment_image_nodes(bboxes, classes, vr_nodes, rule_tables, imname=''):
+    '''
+    Augment the VRs of an image, given as the objects and VR nodes of the
+    image (see get_image_objects()), with all of the VRs entailed by the
+    rule tables.
+
+    Returns:
+        imanno_aug : list of dictionaries (as per augment_image_VRs())
+    '''
+
+    n_objects = len(bboxes)
+    n_props = len(rule_tables.prop_names)
+
+    # the image itself is a node only if some rule involves the links
+    # between the image and its objects
+    image_node = rule_tables.has_object_id is not None or \
+                 rule_tables.source_image_id is not None
+    n_nodes = n_objects + 1 if image_node else n_objects
+
+    links = np.zeros((n_props, n_nodes, n_nodes), dtype=bool)
+    links[vr_nodes[:, 1], vr_nodes[:, 0], vr_nodes[:, 2]] = True
+    if rule_tables.has_object_id is not None:
+        links[rule_tables.has_object_id, n_objects, :n_objects] = True
+    if rule_tables.source_image_id is not None:
+        links[rule_tables.source_image_id, :n_objects, n_objects] = True
+
+    links = infer_links(links, rule_tables)
+
+    # only links between two different objects are VRs
+    object_links = links[:, :n_objects, :n_objects].copy()
+    object_links[:, np.arange(n_objects), np.arange(n_objects)] = False
+
+    n_predicates = rule_tables.n_predicates
+    if object_links[n_predicates:].any():
+        prop_idx = n_predicates + np.argwhere(object_links[n_predicates:])[0, 0]
+        prop_name = rule_tables.prop_names[prop_idx]
+        raise ValueError(f"inferred property '{prop_name}' is not a NeSy4VRD predicate; image {imname}")
+
+    imanno_aug = []
+    for sub_node, prd_idx, obj_node in np.argwhere(object_links.transpose(1, 0, 2)):
+        vr = {'predicate': int(prd_idx),
+              'object': {'category': classes[obj_node],
+                         'bbox': list(bboxes[obj_node])},
+              'subject': {'category': classes[sub_node],
+                          'bbox': list(bboxes[sub_node])}}
+        imanno_aug.append(vr)
+
+    return imanno_aug
+
+
+def augment_VR_annotations(vrd_anno, rule_tables, img_names=None):
+    '''
+    Augment the VRs of a set of images with all of the VRs entailed by the
+    rule tables.
+
+    Parameters:
+        vrd_anno : dictionary - the NeSy4VRD VR annotations
+        rule_tables : VRRuleTables
+        img_names : list - of the image names to augment (if None, all)
+
+    Returns:
+        vrd_anno_augmented : dictionary - the augmented VR annotations
+    '''
+
+    if img_names is None:
+        img_names = list(vrd_anno.keys())
+
+    # identify the objects of every image, by their bboxes, in one pass
+    scene_graph = vrdsg.get_scene_graph(img_names, vrd_anno)
+
+    vrd_anno_augmented = {}
+    for imname in img_names:
+        bboxes, classes, vr_nodes = scene_graph.get_image_nodes(imname)
+        vrd_anno_augmented[imname] = augment_image_nodes(bboxes, classes,
+                                                         vr_nodes, rule_tables,
+                                                         imname)
+
+    return vrd_anno_augmented